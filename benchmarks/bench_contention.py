@@ -0,0 +1,94 @@
+"""
+Benchmark of concurrent subscriptions to a single hot event.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from common.server_handler import CombinedHandler  # noqa: E402
+from common.subscription_combiner import SubscriptionCombiner  # noqa: E402
+
+
+# ----- Functions ----- #
+
+def create_database(path: str, users: int) -> tuple[str, list[str]]:
+    """
+    Create a database with one event and the given number of users.
+    :return: Tuple of (event id, users ids).
+    """
+    handler = CombinedHandler(path, path)
+    host_id = handler.add_user("host", "host@mail.com", "password")
+    event_id = handler.add_event(host_id, "hot event", "Description", "Holon", [], datetime(2030, 1, 1))
+
+    # Skip the password hashing of add_user, it would dominate the setup.
+    users_ids = [f"user-{i}" for i in range(users)]
+    handler.users_handler.cursor.executemany(
+        "INSERT INTO users (user_id, user_name, user_mail, hashed_password) VALUES (?, ?, ?, '')",
+        [(user_id, user_id, f"{user_id}@mail.com") for user_id in users_ids])
+    handler.users_handler.conn.commit()
+    handler.close()
+    return event_id, users_ids
+
+
+def run(mode: str, users: int, threads: int) -> dict:
+    """
+    Subscribe all the users to the hot event concurrently.
+    :param mode: 'direct' for a handler per thread, 'combined' for the write combining queue.
+    :return: The results.
+    """
+    path = str(Path(tempfile.mkdtemp()) / "data.db")
+    event_id, users_ids = create_database(path, users)
+
+    local = threading.local()
+    combiner = SubscriptionCombiner(lambda: CombinedHandler(path, path))
+
+    def subscribe(user_id: str):
+        if mode == "combined":
+            combiner.add_subscriber(event_id, user_id)
+            return
+        if not hasattr(local, "handler"):
+            local.handler = CombinedHandler(path, path)
+        local.handler.add_subscriber_to_event(event_id, user_id)
+
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(subscribe, user_id) for user_id in users_ids]:
+            try:
+                future.result()
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    handler = CombinedHandler(path, path)
+    subscribers = handler.get_event(event_id).subscribers
+    handler.close()
+    lost = len(users_ids) - errors - (len(subscribers) - 1)  # The host is a subscriber as well.
+    return {"mode": mode, "seconds": elapsed, "per_second": users / elapsed, "errors": errors, "lost_updates": lost}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000, help="Number of concurrent subscriptions.")
+    parser.add_argument("--threads", type=int, default=32, help="Number of concurrent clients.")
+    args = parser.parse_args()
+
+    for mode in ("direct", "combined"):
+        result = run(mode, args.users, args.threads)
+        print(f"{result['mode']:>9}: {result['seconds']:.2f} s, {result['per_second']:.0f} subscriptions/s, "
+              f"{result['errors']} errors, {result['lost_updates']} lost updates")
+
+
+if __name__ == "__main__":
+    main()
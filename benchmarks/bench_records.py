@@ -0,0 +1,77 @@
+"""
+Benchmark of the memory and construction time of the Event records.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+import dataclasses
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from core.event import Event  # noqa: E402
+
+# ----- Constants ----- #
+
+# The same fields as Event, with a regular per instance __dict__.
+DictEvent = dataclasses.make_dataclass("DictEvent", [(field.name, field.type) for field in dataclasses.fields(Event)])
+
+
+# ----- Functions ----- #
+
+def build(cls, rows: int) -> list:
+    """
+    Build records the same way fetch_events does, one per row.
+    :param cls: The record class.
+    :param rows: Number of records.
+    :return: The records.
+    """
+    now = datetime(2030, 1, 1)
+    subscribers = ["user"]
+    return [cls(str(i), "user", "name", "description", "location", subscribers, now, now, now) for i in range(rows)]
+
+
+def measure(cls, rows: int) -> tuple[float, int]:
+    """
+    Measure the construction time and the peak memory of building the records.
+    :return: Tuple of (seconds, peak bytes).
+    """
+    gc.collect()
+    start = time.perf_counter()
+    records = build(cls, rows)
+    elapsed = time.perf_counter() - start
+    del records
+
+    gc.collect()
+    tracemalloc.start()
+    records = build(cls, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Number of records to build.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, cls in (("dict", DictEvent), ("slotted", Event)):
+        elapsed, peak = measure(cls, args.rows)
+        results[name] = (elapsed, peak)
+        print(f"{name:>8}: {elapsed:.2f} s, peak {peak / 2 ** 20:.0f} MiB for {args.rows} records")
+
+    print(f"  memory: -{(1 - results['slotted'][1] / results['dict'][1]) * 100:.0f}%, "
+          f"time: -{(1 - results['slotted'][0] / results['dict'][0]) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark of the events response serialization.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from core.event import Event  # noqa: E402
+from core.utils import to_json_bytes  # noqa: E402
+
+
+# ----- Functions ----- #
+
+def make_events(count: int) -> list[Event]:
+    """
+    Create events that look like a /events response.
+    :param count: Number of events.
+    :return: List of events.
+    """
+    start = datetime(2030, 1, 1)
+    return [Event(event_id=f"event-{i}",
+                  created_user_id=f"user-{i % 100}",
+                  event_name=f"Event {i}",
+                  event_description="Description " * 20,
+                  location=f"Location {i % 10}",
+                  subscribers=[f"User {j}" for j in range(i % 30)],
+                  event_start_time=start + timedelta(minutes=i),
+                  event_end_time=start + timedelta(minutes=i + 60),
+                  creation_time=start) for i in range(count)]
+
+
+def fastapi_path(events: list[Event]) -> bytes:
+    """
+    The default FastAPI path for a route without response model.
+    """
+    return json.dumps(jsonable_encoder(events), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=1000, help="Number of events in the response.")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of encodings to time.")
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    assert fastapi_path(events) == to_json_bytes(events)
+
+    results = {}
+    for name, encode in (("fastapi", fastapi_path), ("raw", to_json_bytes)):
+        best = min(timeit.repeat(lambda: encode(events), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:>8}: {best * 1000:.2f} ms per response of {args.events} events")
+    print(f" speedup: x{results['fastapi'] / results['raw']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Benchmark of the cold start of the API process: import, time to the first response and the first requests.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from common.server_handler import CombinedHandler  # noqa: E402
+
+# ----- Constants ----- #
+
+IMPORT_SCRIPT = "import time; start = time.perf_counter(); import remind_me_api; print(time.perf_counter() - start)"
+START_TIMEOUT = 30  # Seconds to wait for the first response.
+
+
+# ----- Functions ----- #
+
+def measure_import(runs: int) -> list[float]:
+    """
+    Import the API module in new processes.
+    :return: The import time of every run, in seconds.
+    """
+    env = dict(os.environ, PYTHONPATH=str(SRC_DIR))
+    return [float(subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=tempfile.mkdtemp(), env=env, check=True,
+                                 capture_output=True, text=True).stdout) for _ in range(runs)]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def measure_server(directory: str, requests: int) -> dict:
+    """
+    Start a server in the given directory (its data.db is created if it does not exist), wait for its first
+    response of GET /events and send more requests.
+    :return: Seconds from the start of the process to the first response, and the durations of the requests.
+    """
+    port = free_port()
+    env = dict(os.environ, REMIND_ME_RATE_LIMIT="0")
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "remind_me_api:app", "--app-dir", str(SRC_DIR),
+                               "--port", str(port), "--log-level", "warning"], cwd=directory, env=env)
+    url = f"http://127.0.0.1:{port}/events"
+    try:
+        while True:
+            try:
+                status = get(url)
+                break
+            except OSError:
+                if time.perf_counter() - start > START_TIMEOUT:
+                    raise RuntimeError(f"The server did not answer in {START_TIMEOUT} seconds")
+                time.sleep(0.005)
+        first_response = time.perf_counter() - start
+        if status != 200:
+            raise RuntimeError(f"GET /events answered {status}")
+
+        durations = []
+        for _ in range(requests):
+            request_start = time.perf_counter()
+            get(url)
+            durations.append(time.perf_counter() - request_start)
+    finally:
+        server.terminate()
+        server.wait()
+    return {"first_response": first_response, "requests": durations}
+
+
+def measure_handlers(handlers: int) -> dict:
+    """
+    Create handlers of a new database in this process, as every request does.
+    :return: Seconds of the first handler and of each of the next ones.
+    """
+    path = str(Path(tempfile.mkdtemp()) / "data.db")
+    start = time.perf_counter()
+    CombinedHandler(path, path).close()
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(handlers):
+        CombinedHandler(path, path).close()
+    return {"first": first, "next": (time.perf_counter() - start) / handlers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5, help="Number of imports and of server starts.")
+    parser.add_argument("--requests", type=int, default=20, help="Requests after the first response.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    imports = measure_import(args.runs)
+    # A new database, as a new deployment, and the existing database, as every worker started by the autoscaler.
+    directory = tempfile.mkdtemp()
+    new_database = measure_server(directory, args.requests)
+    existing = [measure_server(directory, args.requests) for _ in range(args.runs)]
+    handlers = measure_handlers(100)
+
+    results = {
+        "import_ms": statistics.median(imports) * 1000,
+        "first_response_new_database_ms": new_database["first_response"] * 1000,
+        "first_response_ms": statistics.median(run["first_response"] for run in existing) * 1000,
+        "first_request_ms": statistics.median(run["requests"][0] for run in existing) * 1000 if args.requests else 0,
+        "next_requests_ms": statistics.median(duration for run in existing for duration in run["requests"][1:])
+        * 1000 if args.requests > 1 else 0,
+        "first_handler_ms": handlers["first"] * 1000,
+        "next_handlers_ms": handlers["next"] * 1000,
+    }
+    for name, value in results.items():
+        print(f"{name:<32}{value:>10.2f}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Benchmark suite of the handlers, the /events route and the reminder loop, on a synthetic dataset.
+Results are written as JSON and can be compared with a previous run to catch regressions.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+from data_generator import Dataset, generate_dataset
+
+import remind_me_api  # noqa: E402
+from common.server_handler import CombinedHandler  # noqa: E402
+from common.sharded_handlers import DEFAULT_SHARDS  # noqa: E402
+from core.event import Event  # noqa: E402
+from core.storage import STORAGE_MEMORY, STORAGE_SHARDED, STORAGE_SQLITE  # noqa: E402
+
+# ----- Constants ----- #
+
+DEFAULT_THRESHOLD = 0.1  # A benchmark regressed if its median is more than 10% slower than the baseline.
+BENCHMARKS = {}
+
+
+# ----- Functions ----- #
+
+def benchmark(name: str):
+    """
+    Register a benchmark, a function of (handler, dataset, ops) that returns the duration of every operation.
+    """
+    def register(function: Callable):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def timed(operation: Callable, ops: int) -> list[float]:
+    """
+    Run an operation ops times.
+    :return: The duration of every run, in seconds.
+    """
+    samples = []
+    for index in range(ops):
+        start = time.perf_counter()
+        operation(index)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+@benchmark("add_event")
+def bench_add_event(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    start = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S+00:00')
+    host_id = dataset.users_ids[0]
+    events_ids = []
+
+    def add_event(index: int):
+        event = Event(None, host_id, f"bench-event-{index}", "Description", "Holon", [host_id], start, start, None)
+        events_ids.append(handler.events_handler.add_event(event))
+
+    samples = timed(add_event, ops)
+    for event_id in events_ids:
+        handler.events_handler.remove_event(event_id)
+    return samples
+
+
+@benchmark("get_events_by_start_time")
+def bench_get_events_by_start_time(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    return timed(lambda index: handler.events_handler.get_events(sort_by_attribute="event_start_time"), ops)
+
+
+@benchmark("get_events_by_subscribers")
+def bench_get_events_by_subscribers(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    return timed(lambda index: handler.events_handler.get_events(sort_by_attribute="subscribers", reverse=True), ops)
+
+
+@benchmark("add_subscriber_hot_event")
+def bench_add_subscriber_hot_event(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    if not dataset.hot_events_ids:
+        return []
+    event_id = dataset.hot_events_ids[0]
+    subscribed = set(handler.get_event(event_id).subscribers)
+    users_ids = [user_id for user_id in dataset.users_ids if user_id not in subscribed][:ops]
+
+    samples = timed(lambda index: handler.events_handler.add_subscriber(event_id, users_ids[index]), len(users_ids))
+    for user_id in users_ids:
+        handler.events_handler.remove_subscriber(event_id, user_id)
+    return samples
+
+
+@benchmark("events_route")
+def bench_events_route(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    """
+    GET /events sorted by start time, with the names of the subscribers, through the whole ASGI application.
+    The response cache is cleared before every request, so every request renders the events.
+    """
+    remind_me_api.app.dependency_overrides[remind_me_api.get_handler] = dataset.open
+    remind_me_api.app.dependency_overrides[remind_me_api.rate_limit] = lambda: True
+    loop = asyncio.new_event_loop()
+
+    def request(index: int):
+        remind_me_api.response_cache.entries.clear()
+        status = loop.run_until_complete(asgi_get(remind_me_api.app, "/events", "sort_by_attribute=event_start_time"))
+        if status != 200:
+            raise RuntimeError(f"GET /events answered {status}")
+
+    try:
+        return timed(request, ops)
+    finally:
+        loop.close()
+        remind_me_api.app.dependency_overrides.clear()
+
+
+@benchmark("check_for_upcoming_events")
+def bench_check_for_upcoming_events(handler: CombinedHandler, dataset: Dataset, ops: int) -> list[float]:
+    # The reminders are printed, keep them out of the report.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return timed(lambda index: remind_me_api.check_for_upcoming_events(handler), ops)
+
+
+async def asgi_get(app, path: str, query: str = "") -> int:
+    """
+    Send a GET request to an ASGI application in the process, without a server or an HTTP client.
+    :return: The status code, the body is read and dropped.
+    """
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+             "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+    status = None
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: dict):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def summarize(samples: list[float]) -> dict:
+    """
+    Summarize the durations of a benchmark.
+    :return: The number of operations, the median and the 95th percentile in milliseconds and the operations per
+    second.
+    """
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {"ops": len(ordered),
+            "median_ms": statistics.median(ordered) * 1000,
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+            "ops_per_second": len(ordered) / total if total else 0.0}
+
+
+def run(args: argparse.Namespace) -> dict:
+    """
+    Generate the dataset and run the selected benchmarks.
+    :return: The report, with the parameters of the run and the summary of every benchmark.
+    """
+    path = args.database or str(Path(tempfile.mkdtemp()) / "bench.db")
+    start = time.perf_counter()
+    dataset = generate_dataset(path, args.users, args.events, args.hot_events, args.hot_subscribers, args.seed,
+                               args.storage, args.shards)
+    print(f"Generated {args.users} users and {args.events} events in {time.perf_counter() - start:.1f} s",
+          file=sys.stderr)
+
+    results = {}
+    handler = dataset.open()
+    try:
+        for name in args.only or BENCHMARKS:
+            ops = args.ops if name in ("add_event", "add_subscriber_hot_event") else args.repeat
+            samples = BENCHMARKS[name](handler, dataset, ops)
+            if samples:
+                results[name] = summarize(samples)
+    finally:
+        handler.close()
+
+    parameters = {key: getattr(args, key) for key in ("users", "events", "hot_events", "hot_subscribers", "seed",
+                                                      "storage", "shards", "repeat", "ops")}
+    return {"created": datetime.now(timezone.utc).isoformat(), "python": platform.python_version(),
+            "platform": platform.platform(), "parameters": parameters, "results": results}
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Compare the medians of a run with a baseline run.
+    :param threshold: Allowed slowdown, as a fraction of the baseline median.
+    :return: Names of the benchmarks that regressed.
+    """
+    if report["parameters"] != baseline.get("parameters"):
+        print("Warning: the baseline was run with different parameters", file=sys.stderr)
+
+    regressions = []
+    print(f"\n{'benchmark':<28}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, result in report["results"].items():
+        if name not in baseline.get("results", {}):
+            continue
+        before, after = baseline["results"][name]["median_ms"], result["median_ms"]
+        change = after / before - 1 if before else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<28}{before:>14.3f}{after:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'benchmark':<28}{'ops':>6}{'median ms':>12}{'p95 ms':>12}{'ops/s':>12}")
+    for name, result in report["results"].items():
+        print(f"{name:<28}{result['ops']:>6}{result['median_ms']:>12.3f}{result['p95_ms']:>12.3f}"
+              f"{result['ops_per_second']:>12.1f}")
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=2000, help="Number of users.")
+    parser.add_argument("--events", type=int, default=2000, help="Number of events.")
+    parser.add_argument("--hot-events", type=int, default=2, help="Number of events with --hot-subscribers.")
+    parser.add_argument("--hot-subscribers", type=int, default=1000, help="Subscribers of every hot event.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset.")
+    parser.add_argument("--storage", default=STORAGE_SQLITE, choices=[STORAGE_SQLITE, STORAGE_MEMORY, STORAGE_SHARDED])
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="Number of shards of the sharded storage.")
+    parser.add_argument("--database", help="Database file of the dataset, a new temporary file by default.")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs of every read benchmark.")
+    parser.add_argument("--ops", type=int, default=200, help="Operations of every write benchmark.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these benchmarks.")
+    parser.add_argument("--output", help="Write the report to this JSON file.")
+    parser.add_argument("--compare", help="Compare with the JSON report of a previous run.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown of a median in --compare, as a fraction.")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.threshold)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Synthetic datasets for the benchmarks.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import dataclasses
+import random
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from common.server_handler import CombinedHandler  # noqa: E402
+from common.sharded_handlers import DEFAULT_SHARDS  # noqa: E402
+from core.storage import STORAGE_SQLITE  # noqa: E402
+
+# ----- Constants ----- #
+
+LOCATIONS = ["Tel Aviv", "Holon", "Haifa", "Jerusalem", "Eilat", "Ramat Gan", "Herzliya", "Netanya"]
+MAX_SUBSCRIBERS = 200  # Cap of the subscribers of a regular (not hot) event.
+SUBSCRIBERS_SHAPE = 1.2  # Pareto shape of the subscribers per event, most events are small and a few are large.
+SCHEDULE_DAYS = 14  # The events start within this many days from the generation time.
+
+
+# ----- Classes ----- #
+
+@dataclasses.dataclass
+class Dataset:
+    """
+    Ids of a generated dataset.
+    """
+    path: str
+    storage: str
+    shards: int
+    users_ids: list[str]
+    events_ids: list[str]
+    hot_events_ids: list[str]
+
+    def open(self) -> CombinedHandler:
+        """
+        Open a new handler of the dataset.
+        """
+        return CombinedHandler(self.path, self.path, storage=self.storage, shards=self.shards)
+
+
+# ----- Functions ----- #
+
+@contextmanager
+def fast_password_hashing():
+    """
+    Replace the bcrypt hashing of add_user, it would dominate the generation of the users.
+    """
+    def plain(password: str) -> str:
+        return password
+
+    with mock.patch("common.users_handler.hash_password", plain), \
+            mock.patch("common.memory_handlers.hash_password", plain):
+        yield
+
+
+def subscriber_counts(events: int, users: int, hot_events: int, hot_subscribers: int, rng: random.Random) -> list[int]:
+    """
+    Number of subscribers of each event: the first hot_events events get hot_subscribers each, the others follow
+    a long tailed (Pareto) distribution.
+    :param events: Number of events.
+    :param users: Number of users, the max subscribers of an event.
+    :param hot_events: Number of hot events.
+    :param hot_subscribers: Subscribers of each hot event.
+    :param rng: Random generator.
+    :return: The counts, in the order of the events.
+    """
+    counts = []
+    for index in range(events):
+        if index < hot_events:
+            count = hot_subscribers
+        else:
+            count = min(int(rng.paretovariate(SUBSCRIBERS_SHAPE)) - 1, MAX_SUBSCRIBERS)
+        counts.append(min(count, users))
+    return counts
+
+
+def generate_dataset(path: str, users: int, events: int, hot_events: int = 1, hot_subscribers: int = 1000,
+                     seed: int = 0, storage: str = STORAGE_SQLITE, shards: int = DEFAULT_SHARDS) -> Dataset:
+    """
+    Create users and events with subscribers. The same arguments always create the same users, events and
+    subscriptions (the ids and the start times differ).
+    :param path: Database file (or name, for the memory engine).
+    :param users: Number of users.
+    :param events: Number of events.
+    :param hot_events: Number of events with hot_subscribers subscribers.
+    :param hot_subscribers: Subscribers of each hot event, the first users.
+    :param seed: Seed of the random generator.
+    :param storage: Storage engine.
+    :param shards: Number of shards of the sharded engine.
+    :return: The dataset.
+    """
+    rng = random.Random(seed)
+    handler = CombinedHandler(path, path, storage=storage, shards=shards)
+    try:
+        with fast_password_hashing():
+            users_ids = [handler.add_user(f"user-{index}", f"user-{index}@mail.com", "password")
+                         for index in range(users)]
+
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        counts = subscriber_counts(events, users, hot_events, hot_subscribers, rng)
+        events_ids = []
+        for index, count in enumerate(counts):
+            # Hot events are subscribed by the first users, so a benchmark can use the others.
+            subscribers = users_ids[:count] if index < hot_events else rng.sample(users_ids, count)
+            start = now + timedelta(seconds=rng.randrange(SCHEDULE_DAYS * 24 * 60 * 60))
+            events_ids.append(handler.add_event(rng.choice(users_ids), f"event-{index}", "Description",
+                                                rng.choice(LOCATIONS), subscribers, start,
+                                                start + timedelta(hours=rng.randint(1, 4))))
+    finally:
+        handler.close()
+    return Dataset(path, storage, shards, users_ids, events_ids, events_ids[:hot_events])
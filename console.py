@@ -10,19 +10,41 @@ THIS FILE IS ONLY FOR TEST THE API ROUTES VIA CONSOLE.
 
 # ----- Imports ----- #
 
-import requests
+import argparse
 import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+
+import requests
 
 # ----- Constants ----- #
 
 BASE_URL = "http://127.0.0.1:8000"
+SRC_DIR = Path(__file__).resolve().parent / "src"
+OPERATIONS = ("register", "login", "schedule", "subscribe", "list")
+DEFAULT_MIX = "register=1,login=1,schedule=2,subscribe=4,list=2"
+LOAD_PASSWORD = "load-password"
+LOCATIONS = ["Tel Aviv", "Holon", "Haifa", "Jerusalem"]
+SERVER_START_TIMEOUT = 30  # Seconds to wait for a started server to answer.
 
 
 class CLIApp:
     """ Command-Line Application for User and Event Management """
 
-    def __init__(self):
-        """ Initialize the CLIApp """
+    def __init__(self, base_url: str = BASE_URL, session: requests.Session = None):
+        """ Initialize the CLIApp, the requests reuse the connections of the session. """
+        self.base_url = base_url
+        self.session = session or requests.Session()
         self.current_user_id = None
 
     @staticmethod
@@ -73,7 +95,7 @@ class CLIApp:
         password = input("Enter password: ")
 
         try:
-            response = requests.post(f"{BASE_URL}/login/?username={username}&password={password}")
+            response = self.request_login(username, password)
             response.raise_for_status()
 
             print("\nLogin successful!")
@@ -91,7 +113,7 @@ class CLIApp:
         mail = input("Enter email: ")
         password = input("Enter password: ")
 
-        response = requests.post(f"{BASE_URL}/register/?username={username}&mail={mail}&password={password}")
+        response = self.request_register(username, mail, password)
 
         if response.status_code == 200:
             print("Registration successful!")
@@ -108,7 +130,7 @@ class CLIApp:
             print("Please login or register first.")
             return
 
-        response = requests.get(f"{BASE_URL}/get_user/{self.current_user_id}/")
+        response = self.session.get(f"{self.base_url}/get_user/{self.current_user_id}/")
         if response.status_code == 200:
             user_data = response.json()
             print("User Data:", user_data)
@@ -132,9 +154,7 @@ class CLIApp:
         start_dt = datetime.datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
         end_dt = datetime.datetime.strptime(end, "%Y-%m-%d %H:%M:%S")
 
-        response = requests.post(f"{BASE_URL}/schedule_event/?user_id={self.current_user_id}"
-                                 f"&name={name}&description={description}&location={location}"
-                                 f"&start={start_dt}&end={end_dt}")
+        response = self.request_schedule_event(name, description, location, start_dt, end_dt)
 
         if response.status_code == 200:
             print("Event scheduled successfully!")
@@ -152,7 +172,7 @@ class CLIApp:
 
         event_name = input("Enter event name: ")
 
-        response = requests.get(f"{BASE_URL}/get_event/{event_name}/")
+        response = self.session.get(f"{self.base_url}/get_event/{event_name}/")
         if response.status_code == 200:
             event_data = response.json()
             print("Event Data:", event_data)
@@ -169,7 +189,7 @@ class CLIApp:
 
         location = input("Enter event location or venue: ")
 
-        response = requests.get(f"{BASE_URL}/events", params={"location": location})
+        response = self.request_events(location=location)
         if response.status_code == 200:
             events = response.json()
             print("\nEvents in", location, ":")
@@ -203,7 +223,7 @@ class CLIApp:
             print("Invalid choice. Returning to main menu.")
             return
 
-        response = requests.get(f"{BASE_URL}/events", params={"sort_by_attribute": sort_by})
+        response = self.request_events(sort_by_attribute=sort_by)
         if response.status_code == 200:
             events = response.json()
             print("\nEvents sorted by", sort_by, ":")
@@ -212,6 +232,258 @@ class CLIApp:
         else:
             print("Error:", response.json()["detail"])
 
+    def request_login(self, username: str, password: str) -> requests.Response:
+        """ Send a login request. """
+        return self.session.post(f"{self.base_url}/login/", params={"username": username, "password": password})
+
+    def request_register(self, username: str, mail: str, password: str) -> requests.Response:
+        """ Send a register request. """
+        return self.session.post(f"{self.base_url}/register/",
+                                 params={"username": username, "mail": mail, "password": password})
+
+    def request_schedule_event(self, name: str, description: str, location: str, start: datetime.datetime,
+                               end: datetime.datetime) -> requests.Response:
+        """ Send a request to schedule an event of the current user. """
+        return self.session.post(f"{self.base_url}/schedule_event/",
+                                 params={"user_id": self.current_user_id, "name": name, "description": description,
+                                         "location": location, "start": str(start), "end": str(end)})
+
+    def request_subscribe(self, event_id: str) -> requests.Response:
+        """ Send a request to subscribe the current user to an event. """
+        return self.session.post(f"{self.base_url}/add_subscriber/",
+                                 params={"event_id": event_id, "user_id": self.current_user_id})
+
+    def request_events(self, **params) -> requests.Response:
+        """ Send a request to list the events, the params are the queries of GET /events. """
+        return self.session.get(f"{self.base_url}/events", params=params)
+
+
+class LoadGenerator:
+    """ Open loop load of CLIApp operations: requests arrive at a fixed average rate, whether the server keeps up
+    or not, so a slow server shows up in the latencies instead of lowering the load. """
+
+    def __init__(self, base_url: str, rate: float, duration: float, concurrency: int, mix: dict[str, float],
+                 seed: int = 0):
+        """
+        :param base_url: The server.
+        :param rate: Average requests per second, the arrivals are random (Poisson).
+        :param duration: Seconds of load.
+        :param concurrency: Max requests in flight, the requests that arrive when all of them are busy wait.
+        :param mix: Relative weight of every operation.
+        :param seed: Seed of the arrivals and of the operations.
+        """
+        self.base_url = base_url
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.users = []  # Tuples of (user id, user name).
+        self.events = []  # Tuples of (event id, subscribers ids).
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.elapsed = 0.0
+
+    def client(self) -> CLIApp:
+        """ Get the client of the current thread, every thread keeps its own connections. """
+        if not hasattr(self.local, "app"):
+            session = requests.Session()
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
+            self.local.app = CLIApp(self.base_url, session)
+        return self.local.app
+
+    def prepare(self, users: int, events: int):
+        """ Create the users and the events the first operations use. """
+        for _ in range(users):
+            self.register(self.client()).raise_for_status()
+        for _ in range(events):
+            self.schedule(self.client()).raise_for_status()
+
+    def register(self, app: CLIApp) -> requests.Response:
+        name = f"load-{uuid.uuid4().hex[:12]}"
+        response = app.request_register(name, f"{name}@mail.com", LOAD_PASSWORD)
+        if response.ok:
+            with self.lock:
+                self.users.append((response.json()["user_id"], name))
+        return response
+
+    def login(self, app: CLIApp) -> requests.Response:
+        with self.lock:
+            user_id, name = self.random.choice(self.users)
+        return app.request_login(name, LOAD_PASSWORD)
+
+    def schedule(self, app: CLIApp) -> requests.Response:
+        with self.lock:
+            app.current_user_id = self.random.choice(self.users)[0]
+            start = datetime.datetime.now() + datetime.timedelta(minutes=self.random.randrange(60 * 24 * 30))
+            location = self.random.choice(LOCATIONS)
+        response = app.request_schedule_event(f"load-{uuid.uuid4().hex[:12]}", "Load test", location, start,
+                                              start + datetime.timedelta(hours=1))
+        if response.ok:
+            with self.lock:
+                # The host is the first subscriber.
+                self.events.append((response.json()["event_id"], {app.current_user_id}))
+        return response
+
+    def subscribe(self, app: CLIApp) -> requests.Response:
+        with self.lock:
+            event_id, subscribers = self.random.choice(self.events)
+            candidates = [user_id for user_id, _ in self.random.sample(self.users, min(10, len(self.users)))
+                          if user_id not in subscribers]
+            app.current_user_id = candidates[0] if candidates else self.random.choice(self.users)[0]
+            subscribers.add(app.current_user_id)
+        return app.request_subscribe(event_id)
+
+    def list_events(self, app: CLIApp) -> requests.Response:
+        with self.lock:
+            sort_by = self.random.choice(["event_start_time", "subscribers", "creation_time"])
+        return app.request_events(sort_by_attribute=sort_by)
+
+    def execute(self, operation: str, arrival: float):
+        """ Run an operation, its latency is measured from its arrival, including the wait for a free worker. """
+        try:
+            operations = {"register": self.register, "login": self.login, "schedule": self.schedule,
+                          "subscribe": self.subscribe, "list": self.list_events}
+            response = operations[operation](self.client())
+            error = None if response.ok else str(response.status_code)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - arrival
+        with self.lock:
+            self.latencies[operation].append(latency)
+            if error:
+                self.errors[operation][error] += 1
+
+    def run(self):
+        """ Send the requests for the duration of the load, and wait for them to finish. """
+        operations = [operation for operation in OPERATIONS if self.mix.get(operation)]
+        weights = [self.mix[operation] for operation in operations]
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            arrival = start
+            while True:
+                arrival += self.random.expovariate(self.rate)
+                if arrival - start > self.duration:
+                    break
+                time.sleep(max(0.0, arrival - time.perf_counter()))
+                operation = self.random.choices(operations, weights)[0]
+                futures.append(executor.submit(self.execute, operation, arrival))
+            wait(futures)
+        self.elapsed = time.perf_counter() - start
+
+    def report(self) -> dict:
+        """ Summarize the latencies (in milliseconds) and the errors of every operation and of all of them. """
+        summary = {}
+        for operation in list(self.latencies) + ["total"]:
+            if operation == "total":
+                latencies = [latency for values in self.latencies.values() for latency in values]
+                errors = sum((self.errors[name] for name in self.latencies), Counter())
+            else:
+                latencies, errors = self.latencies[operation], self.errors[operation]
+            latencies = sorted(latencies)
+            summary[operation] = {
+                "requests": len(latencies),
+                "errors": sum(errors.values()),
+                "error_rate": sum(errors.values()) / len(latencies) if latencies else 0.0,
+                "error_statuses": dict(errors),
+                "per_second": len(latencies) / self.elapsed if self.elapsed else 0.0,
+                **{f"p{percent}_ms": percentile(latencies, percent) * 1000 for percent in (50, 90, 99)},
+                "max_ms": latencies[-1] * 1000 if latencies else 0.0}
+        return summary
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """
+    Get a percentile of sorted values, by the nearest rank.
+    :param values: Sorted values.
+    :param percent: The percentile, 0 to 100.
+    :return: The value, 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(len(values) * percent / 100 + 0.5) - 1))]
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """
+    Parse an operations mix, e.g. 'register=1,subscribe=4'.
+    :param mix: Comma separated operation=weight pairs.
+    :return: Dict of operation to weight.
+    """
+    weights = {}
+    for pair in mix.split(","):
+        operation, _, weight = pair.partition("=")
+        if operation.strip() not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[operation.strip()] = float(weight or 1)
+    return weights
+
+
+def start_server(port: int, storage: str) -> subprocess.Popen:
+    """
+    Start a server with a new database in a temporary directory, and without rate limiting.
+    :param port: Port of the server.
+    :param storage: Storage engine of the server.
+    :return: The server process.
+    """
+    env = dict(os.environ, REMIND_ME_RATE_LIMIT="0", REMIND_ME_STORAGE=storage)
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "remind_me_api:app", "--app-dir", str(SRC_DIR),
+                               "--port", str(port), "--log-level", "warning"], cwd=tempfile.mkdtemp(), env=env)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"The server did not start in {SERVER_START_TIMEOUT} seconds")
+
+
+def run_load(argv: list[str]):
+    """ Run the load generation mode, see --help. """
+    parser = argparse.ArgumentParser(prog="console.py load", description="Generate load of CLIApp operations.")
+    parser.add_argument("--url", default=BASE_URL, help="The server, ignored with --start-server.")
+    parser.add_argument("--start-server", action="store_true", help="Start a local server with a new database.")
+    parser.add_argument("--port", type=int, default=8001, help="Port of the started server.")
+    parser.add_argument("--storage", default="sqlite", help="Storage engine of the started server.")
+    parser.add_argument("--rate", type=float, default=20, help="Average requests per second.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Max requests in flight.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of the operations.")
+    parser.add_argument("--users", type=int, default=20, help="Users to register before the load.")
+    parser.add_argument("--events", type=int, default=20, help="Events to schedule before the load.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the arrivals and the operations.")
+    parser.add_argument("--output", help="Write the report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    server = start_server(args.port, args.storage) if args.start_server else None
+    try:
+        url = f"http://127.0.0.1:{args.port}" if server else args.url
+        generator = LoadGenerator(url, args.rate, args.duration, args.concurrency, parse_mix(args.mix), args.seed)
+        generator.prepare(max(args.users, 1), max(args.events, 1))
+        generator.run()
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    report = generator.report()
+    print(f"{'operation':<12}{'requests':>10}{'req/s':>9}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+          f"{'max ms':>10}")
+    for operation, result in report.items():
+        print(f"{operation:<12}{result['requests']:>10}{result['per_second']:>9.1f}{result['error_rate']:>8.1%}"
+              f"{result['p50_ms']:>10.1f}{result['p90_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['max_ms']:>10.1f}")
+    errors = {operation: result["error_statuses"] for operation, result in report.items()
+              if result["error_statuses"] and operation != "total"}
+    if errors:
+        print("Errors:", errors)
+    if args.output:
+        Path(args.output).write_text(json.dumps({"parameters": vars(args), "results": report}, indent=2))
+
 
 def get_correct_datetime_input(msg: str) -> str:
     """
@@ -229,10 +501,14 @@ def get_correct_datetime_input(msg: str) -> str:
 
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["load"]:
+        run_load(sys.argv[2:])
+        sys.exit()
+
     app = CLIApp()
     try:
         app.run()
     except KeyboardInterrupt:
         print("\nExiting the application.")
     except Exception as e:
-        print(f"An unexpected error occurred: {e}. Exiting.")
\ No newline at end of file
+        print(f"An unexpected error occurred: {e}. Exiting.")
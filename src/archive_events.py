@@ -0,0 +1,42 @@
+"""
+Archival job, moves finished events to the archive table.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+from datetime import timedelta
+
+from common.server_handler import CombinedHandler, USERS_DATABASE_NAME, EVENTS_DATABASE_NAME, STORAGE_ENGINES
+from common.sharded_handlers import DEFAULT_SHARDS
+from core.storage import STORAGE_SQLITE
+
+# ----- Constants ----- #
+
+DEFAULT_RETENTION_DAYS = 30
+
+
+# ----- Functions ----- #
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the events that ended before the retention period to the "
+                                                 "archive. Run it periodically (e.g. daily from cron).")
+    parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION_DAYS,
+                        help="Days to keep finished events in the events table.")
+    parser.add_argument("--users-database", default=USERS_DATABASE_NAME)
+    parser.add_argument("--events-database", default=EVENTS_DATABASE_NAME)
+    parser.add_argument("--storage", choices=list(STORAGE_ENGINES), default=STORAGE_SQLITE)
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    args = parser.parse_args()
+
+    handler = CombinedHandler(args.users_database, args.events_database, args.storage, args.shards)
+    try:
+        archived = handler.archive_past_events(timedelta(days=args.retention_days))
+    finally:
+        handler.close()
+    print(f"Archived {archived} events.")
+
+
+if __name__ == "__main__":
+    main()
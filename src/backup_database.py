@@ -0,0 +1,40 @@
+"""
+Online backup job, copies the database while the server is running.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+from pathlib import Path
+
+from common.sharded_handlers import shard_files
+from core.database_handler import DatabaseHandler, DATABASE_NAME, BACKUP_PAGES, BACKUP_PAUSE
+
+
+# ----- Functions ----- #
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up the database without pausing the server. The pages are "
+                                                 "copied in batches, and the writers run between the batches.")
+    parser.add_argument("target", help="The backup file.")
+    parser.add_argument("--database", default=DATABASE_NAME)
+    parser.add_argument("--shards", type=int, default=0, help="Number of shards of the sharded engine, whose "
+                                                                "files are backed up next to the target.")
+    parser.add_argument("--pages", type=int, default=BACKUP_PAGES, help="Pages copied in each step.")
+    parser.add_argument("--pause", type=float, default=BACKUP_PAUSE, help="Seconds between two steps.")
+    args = parser.parse_args()
+
+    sources = [Path(args.database)] + shard_files(args.database, args.shards)
+    targets = [Path(args.target)] + shard_files(args.target, args.shards)
+    for source, target in zip(sources, targets):
+        handler = DatabaseHandler(source)
+        try:
+            handler.backup(target, args.pages, args.pause)
+        finally:
+            handler.close()
+        print(f"Backed up {source} to {target}.")
+
+
+if __name__ == "__main__":
+    main()
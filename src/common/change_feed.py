@@ -0,0 +1,186 @@
+"""
+Change feed file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import asyncio
+import contextlib
+import logging
+import threading
+from typing import Callable, Optional
+
+from common.server_handler import CombinedHandler
+from core.exceptions import RemindMeBaseException
+
+# ----- Constants ----- #
+
+POLL_INTERVAL = 0.5  # Seconds between two reads of the change log.
+POLL_LIMIT = 500  # Max changes read at once.
+MAX_POLL_BACKOFF = 30  # Max seconds between two reads after failed reads.
+MAX_LISTENERS = 1000
+LISTENER_QUEUE_SIZE = 100  # Max pending batches of a listener before it is dropped.
+
+feed_log = logging.getLogger("remind_me.change_feed")
+
+
+# ----- Exceptions ----- #
+
+
+class TooManyListeners(RemindMeBaseException):
+    """
+    The change feed reached its max number of listeners exception.
+    """
+    pass
+
+
+# ----- Classes ----- #
+
+class ChangeListener:
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue_size: int):
+        """
+        Init a listener that receives the changes on the given event loop.
+        :param loop: The event loop of the listener.
+        :param queue_size: Max pending batches.
+        """
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, changes: list[dict]):
+        """
+        Push a batch of changes, called from the feed thread.
+        :param changes: The new changes.
+        """
+        self.loop.call_soon_threadsafe(self._put, changes)
+
+    def cut_off(self):
+        """
+        Stop the listener, it resumes with 'since'. Called from the feed thread when it missed changes.
+        """
+        self.loop.call_soon_threadsafe(self._cut_off)
+
+    def _put(self, changes: list[dict]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(changes)
+        except asyncio.QueueFull:
+            # A slow listener is cut off instead of buffering without bound, it can resume with 'since'.
+            self._cut_off()
+
+    def _cut_off(self):
+        if self.overflowed:
+            return
+        self.overflowed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait([])  # Wake up the waiting get, so it notices the overflow.
+
+    async def get(self, timeout: float) -> Optional[list[dict]]:
+        """
+        Wait for the next batch of changes.
+        :param timeout: Seconds to wait.
+        :return: The changes, None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChangeFeed:
+    def __init__(self,
+                 handler_factory: Callable[[], CombinedHandler],
+                 poll_interval: float = POLL_INTERVAL,
+                 max_listeners: int = MAX_LISTENERS,
+                 queue_size: int = LISTENER_QUEUE_SIZE):
+        """
+        Init the change feed, a single reader of the change log that fans the changes out to the listeners.
+        :param handler_factory: Creates the handler that reads the change log.
+        :param poll_interval: Seconds between two reads of the change log.
+        :param max_listeners: Max number of listeners.
+        :param queue_size: Max pending batches of each listener.
+        """
+        self.handler_factory = handler_factory
+        self.poll_interval = poll_interval
+        self.max_listeners = max_listeners
+        self.queue_size = queue_size
+        self.listeners: set[ChangeListener] = set()
+        self.lock = threading.Lock()
+        self.handler: Optional[CombinedHandler] = None
+        self.last_sequence: Optional[int] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def subscribe(self) -> ChangeListener:
+        """
+        Add a listener on the running event loop, and start the feed thread if needed.
+        :return: The listener.
+        """
+        listener = ChangeListener(asyncio.get_running_loop(), self.queue_size)
+        with self.lock:
+            if len(self.listeners) >= self.max_listeners:
+                raise TooManyListeners(self.max_listeners)
+            self._start()
+            self.listeners.add(listener)
+        return listener
+
+    def unsubscribe(self, listener: ChangeListener):
+        """
+        Remove a listener.
+        :param listener: The listener.
+        """
+        with self.lock:
+            self.listeners.discard(listener)
+
+    def _start(self):
+        if self.thread is not None:
+            return
+        self.handler = self.handler_factory()
+        # Listeners catch up on the older changes by themselves.
+        self.last_sequence = self.handler.get_last_change_sequence()
+        self.thread = threading.Thread(target=self._run, name="change_feed", daemon=True)
+        self.thread.start()
+
+    def poll(self):
+        """
+        Read the new changes once and push them to all the listeners.
+        """
+        if self.handler is None:
+            self.handler = self.handler_factory()
+        changes = self.handler.get_changes(self.last_sequence, POLL_LIMIT)
+        if not changes:
+            return
+        # The sequence numbers have no gaps, unless the changes after the last read were trimmed meanwhile.
+        missed_changes = changes[0]["sequence"] > self.last_sequence + 1
+        self.last_sequence = changes[-1]["sequence"]
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            if missed_changes:
+                listener.cut_off()
+            else:
+                listener.push(changes)
+
+    def _run(self):
+        delay = self.poll_interval
+        while not self.stopped.wait(delay):
+            try:
+                self.poll()
+                delay = self.poll_interval
+            except Exception:
+                delay = min(delay * 2, MAX_POLL_BACKOFF)
+                feed_log.exception("Failed to read the change log, retrying in %.1f seconds", delay)
+                if self.handler is not None:
+                    # The next read opens a new handler.
+                    with contextlib.suppress(Exception):
+                        self.handler.close()
+                    self.handler = None
+
+    def stop(self):
+        """
+        Stop the feed thread.
+        """
+        self.stopped.set()
@@ -6,25 +6,80 @@ Date: 22/10/2023
 # ----- Imports ----- #
 
 import json
-from datetime import datetime
+import sqlite3
+from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-from typing import Union, Optional
+from typing import Iterator, Union, Optional
 
-from core.database_handler import DatabaseHandler
+from core.database_handler import DatabaseHandler, in_list_chunks
+from core.migrations import Backfill, Migration
 from core.event import Event, EventAlreadyExist, ModifyChangesAreInvalid, InvalidAttribute, \
-    UserDoesNotASubscriber, UserAlreadySubscriber
-from core.utils import generate_unique_id
+    UserDoesNotASubscriber, UserAlreadySubscriber, EventDoesNotExist, EventModifiedConcurrently, EventVersionMismatch
+from core.metrics import timed_stage
+from core.storage import EventsStorage
+from core.utils import as_utc, generate_unique_id
+
+# ----- Constants ----- #
+
+# Attempts of an optimistic read-modify-write before giving up.
+MAX_WRITE_ATTEMPTS = 20
+
+# Kinds of the maintained aggregates, each is counted per key.
+STAT_SUBSCRIBERS = "subscribers"  # Per event id.
+STAT_LOCATION = "location"  # Per location.
+STAT_HOST = "host"  # Per created user id.
+STAT_DAY = "day"  # Per start date (YYYY-MM-DD).
+
+# Decoders of the stored columns that are not kept as is.
+COLUMN_DECODERS = {
+    "subscribers": json.loads,
+    "event_start_time": datetime.fromisoformat,
+    "event_end_time": datetime.fromisoformat,
+    "creation_time": datetime.fromisoformat,
+}
 
 
 # ----- Classes ----- #
 
-class EventsHandler(DatabaseHandler):
-    def __init__(self, events_database_file: Union[str, Path]):
+class EventsHandler(DatabaseHandler, EventsStorage):
+    def __init__(self, events_database_file: Union[str, Path], pooled: bool = False):
         """
         Init the event handler class.
         :param events_database_file: The event database.
+        :param pooled: If True, take a connection of the pool, it is given back by close.
         """
-        super().__init__(events_database_file)
+        super().__init__(events_database_file, pooled)
+        self._migrate("events", self._events_migrations())
+
+    @classmethod
+    def _events_migrations(cls) -> list[Migration]:
+        """
+        Get the migrations of the events tables, in the order they were introduced.
+        :return: The migrations.
+        """
+        return [
+            Migration(1, "Create the events table", cls._create_events_table),
+            Migration(2, "Add the version of the events",
+                      lambda handler: handler._add_missing_column("events", "version", "INTEGER NOT NULL DEFAULT 0")),
+            Migration(3, "Create the events archive", cls._create_events_archive),
+            Migration(4, "Create the aggregates", cls._create_stats),
+            Migration(5, "Index the end time of the events, for the archive job",
+                      lambda handler: handler.cursor.execute(
+                          "CREATE INDEX IF NOT EXISTS events_end_time ON events (event_end_time)")),
+            Migration(6, "Count the subscribers of the events, so they are sorted by an index",
+                      cls._add_subscriber_count, Backfill("events", "event_id", cls._backfill_subscriber_count)),
+            Migration(7, "Count the subscribers of the archived events", lambda handler: None,
+                      Backfill("events_archive", "event_id",
+                               lambda handler, keys: handler._backfill_subscriber_count(keys, "events_archive"))),
+            Migration(8, "Index the start time of the events, for the upcoming events",
+                      lambda handler: handler.cursor.execute(
+                          "CREATE INDEX IF NOT EXISTS events_start_time ON events (event_start_time)")),
+            Migration(9, "Index the events of every user, the hosts and the subscribers", cls._create_user_events,
+                      Backfill("events", "event_id", lambda handler, keys: handler._index_event_users(keys))),
+        ]
+
+    def _create_events_table(self):
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS events
             (event_id TEXT PRIMARY KEY, 
@@ -39,101 +94,294 @@ class EventsHandler(DatabaseHandler):
             FOREIGN KEY (created_user_id) REFERENCES users(user_id))
         ''')
 
+    def _create_events_archive(self):
+        # Finished events are moved here, with the same columns, so the events table stays small.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events_archive
+            (event_id TEXT PRIMARY KEY,
+            created_user_id TEXT,
+            event_name TEXT,
+            event_description TEXT,
+            location TEXT,
+            subscribers TEXT DEFAULT '[]',
+            event_start_time DATETIME,
+            event_end_time DATETIME,
+            creation_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0)
+        ''')
+
+    def _add_subscriber_count(self):
+        # Kept by every write of the subscribers, the existing rows are filled by the backfill.
+        self._add_missing_column("events", "subscriber_count", "INTEGER")
+        self._add_missing_column("events_archive", "subscriber_count", "INTEGER")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS events_subscriber_count ON events (subscriber_count)")
+
+    def _create_user_events(self):
+        # The hosts and the subscribers of the (not archived) events, kept by every write of the events.
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_events
+            (user_id TEXT,
+            event_id TEXT,
+            PRIMARY KEY (user_id, event_id)) WITHOUT ROWID
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS user_events_event_id ON user_events (event_id)")
+
+    def _index_event_users(self, events_ids: list[str]):
+        """
+        Rebuild the rows of the given events in the user events index, from the events table.
+        :param events_ids: The events, the ones that are not in the events table are removed from the index.
+        """
+        for placeholders, chunk in in_list_chunks(events_ids):
+            self.cursor.execute(f"DELETE FROM user_events WHERE event_id IN ({placeholders})", chunk)
+            self.cursor.execute(f"INSERT OR IGNORE INTO user_events (user_id, event_id) "
+                                f"SELECT created_user_id, event_id FROM events WHERE event_id IN ({placeholders})",
+                                chunk)
+            self.cursor.execute(f"INSERT OR IGNORE INTO user_events (user_id, event_id) "
+                                f"SELECT json_each.value, events.event_id FROM events, json_each(events.subscribers) "
+                                f"WHERE events.event_id IN ({placeholders})", chunk)
+
+    def rebuild_user_events(self):
+        """
+        Recompute the user events index from the events table.
+        """
+        self.cursor.execute("DELETE FROM user_events")
+        self.cursor.execute("INSERT OR IGNORE INTO user_events (user_id, event_id) "
+                            "SELECT created_user_id, event_id FROM events")
+        self.cursor.execute("INSERT OR IGNORE INTO user_events (user_id, event_id) "
+                            "SELECT json_each.value, events.event_id FROM events, json_each(events.subscribers)")
+        self.conn.commit()
+
+    def _index_subscriber(self, event_id: str, user_id: str, action: str):
+        """
+        Update the user events index with a new or a removed subscriber, should be called before the commit.
+        :param event_id: ID of the event.
+        :param user_id: ID of the subscriber.
+        :param action: 'add' or 'remove'.
+        """
+        if action == "add":
+            self.cursor.execute("INSERT OR IGNORE INTO user_events (user_id, event_id) VALUES (?, ?)",
+                                (user_id, event_id))
+        else:
+            # The host of the event stays in the index.
+            self.cursor.execute("DELETE FROM user_events WHERE user_id = ? AND event_id = ? AND NOT EXISTS "
+                                "(SELECT 1 FROM events WHERE event_id = ? AND created_user_id = ?)",
+                                (user_id, event_id, event_id, user_id))
+
+    def _backfill_subscriber_count(self, events_ids: list[str], table_name: str = "events"):
+        """
+        Fill the subscribers count of existing events.
+        :param events_ids: The events of the batch.
+        :param table_name: The events table or the archive.
+        """
+        for placeholders, chunk in in_list_chunks(events_ids):
+            self.cursor.execute(f"UPDATE {table_name} SET subscriber_count = json_array_length(subscribers) "
+                                f"WHERE event_id IN ({placeholders})", chunk)
+
     def add_event(self, event: Event) -> str:
         """
         Add event to the database.
-        :param event: Given event to add.
+        :param event: Given event to add, it gets a new id unless it already has one.
         :return: Event id.
         """
-        self.cursor.execute("SELECT event_id FROM events WHERE event_name=?", (event.event_name,))
-        if self.cursor.fetchone():
-            raise EventAlreadyExist()
+        event.event_id = event.event_id or generate_unique_id()
 
-        event.event_id = generate_unique_id()
-
-        self.cursor.execute(
-            "INSERT INTO events (event_id, created_user_id, event_name, event_description, location, subscribers, "
-            "event_start_time, event_end_time, creation_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (event.event_id, event.created_user_id, event.event_name, event.event_description, event.location,
-             json.dumps(event.subscribers), event.event_start_time, event.event_end_time, datetime.now()))
+        # The unique name constraint is the check, a separate SELECT would race with concurrent inserts.
+        try:
+            self.cursor.execute(
+                "INSERT INTO events (event_id, created_user_id, event_name, event_description, location, "
+                "subscribers, subscriber_count, event_start_time, event_end_time, creation_time) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (event.event_id, event.created_user_id, event.event_name, event.event_description, event.location,
+                 json.dumps(event.subscribers), len(event.subscribers), event.event_start_time, event.event_end_time,
+                 datetime.now()))
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            event.event_id = None
+            raise EventAlreadyExist(event.event_name)
+        self._count_event(event.event_id, 1)
+        self._index_event_users([event.event_id])
+        self._record_change("events", event.event_id, "add",
+                            {"event_name": event.event_name, "created_user_id": event.created_user_id,
+                             "location": event.location, "event_start_time": event.event_start_time,
+                             "event_end_time": event.event_end_time})
         self.conn.commit()
         return event.event_id
 
     def remove_event(self, event_id: str):
         """
-        Remove event from data base.
+        Remove event from data base, whether it is archived or not.
         :param event_id: Given event id to remove
         """
+        self._count_event(event_id, -1)
         self.cursor.execute("DELETE FROM events WHERE event_id=?", (event_id,))
+        self.cursor.execute("DELETE FROM events_archive WHERE event_id=?", (event_id,))
+        self.cursor.execute("DELETE FROM user_events WHERE event_id=?", (event_id,))
+        self._record_change("events", event_id, "remove")
         self.conn.commit()
 
-    def modify_event(self, event_id: str, **changes) -> None:
+    def modify_event(self, event_id: str, expected_version: Optional[int] = None, **changes) -> None:
         """
         Modify an existing event in the database by its event ID.
         :param event_id: ID of the event to modify.
+        :param expected_version: If entered, modify the event only if it is still in this version.
         :param changes: Key Value pairs of the fields you want to update and their new values.
         """
-        set_conditions = []
-        params = []
-
-        for key, value in changes.items():
-            if key in Event.__annotations__.keys():
-                if key == "subscribers":
-                    value = json.dumps(value)
-                set_conditions.append(f"{key} = ?")
-                params.append(value)
-
-        if not set_conditions:
+        keys = tuple(sorted(key for key in changes if key in Event.__annotations__.keys() and key != "version"))
+        if not keys:
             raise ModifyChangesAreInvalid(changes)
 
-        set_conditions_str = ', '.join(set_conditions)
-        query = f"UPDATE events SET {set_conditions_str} WHERE event_id = ?"
-
+        params = []
+        applied_changes = {}
+        for key in keys:
+            value = applied_changes[key] = changes[key]
+            if key == "subscribers":
+                params.append(len(value))
+                value = json.dumps(value)
+            params.append(value)
         params.append(event_id)
+        if expected_version is not None:
+            params.append(expected_version)
+        query = self._update_query(keys, expected_version is not None)
+
+        self._count_event(event_id, -1)
+        try:
+            self.cursor.execute(query, params)
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            raise EventAlreadyExist(changes.get("event_name"))
 
-        self.cursor.execute(query, params)
+        if expected_version is not None and self.cursor.rowcount == 0:
+            self.conn.rollback()
+            self.cursor.execute("SELECT version FROM events WHERE event_id=?", (event_id,))
+            result = self.cursor.fetchone()
+            if not result:
+                raise EventDoesNotExist(event_id)
+            raise EventVersionMismatch(expected_version, result[0])
+        if self.cursor.rowcount == 0:
+            # The event does not exist, nothing was modified.
+            self.conn.rollback()
+            return
+        self._count_event(event_id, 1)
+        if "subscribers" in keys or "created_user_id" in keys:
+            self._index_event_users([event_id])
+        self._record_change("events", event_id, "modify", applied_changes)
         self.conn.commit()
 
-    def get_event(self, event_id) -> Event:
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _update_query(cls, keys: tuple[str, ...], check_version: bool) -> str:
+        """
+        Build the statement of modify_event once per shape, so every call of a shape reuses its prepared statement.
+        :param keys: The modified attributes, sorted.
+        :param check_version: If True, the statement also compares the version of the event.
+        :return: The update statement.
+        """
+        set_conditions = []
+        for key in keys:
+            if key == "subscribers":
+                set_conditions.append("subscriber_count = ?")
+            set_conditions.append(f"{key} = ?")
+        query = f"UPDATE events SET {', '.join(set_conditions)}, version = version + 1 WHERE event_id = ?"
+        if check_version:
+            query += " AND version = ?"
+        return query
+
+    def get_event(self, event_id, include_archived: bool = False) -> Event:
         """
         Get event by id from database.
         :param event_id: Given event id.
+        :param include_archived: If True, look for the event in the archive as well.
         :return: Event.
         """
-        return self.get_events_by_ids([event_id])[0]
+        return self.get_events_by_ids([event_id], include_archived=include_archived)[0]
 
-    def get_events_by_ids(self, events_ids: list[str] = None) -> list[Event]:
+    def get_event_version_by_name(self, event_name: str) -> Optional[tuple[str, int]]:
+        """
+        Get the id and the version of an event by its name, without fetching the event.
+        :param event_name: Name of the event.
+        :return: Tuple of (event id, version), None if the event does not exist.
+        """
+        self.cursor.execute("SELECT event_id, version FROM events WHERE event_name=?", (event_name,))
+        return self.cursor.fetchone()
+
+    def get_event_by_name(self, event_name: str, fields: Optional[list[str]] = None) -> Union[Event, dict, None]:
+        """
+        Get an event by its name, a single probe of the unique name index.
+        :param event_name: Name of the event.
+        :param fields: If entered, return only these attributes of the event as a dict.
+        :return: The event, None if it does not exist.
+        """
+        self.cursor.execute(f"SELECT {self._select_columns(fields)} FROM events WHERE event_name=?", (event_name,))
+        result = self.cursor.fetchone()
+        if result is None:
+            return None
+        if fields:
+            return self.fetch_records([result], fields)[0]
+        return self.fetch_events([result])[0]
+
+    def get_events_by_ids(self, events_ids: list[str] = None, fields: Optional[list[str]] = None,
+                          include_archived: bool = False) -> Union[list[Event], list[dict]]:
         """
         Return all the events.
         :param events_ids: If entered, return all the events that were given. if not return all.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param include_archived: If True, return the archived events as well.
         """
+        columns = self._select_columns(fields)
+        source = self._events_source(include_archived)
         if events_ids is not None:
-            placeholders = ', '.join(['?'] * len(events_ids))
-            query = "SELECT * FROM events WHERE event_id IN ({})".format(placeholders)
-            self.cursor.execute(query, events_ids)
+            results = []
+            # The lists are padded to a few sizes, so their statements are reused.
+            for placeholders, chunk in in_list_chunks(list(dict.fromkeys(events_ids))):
+                self.cursor.execute(f"SELECT {columns} FROM {source} WHERE event_id IN ({placeholders})", chunk)
+                results.extend(self.cursor.fetchall())
         else:
-            self.cursor.execute("SELECT * FROM events")
-        results = self.cursor.fetchall()
+            self.cursor.execute(f"SELECT {columns} FROM {source}")
+            results = self.cursor.fetchall()
+        if fields:
+            return self.fetch_records(results, fields)
         return self.fetch_events(results)
 
-    def get_events(self, sort_by_attribute: Optional[str] = None, reverse: bool = False, **filters) -> list[Event]:
+    def get_events(self, sort_by_attribute: Optional[str] = None, reverse: bool = False,
+                   fields: Optional[list[str]] = None, include_archived: bool = False,
+                   **filters) -> Union[list[Event], list[dict]]:
         """
         Fetch all events with optional filtering and sorting.
         :param sort_by_attribute: The attribute to sort by (e.g., 'event_start_time', 'creation_time', 'subscribers').
         :param reverse: If True, sort in descending order. otherwise, sort in ascending order.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param include_archived: If True, return the archived events as well.
         :param filters: Key Value pairs of the attributes and values you want to filter by.
         :return: List of events that match the given filters and sorted by the provided attribute.
         """
+        filter_keys = tuple(sorted(key for key in filters if key in Event.__annotations__.keys()))
+        query = self._events_query(tuple(fields) if fields else None, include_archived, filter_keys,
+                                   sort_by_attribute, reverse)
+        self.cursor.execute(query, [filters[key] for key in filter_keys])
+        results = self.cursor.fetchall()
+        if fields:
+            return self.fetch_records(results, fields)
+        return self.fetch_events(results)
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _events_query(cls, fields: Optional[tuple[str, ...]], include_archived: bool, filter_keys: tuple[str, ...],
+                      sort_by_attribute: Optional[str], reverse: bool) -> str:
+        """
+        Build the query of get_events once per shape, so every call of a shape reuses its prepared statement.
+        :param fields: The selected attributes, None for all of them.
+        :param include_archived: If True, select from the archive as well.
+        :param filter_keys: The filtered attributes, sorted.
+        :param sort_by_attribute: The attribute to sort by.
+        :param reverse: If True, sort in descending order.
+        :return: The select query.
+        """
+        columns = cls._select_columns(fields)
+
         # Filtering query.
-        query_conditions = []
-        params = []
-        for key, value in filters.items():
-            if key in Event.__annotations__.keys():
-                query_conditions.append(f"{key} = ?")
-                params.append(value)
         where_clause = ''
-        if query_conditions:
-            where_conditions_str = ' AND '.join(query_conditions)
+        if filter_keys:
+            where_conditions_str = ' AND '.join(f"{key} = ?" for key in filter_keys)
             where_clause = f"WHERE {where_conditions_str}"
 
         # Sorting query.
@@ -142,35 +390,155 @@ class EventsHandler(DatabaseHandler):
             if sort_by_attribute not in Event.__annotations__.keys():
                 raise InvalidAttribute(sort_by_attribute)
 
-            # Counting the number of subscribers.
+            # The number of subscribers is kept in its own column.
             if sort_by_attribute == "subscribers":
-                order_by_clause = "LENGTH(subscribers) - LENGTH(REPLACE(subscribers, ',', ''))"
+                order_by_clause = "subscriber_count"
             else:
                 order_by_clause = sort_by_attribute
 
             order_direction = "DESC" if reverse else "ASC"
             order_clause = f"ORDER BY {order_by_clause} {order_direction}"
 
-        query = f"SELECT * FROM events {where_clause} {order_clause}"
-        self.cursor.execute(query, params)
+        return f"SELECT {columns} FROM {cls._events_source(include_archived)} {where_clause} {order_clause}"
+
+    def get_upcoming_events(self, start: datetime, limit: int, fields: Optional[list[str]] = None,
+                            end: Optional[datetime] = None) -> Union[list[Event], list[dict]]:
+        """
+        Fetch the next events by their start time, a range of the start time index.
+        :param start: Return the events that start at this time (UTC) or later.
+        :param limit: Max number of events to return.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param end: If entered, return only the events that start at this time (UTC) or earlier.
+        :return: The events, sorted by their start time.
+        """
+        start = as_utc(start).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        if end is None:
+            self.cursor.execute(f"SELECT {self._select_columns(fields)} FROM events WHERE event_start_time >= ? "
+                                f"ORDER BY event_start_time LIMIT ?", (start, limit))
+        else:
+            self.cursor.execute(f"SELECT {self._select_columns(fields)} FROM events WHERE event_start_time >= ? "
+                                f"AND event_start_time <= ? ORDER BY event_start_time LIMIT ?",
+                                (start, as_utc(end).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), limit))
         results = self.cursor.fetchall()
+        if fields:
+            return self.fetch_records(results, fields)
         return self.fetch_events(results)
 
+    def get_user_events(self, user_id: str) -> list[Event]:
+        """
+        Fetch all the events the user hosts or subscribed to.
+        :param user_id: ID of the user.
+        :return: List of the user events.
+        """
+        self.cursor.execute("SELECT events.* FROM user_events JOIN events ON events.event_id = user_events.event_id "
+                            "WHERE user_events.user_id = ?", (user_id,))
+        return self.fetch_events(self.cursor.fetchall())
+
+    def iter_user_events(self, user_id: str, batch_size: int = 500) -> Iterator[Event]:
+        """
+        Iterate over all the events the user hosts or subscribed to, reading them in batches.
+        :param user_id: ID of the user.
+        :param batch_size: Number of events to read at once.
+        :return: Iterator of the user events, ordered by their id.
+        """
+        last_event_id = ""
+        while True:
+            # Every batch continues from the last id, so the batches do not keep a cursor open between them.
+            self.cursor.execute("SELECT events.* FROM user_events "
+                                "JOIN events ON events.event_id = user_events.event_id "
+                                "WHERE user_events.user_id = ? AND user_events.event_id > ? "
+                                "ORDER BY user_events.event_id LIMIT ?", (user_id, last_event_id, batch_size))
+            results = self.cursor.fetchall()
+            yield from self.fetch_events(results)
+            if len(results) < batch_size:
+                return
+            last_event_id = results[-1][0]
+
+    @staticmethod
+    def _events_source(include_archived: bool) -> str:
+        """
+        Get the table to select the events from.
+        :param include_archived: If True, select from both the events and the archive.
+        :return: The source of a select query.
+        """
+        if include_archived:
+            return "(SELECT * FROM events UNION ALL SELECT * FROM events_archive)"
+        return "events"
+
+    def archive_events(self, ended_before: datetime, batch_size: int = 500) -> int:
+        """
+        Move the events that ended before the given time to the archive, in batches.
+        :param ended_before: Archive the events that ended before this time (UTC).
+        :param batch_size: Number of events to move in each transaction.
+        :return: Number of archived events.
+        """
+        cutoff = ended_before.strftime('%Y-%m-%d %H:%M:%S')
+        archived = 0
+        while True:
+            self.cursor.execute("SELECT event_id FROM events WHERE event_end_time < ? LIMIT ?", (cutoff, batch_size))
+            events_ids = [result[0] for result in self.cursor.fetchall()]
+            if not events_ids:
+                return archived
+
+            for event_id in events_ids:
+                self._count_event(event_id, -1)
+            for placeholders, chunk in in_list_chunks(events_ids):
+                self.cursor.execute(f"INSERT OR REPLACE INTO events_archive SELECT * FROM events "
+                                    f"WHERE event_id IN ({placeholders})", chunk)
+                self.cursor.execute(f"DELETE FROM events WHERE event_id IN ({placeholders})", chunk)
+                self.cursor.execute(f"DELETE FROM user_events WHERE event_id IN ({placeholders})", chunk)
+            for event_id in events_ids:
+                self._record_change("events", event_id, "archive")
+            self.conn.commit()
+            archived += len(events_ids)
+
+    @staticmethod
+    def _select_columns(fields: Optional[list[str]]) -> str:
+        """
+        Build the columns part of a select query.
+        :param fields: The requested attributes, None for all of them.
+        :return: The columns to select.
+        """
+        if not fields:
+            return "*"
+        for field in fields:
+            if field not in Event.__annotations__.keys():
+                raise InvalidAttribute(field)
+        return ', '.join(fields)
+
+    @staticmethod
+    def fetch_records(results, fields: list[str]) -> list[dict]:
+        """
+        Decode projected rows into lightweight records.
+        :param results: Rows that were selected with the given fields.
+        :param fields: The selected attributes, in the order they were selected.
+        :return: List of dicts from attribute to value.
+        """
+        decoders = [(index, field, COLUMN_DECODERS.get(field)) for index, field in enumerate(fields)]
+        records = []
+        with timed_stage("decode"):
+            for result in results:
+                records.append({field: decoder(result[index]) if decoder and result[index] is not None
+                                else result[index] for index, field, decoder in decoders})
+        return records
+
     @staticmethod
     def fetch_events(results):
         events = []
-        for result in results:
-            subscribers = json.loads(result[5])
-            events.append(
-                Event(event_id=result[0],
-                      created_user_id=result[1],
-                      event_name=result[2],
-                      event_description=result[3],
-                      location=result[4],
-                      subscribers=subscribers,
-                      event_start_time=datetime.fromisoformat(result[6]),
-                      event_end_time=datetime.fromisoformat(result[7]),
-                      creation_time=datetime.fromisoformat(result[8])))
+        with timed_stage("decode"):
+            for result in results:
+                subscribers = json.loads(result[5])
+                events.append(
+                    Event(event_id=result[0],
+                          created_user_id=result[1],
+                          event_name=result[2],
+                          event_description=result[3],
+                          location=result[4],
+                          subscribers=subscribers,
+                          event_start_time=datetime.fromisoformat(result[6]),
+                          event_end_time=datetime.fromisoformat(result[7]),
+                          creation_time=datetime.fromisoformat(result[8]),
+                          version=result[9]))
 
         return events
 
@@ -180,15 +548,7 @@ class EventsHandler(DatabaseHandler):
         :param event_id: ID of the event.
         :param user_id: ID of the new subscriber.
         """
-        event = self.get_event(event_id)
-        if user_id in event.subscribers:
-            raise UserAlreadySubscriber(user_id)
-
-        event.subscribers.append(user_id)
-        serialized_subscribers = json.dumps(event.subscribers)
-
-        self.cursor.execute("UPDATE events SET subscribers = ? WHERE event_id = ?", (serialized_subscribers, event_id))
-        self.conn.commit()
+        self._update_subscribers(event_id, user_id, "add")
 
     def remove_subscriber(self, event_id: str, user_id: str) -> None:
         """
@@ -196,12 +556,224 @@ class EventsHandler(DatabaseHandler):
         :param event_id: ID of the event.
         :param user_id: ID of the subscriber to be removed.
         """
-        event = self.get_event(event_id)
-        if user_id not in event.subscribers:
-            raise UserDoesNotASubscriber(user_id)
+        self._update_subscribers(event_id, user_id, "remove")
 
-        event.subscribers.remove(user_id)
-        serialized_subscribers = json.dumps(event.subscribers)
+    def _update_subscribers(self, event_id: str, user_id: str, action: str) -> None:
+        """
+        Add or remove a subscriber with an optimistic read-modify-write.
+        The update only applies if the event version did not change since it was read, otherwise it is retried.
+        :param event_id: ID of the event.
+        :param user_id: ID of the subscriber.
+        :param action: 'add' or 'remove'.
+        """
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            self.cursor.execute("SELECT subscribers, version FROM events WHERE event_id=?", (event_id,))
+            result = self.cursor.fetchone()
+            if not result:
+                raise EventDoesNotExist(event_id)
+
+            subscribers, version = json.loads(result[0]), result[1]
+            if action == "add":
+                if user_id in subscribers:
+                    raise UserAlreadySubscriber(user_id)
+                subscribers.append(user_id)
+            else:
+                if user_id not in subscribers:
+                    raise UserDoesNotASubscriber(user_id)
+                subscribers.remove(user_id)
 
-        self.cursor.execute("UPDATE events SET subscribers = ? WHERE event_id = ?", (serialized_subscribers, event_id))
+            self.cursor.execute("UPDATE events SET subscribers = ?, subscriber_count = ?, version = version + 1 "
+                                "WHERE event_id = ? AND version = ?",
+                                (json.dumps(subscribers), len(subscribers), event_id, version))
+            if self.cursor.rowcount == 1:
+                self._adjust_stat(STAT_SUBSCRIBERS, event_id, 1 if action == "add" else -1)
+                self._index_subscriber(event_id, user_id, action)
+                self._record_change("events", event_id, f"{action}_subscriber", {"user_id": user_id})
+                self.conn.commit()
+                return
+            self.conn.rollback()
+
+        raise EventModifiedConcurrently(event_id)
+
+    def apply_subscriber_changes(self, operations: list[tuple[str, str, str]]) -> list[Optional[Exception]]:
+        """
+        Add and remove many subscribers in one transaction, every event is read and written once.
+        Like the single subscriber updates, the events are only written if their versions did not change since
+        they were read, otherwise the whole batch is retried.
+        :param operations: Tuples of (action, event id, user id), where action is 'add' or 'remove'.
+        :return: For each operation, None if it was applied, otherwise the error.
+        """
+        event_ids = list(dict.fromkeys(event_id for _, event_id, _ in operations))
+        for _ in range(MAX_WRITE_ATTEMPTS):
+            records = self.get_events_by_ids(event_ids, fields=["event_id", "subscribers", "version"])
+            subscribers = {record["event_id"]: record["subscribers"] for record in records}
+            versions = {record["event_id"]: record["version"] for record in records}
+
+            results = []
+            changed_events = []
+            applied = []
+            for action, event_id, user_id in operations:
+                event_subscribers = subscribers.get(event_id)
+                if event_subscribers is None:
+                    results.append(EventDoesNotExist(event_id))
+                elif action == "add" and user_id in event_subscribers:
+                    results.append(UserAlreadySubscriber(user_id))
+                elif action == "remove" and user_id not in event_subscribers:
+                    results.append(UserDoesNotASubscriber(user_id))
+                elif action not in ("add", "remove"):
+                    results.append(InvalidAttribute(action))
+                else:
+                    if action == "add":
+                        event_subscribers.append(user_id)
+                    else:
+                        event_subscribers.remove(user_id)
+                    if event_id not in changed_events:
+                        changed_events.append(event_id)
+                    applied.append((action, event_id, user_id))
+                    results.append(None)
+
+            try:
+                conflict = False
+                for event_id in changed_events:
+                    self.cursor.execute("UPDATE events SET subscribers = ?, subscriber_count = ?, "
+                                        "version = version + 1 WHERE event_id = ? AND version = ?",
+                                        (json.dumps(subscribers[event_id]), len(subscribers[event_id]), event_id,
+                                         versions[event_id]))
+                    if self.cursor.rowcount != 1:
+                        conflict = True
+                        break
+                if conflict:
+                    self.conn.rollback()
+                    continue
+                for action, event_id, user_id in applied:
+                    self._adjust_stat(STAT_SUBSCRIBERS, event_id, 1 if action == "add" else -1)
+                    self._index_subscriber(event_id, user_id, action)
+                    self._record_change("events", event_id, f"{action}_subscriber", {"user_id": user_id})
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return results
+
+        raise EventModifiedConcurrently(event_ids)
+
+    def _create_stats(self):
+        """
+        Create the aggregates table, and fill it from the existing events when it is new.
+        The aggregates are incremented by the writers, so they are filled in the transaction of the migration and not
+        by a backfill.
+        """
+        self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='event_stats'")
+        is_new = self.cursor.fetchone() is None
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_stats
+            (kind TEXT,
+            key TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key))
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS event_stats_count ON event_stats (kind, count)")
+        if is_new:
+            self._count_all_events()
+
+    def rebuild_stats(self):
+        """
+        Recompute all the aggregates from the events table.
+        """
+        self.cursor.execute("DELETE FROM event_stats")
+        self._count_all_events()
         self.conn.commit()
+
+    def _count_all_events(self):
+        """
+        Add all the events to the aggregates, without committing.
+        """
+        self.cursor.execute("SELECT event_id FROM events")
+        for (event_id,) in self.cursor.fetchall():
+            self._count_event(event_id, 1)
+
+    def _adjust_stat(self, kind: str, key: str, delta: int):
+        """
+        Add to an aggregate, should be called by mutations before their commit.
+        :param kind: Kind of the aggregate.
+        :param key: What is counted.
+        :param delta: Value to add.
+        """
+        if delta == 0:
+            return
+        self.cursor.execute("INSERT INTO event_stats (kind, key, count) VALUES (?, ?, ?) "
+                            "ON CONFLICT(kind, key) DO UPDATE SET count = count + excluded.count", (kind, key, delta))
+        if delta < 0:
+            self.cursor.execute("DELETE FROM event_stats WHERE kind = ? AND key = ? AND count <= 0", (kind, key))
+
+    def _count_event(self, event_id: str, sign: int):
+        """
+        Add (or subtract) an event in the aggregates, by its current row.
+        :param event_id: ID of the event.
+        :param sign: 1 to add the event, -1 to subtract it.
+        """
+        self.cursor.execute("SELECT location, created_user_id, event_start_time, subscribers FROM events "
+                            "WHERE event_id=?", (event_id,))
+        result = self.cursor.fetchone()
+        if not result:
+            return
+        location, created_user_id, event_start_time, subscribers = result
+        self._adjust_stat(STAT_LOCATION, location, sign)
+        self._adjust_stat(STAT_HOST, created_user_id, sign)
+        self._adjust_stat(STAT_DAY, str(event_start_time)[:10], sign)
+        self._adjust_stat(STAT_SUBSCRIBERS, event_id, sign * len(json.loads(subscribers)))
+
+    def get_stats(self, top: int = 10, from_day: Optional[str] = None, days: int = 30,
+                  rankings_top: Optional[int] = None) -> dict:
+        """
+        Get the maintained aggregates, every part is read by an index.
+        :param top: Number of entries in each ranking, negative for all of them.
+        :param from_day: First day (YYYY-MM-DD) of the upcoming counts, defaults to today.
+        :param days: Max number of days in the upcoming counts.
+        :param rankings_top: Number of entries in the locations and the hosts rankings, if it is not top.
+        :return: The rankings of the events by subscribers, the locations and the hosts, and the events per day.
+        """
+        rankings_top = top if rankings_top is None else rankings_top
+        from_day = from_day if from_day is not None else datetime.now().strftime('%Y-%m-%d')
+        self.cursor.execute("SELECT event_stats.key, event_stats.count, events.event_name FROM event_stats "
+                            "JOIN events ON events.event_id = event_stats.key WHERE kind = ? "
+                            "ORDER BY count DESC LIMIT ?", (STAT_SUBSCRIBERS, top))
+        popular_events = [{"event_id": result[0], "event_name": result[2], "subscribers": result[1]}
+                          for result in self.cursor.fetchall()]
+
+        rankings = {kind: [{kind: key, "events": count} for key, count in self.get_ranking(kind, rankings_top)]
+                    for kind in (STAT_LOCATION, STAT_HOST)}
+
+        self.cursor.execute("SELECT key, count FROM event_stats WHERE kind = ? AND key >= ? ORDER BY key LIMIT ?",
+                            (STAT_DAY, from_day, days))
+        upcoming_days = [{"day": result[0], "events": result[1]} for result in self.cursor.fetchall()]
+
+        return {"popular_events": popular_events,
+                "locations": rankings[STAT_LOCATION],
+                "hosts": rankings[STAT_HOST],
+                "upcoming_days": upcoming_days}
+
+    def get_ranking(self, kind: str, limit: int) -> list[tuple[str, int]]:
+        """
+        Get the aggregates with the largest counts, a range of the counts index.
+        :param kind: Kind of the aggregates.
+        :param limit: Max number of aggregates, negative for all of them.
+        :return: List of (key, count), by the count in descending order.
+        """
+        self.cursor.execute("SELECT key, count FROM event_stats WHERE kind = ? ORDER BY count DESC LIMIT ?",
+                            (kind, limit))
+        return self.cursor.fetchall()
+
+    def get_stat_counts(self, kind: str, keys: list[str]) -> dict[str, int]:
+        """
+        Get aggregates by their keys, each one is read by the primary key.
+        :param kind: Kind of the aggregates.
+        :param keys: What is counted.
+        :return: The count of every key that has one.
+        """
+        counts = {}
+        for placeholders, chunk in in_list_chunks(keys):
+            self.cursor.execute(f"SELECT key, count FROM event_stats WHERE kind = ? AND key IN ({placeholders})",
+                                [kind] + chunk)
+            counts.update(self.cursor.fetchall())
+        return counts
@@ -0,0 +1,196 @@
+"""
+Idempotency keys handler file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+from core.database_handler import DatabaseHandler, DATABASE_NAME
+from core.exceptions import RemindMeBaseException
+from core.migrations import Migration
+from core.utils import DateTimeEncoder
+
+# ----- Constants ----- #
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # Seconds a key and its response are kept.
+# Seconds a running request holds its key, a retry after that takes the key over (the first request crashed).
+CLAIM_LEASE = 10
+PURGE_INTERVAL = 60  # Seconds between two deletions of the expired keys.
+
+
+# ----- Exceptions ----- #
+
+
+class IdempotentRequestInProgress(RemindMeBaseException):
+    """
+    A request with the same idempotency key is still running exception.
+    """
+    pass
+
+
+class IdempotencyKeyReused(RemindMeBaseException):
+    """
+    An idempotency key was sent again with different request parameters exception.
+    """
+    pass
+
+
+# ----- Classes ----- #
+
+class IdempotencyHandler(DatabaseHandler):
+    # Time of the next deletion of the expired keys of every database, shared by the handlers of the process.
+    _next_purge: dict[str, float] = {}
+
+    def __init__(self, database_file: Union[str, Path] = DATABASE_NAME, ttl: float = IDEMPOTENCY_KEY_TTL,
+                 lease: float = CLAIM_LEASE, purge_interval: float = PURGE_INTERVAL, pooled: bool = False):
+        """
+        Init the idempotency keys handler, that stores the responses of the create requests by their keys,
+        so a retried request returns the first response instead of running again.
+        :param database_file: The database.
+        :param ttl: Seconds a key and its response are kept.
+        :param lease: Seconds a running request holds its key.
+        :param purge_interval: Seconds between two deletions of the expired keys.
+        :param pooled: If True, take a connection of the pool, it is given back by close.
+        """
+        super().__init__(database_file, pooled)
+        self.ttl = ttl
+        self.lease = lease
+        self.purge_interval = purge_interval
+        self._migrate("idempotency_keys", [
+            Migration(1, "Create the idempotency keys table", IdempotencyHandler._create_idempotency_table),
+            Migration(2, "Add the claim time and the request hash of the keys", IdempotencyHandler._add_claims),
+        ])
+
+    def _create_idempotency_table(self):
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys
+            (idempotency_key TEXT,
+            route TEXT,
+            response TEXT,
+            creation_time REAL,
+            PRIMARY KEY (idempotency_key, route))
+        ''')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idempotency_keys_creation_time "
+                            "ON idempotency_keys (creation_time)")
+
+    def _add_claims(self):
+        self._add_missing_column("idempotency_keys", "claimed_at", "REAL")
+        self._add_missing_column("idempotency_keys", "request_hash", "TEXT")
+
+    def begin(self, idempotency_key: str, route: str,
+              request_hash: Optional[str] = None) -> tuple[Optional[dict], Optional[float]]:
+        """
+        Claim a key before running its request.
+        :param idempotency_key: The key the client sent.
+        :param route: The route of the request.
+        :param request_hash: Hash of the parameters of the request (see hash_request), None to not check them.
+        :return: Tuple of (the stored response, None) if the request already ran, or (None, the claim time) if it
+                 should run now, the claim time is passed to complete or abort.
+        :raise IdempotentRequestInProgress: If another request holds the key and its lease did not expire.
+        :raise IdempotencyKeyReused: If the key was used by a request with other parameters.
+        """
+        now = time.time()
+        self._purge_expired_keys(now)
+        try:
+            self.cursor.execute("INSERT INTO idempotency_keys "
+                                "(idempotency_key, route, response, creation_time, claimed_at, request_hash) "
+                                "VALUES (?, ?, NULL, ?, ?, ?)", (idempotency_key, route, now, now, request_hash))
+            self.conn.commit()
+            return None, now
+        except sqlite3.IntegrityError:
+            self.conn.commit()
+
+        self.cursor.execute("SELECT response, creation_time, claimed_at, request_hash FROM idempotency_keys "
+                            "WHERE idempotency_key=? AND route=?", (idempotency_key, route))
+        result = self.cursor.fetchone()
+        if not result:
+            # Released meanwhile, the retry should claim it again.
+            raise IdempotentRequestInProgress(idempotency_key)
+        response, creation_time, claimed_at, stored_hash = result
+        if creation_time < now - self.ttl:
+            # Expired and not purged yet, the request runs again.
+            if self._take_over(idempotency_key, route, "creation_time", creation_time, now, request_hash):
+                return None, now
+            raise IdempotentRequestInProgress(idempotency_key)
+        if request_hash is not None and stored_hash is not None and request_hash != stored_hash:
+            raise IdempotencyKeyReused(idempotency_key)
+        if response is not None:
+            return json.loads(response), None
+        if (claimed_at or creation_time) < now - self.lease and \
+                self._take_over(idempotency_key, route, "claimed_at", claimed_at, now, request_hash):
+            return None, now
+        raise IdempotentRequestInProgress(idempotency_key)
+
+    def _take_over(self, idempotency_key: str, route: str, column: str, value: Optional[float], now: float,
+                   request_hash: Optional[str]) -> bool:
+        """
+        Claim a key of an expired request, unless another retry claimed it since it was read.
+        :param column: Time column that was read ('creation_time' or 'claimed_at').
+        :param value: Its value that was read.
+        :return: True if the key is claimed by this request.
+        """
+        self.cursor.execute(f"UPDATE idempotency_keys SET response=NULL, creation_time=?, claimed_at=?, "
+                            f"request_hash=? WHERE idempotency_key=? AND route=? AND {column} IS ?",
+                            (now, now, request_hash, idempotency_key, route, value))
+        claimed = self.cursor.rowcount == 1
+        self.conn.commit()
+        return claimed
+
+    def _purge_expired_keys(self, now: float):
+        """
+        Delete the expired keys, at most once per purge interval in the process.
+        :param now: The current time.
+        """
+        path = str(self._users_database_path.resolve())
+        if now < IdempotencyHandler._next_purge.get(path, 0):
+            return
+        IdempotencyHandler._next_purge[path] = now + self.purge_interval
+        self.cursor.execute("DELETE FROM idempotency_keys WHERE creation_time < ?", (now - self.ttl,))
+        self.conn.commit()
+
+    def complete(self, idempotency_key: str, route: str, claimed_at: float, response: dict) -> bool:
+        """
+        Store the response of a request, if it still holds its claim.
+        :param idempotency_key: The key the client sent.
+        :param route: The route of the request.
+        :param claimed_at: The claim time that begin returned.
+        :param response: The json response.
+        :return: False if the claim was lost, a retry took the key over after the lease expired.
+        """
+        self.cursor.execute("UPDATE idempotency_keys SET response=? WHERE idempotency_key=? AND route=? "
+                            "AND claimed_at=?", (json.dumps(response), idempotency_key, route, claimed_at))
+        completed = self.cursor.rowcount == 1
+        self.conn.commit()
+        return completed
+
+    def abort(self, idempotency_key: str, route: str, claimed_at: float) -> bool:
+        """
+        Release a key of a failed request, so it can be retried, if it still holds its claim.
+        :param idempotency_key: The key the client sent.
+        :param route: The route of the request.
+        :param claimed_at: The claim time that begin returned.
+        :return: False if the claim was lost, the claim of the retry that took the key over is kept.
+        """
+        self.cursor.execute("DELETE FROM idempotency_keys WHERE idempotency_key=? AND route=? AND claimed_at=?",
+                            (idempotency_key, route, claimed_at))
+        released = self.cursor.rowcount == 1
+        self.conn.commit()
+        return released
+
+
+# ----- Functions ----- #
+
+def hash_request(parameters: dict) -> str:
+    """
+    Hash the parameters of a request, to detect a key that is sent again with other parameters.
+    :param parameters: The parameters, by their names.
+    :return: The hex digest.
+    """
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True, cls=DateTimeEncoder).encode()).hexdigest()
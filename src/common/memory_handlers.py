@@ -0,0 +1,505 @@
+"""
+In memory storage engine file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import dataclasses
+import heapq
+import json
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Union
+
+from common.events_handler import STAT_SUBSCRIBERS, STAT_LOCATION, STAT_HOST, STAT_DAY, COLUMN_DECODERS
+from core.event import Event, EventAlreadyExist, ModifyChangesAreInvalid, InvalidAttribute, \
+    UserDoesNotASubscriber, UserAlreadySubscriber, EventDoesNotExist, EventVersionMismatch
+from core.storage import Storage, UsersStorage, EventsStorage
+from core.user import User, UserAlreadyExist, UserDoesNotExist, EventAlreadyInUser, EventDoesNotInUser
+from core.utils import DateTimeEncoder, as_utc, generate_unique_id, hash_password, compare_hashes
+
+
+# ----- Classes ----- #
+
+class MemoryStore:
+    """
+    The tables and the indexes of one in memory database, shared by all the handlers that open it.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users: dict[str, User] = {}
+        self.users_by_name: dict[str, str] = {}
+        self.events: dict[str, Event] = {}
+        self.events_by_name: dict[str, str] = {}
+        self.events_archive: dict[str, Event] = {}
+        self.events_by_user: dict[str, set[str]] = {}  # Events each user hosts or subscribed to.
+        self.stats: dict[str, Counter] = {kind: Counter() for kind in
+                                          (STAT_SUBSCRIBERS, STAT_LOCATION, STAT_HOST, STAT_DAY)}
+        self.table_versions: Counter = Counter()
+        self.changes: list[tuple] = []
+        self.trimmed_changes = 0  # Changes deleted from the start of the log.
+
+
+class MemoryDatabaseHandler(Storage):
+    """
+    Base of the in memory handlers, the counterpart of the sqlite DatabaseHandler.
+    """
+    _stores: dict[str, MemoryStore] = {}
+    _stores_lock = threading.Lock()
+
+    def __init__(self, database_name: Union[str, Path]):
+        """
+        Init the handler class.
+        :param database_name: Name of the database, handlers with the same name share the same data.
+        """
+        with self._stores_lock:
+            self.store = self._stores.setdefault(str(database_name), MemoryStore())
+
+    @classmethod
+    def drop(cls, database_name: Union[str, Path]):
+        """
+        Delete all the data of a database.
+        :param database_name: Name of the database.
+        """
+        with cls._stores_lock:
+            cls._stores.pop(str(database_name), None)
+
+    def _record_change(self, table_name: str, entity_id: str, operation: str, data: Optional[dict] = None):
+        """
+        Append a mutation to the change log and increase the table version, should be called with the store lock.
+        :param table_name: The mutated table.
+        :param entity_id: ID of the mutated row.
+        :param operation: What was done (e.g. 'add', 'remove', 'modify').
+        :param data: The changed values.
+        """
+        self.store.table_versions[table_name] += 1
+        sequence = self.store.trimmed_changes + len(self.store.changes) + 1
+        self.store.changes.append((sequence, table_name, entity_id, operation, json.dumps(data, cls=DateTimeEncoder),
+                                   str(datetime.now())))
+
+    def get_changes(self, since: int = 0, limit: int = 100) -> list[dict]:
+        with self.store.lock:
+            # The sequence numbers are the positions in the log, starting from 1, including the trimmed changes.
+            start = max(since - self.store.trimmed_changes, 0)
+            changes = self.store.changes[start:start + limit]
+        return [{"sequence": change[0],
+                 "table": change[1],
+                 "entity_id": change[2],
+                 "operation": change[3],
+                 "data": json.loads(change[4]),
+                 "time": change[5]} for change in changes]
+
+    def get_last_change_sequence(self) -> int:
+        with self.store.lock:
+            return self.store.trimmed_changes + len(self.store.changes)
+
+    def get_first_change_sequence(self) -> int:
+        with self.store.lock:
+            return self.store.trimmed_changes + 1 if self.store.changes else 0
+
+    def trim_changes(self, keep: int) -> int:
+        with self.store.lock:
+            deleted = max(len(self.store.changes) - keep, 0)
+            del self.store.changes[:deleted]
+            self.store.trimmed_changes += deleted
+        return deleted
+
+    def get_version(self, table_name: str) -> int:
+        return self.store.table_versions[table_name]
+
+    def close(self):
+        pass
+
+
+class MemoryUsersHandler(MemoryDatabaseHandler, UsersStorage):
+    def add_user(self, user: User, password: str) -> str:
+        hashed_password = hash_password(password)
+        with self.store.lock:
+            if user.user_name in self.store.users_by_name:
+                raise UserAlreadyExist("A user with this name already exists.")
+
+            user.user_id = user.user_id or generate_unique_id()
+            user.hashed_password = hashed_password
+            self.store.users[user.user_id] = User(user.user_id, user.user_name, user.user_mail, hashed_password)
+            self.store.users_by_name[user.user_name] = user.user_id
+            self._record_change("users", user.user_id, "add", {"user_name": user.user_name})
+        return user.user_id
+
+    def get_user(self, user_id: str) -> User:
+        user = self.store.users.get(user_id)
+        if user is None:
+            raise UserDoesNotExist()
+        # Like the sqlite engine, the hosted events are not part of the fetched user.
+        return User(user_id=user.user_id, user_name=user.user_name, user_mail=user.user_mail,
+                    hashed_password=user.hashed_password)
+
+    def remove_user(self, user_id: str):
+        with self.store.lock:
+            user = self.store.users.pop(user_id, None)
+            if user is None:
+                raise UserDoesNotExist()
+            del self.store.users_by_name[user.user_name]
+            self._record_change("users", user_id, "remove")
+
+    def add_event_to_user(self, user_id: str, event_id: str):
+        with self.store.lock:
+            user = self.store.users.get(user_id)
+            if user is None:
+                raise UserDoesNotExist()
+            if event_id in user.hosts_events:
+                raise EventAlreadyInUser()
+            user.hosts_events.append(event_id)
+            self._record_change("users", user_id, "add_event", {"event_id": event_id})
+
+    def remove_event_from_user(self, user_id: str, event_id: str):
+        with self.store.lock:
+            user = self.store.users.get(user_id)
+            if user is None:
+                raise UserDoesNotExist()
+            if event_id not in user.hosts_events:
+                raise EventDoesNotInUser()
+            user.hosts_events.remove(event_id)
+            self._record_change("users", user_id, "remove_event", {"event_id": event_id})
+
+    def get_existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        return {user_id for user_id in user_ids if user_id in self.store.users}
+
+    def get_user_id_by_name(self, user_name: str) -> str:
+        user_id = self.store.users_by_name.get(user_name)
+        if user_id is None:
+            raise UserDoesNotExist(user_name)
+        return user_id
+
+    def login(self, user_name: str, password: str) -> str:
+        user_id = self.store.users_by_name.get(user_name)
+        if user_id is None:
+            raise UserDoesNotExist(f"User with name '{user_name}' does not exist.")
+        if not compare_hashes(password, self.store.users[user_id].hashed_password):
+            raise ValueError("Incorrect password.")
+        return user_id
+
+
+class MemoryEventsHandler(MemoryDatabaseHandler, EventsStorage):
+    def add_event(self, event: Event) -> str:
+        event.event_id = event.event_id or generate_unique_id()
+        stored = self._decode(dataclasses.replace(event, subscribers=list(event.subscribers),
+                                                  creation_time=datetime.now(), version=0))
+        with self.store.lock:
+            if event.event_name in self.store.events_by_name or event.event_id in self.store.events:
+                event.event_id = None
+                raise EventAlreadyExist(event.event_name)
+            self._insert(stored)
+            self._record_change("events", event.event_id, "add",
+                                {"event_name": event.event_name, "created_user_id": event.created_user_id,
+                                 "location": event.location, "event_start_time": event.event_start_time,
+                                 "event_end_time": event.event_end_time})
+        return event.event_id
+
+    def remove_event(self, event_id: str):
+        with self.store.lock:
+            if event_id in self.store.events:
+                self._delete(event_id)
+            self.store.events_archive.pop(event_id, None)
+            self._record_change("events", event_id, "remove")
+
+    def modify_event(self, event_id: str, expected_version: Optional[int] = None, **changes) -> None:
+        applied_changes = {key: value for key, value in changes.items()
+                           if key in Event.__annotations__.keys() and key != "version"}
+        if not applied_changes:
+            raise ModifyChangesAreInvalid(changes)
+
+        with self.store.lock:
+            event = self.store.events.get(event_id)
+            if event is None:
+                # Like the update statement of the sqlite engine, a missing event is only reported by its version.
+                if expected_version is not None:
+                    raise EventDoesNotExist(event_id)
+                return
+            if expected_version is not None and event.version != expected_version:
+                raise EventVersionMismatch(expected_version, event.version)
+            new_name = applied_changes.get("event_name", event.event_name)
+            if self.store.events_by_name.get(new_name, event_id) != event_id:
+                raise EventAlreadyExist(new_name)
+
+            modified = self._decode(dataclasses.replace(event, **applied_changes, version=event.version + 1))
+            modified.subscribers = list(modified.subscribers)
+            self._delete(event_id)
+            self._insert(modified)
+            self._record_change("events", event_id, "modify", applied_changes)
+
+    def get_event(self, event_id: str, include_archived: bool = False) -> Event:
+        return self.get_events_by_ids([event_id], include_archived=include_archived)[0]
+
+    def get_event_by_name(self, event_name: str, fields: Optional[list[str]] = None) -> Union[Event, dict, None]:
+        self._check_fields(fields)
+        with self.store.lock:
+            event_id = self.store.events_by_name.get(event_name)
+            if event_id is None:
+                return None
+            return self._fetch([self.store.events[event_id]], fields)[0]
+
+    def get_event_version_by_name(self, event_name: str) -> Optional[tuple[str, int]]:
+        with self.store.lock:
+            event_id = self.store.events_by_name.get(event_name)
+            if event_id is None:
+                return None
+            return event_id, self.store.events[event_id].version
+
+    def get_events_by_ids(self, events_ids: list[str] = None, fields: Optional[list[str]] = None,
+                          include_archived: bool = False) -> Union[list[Event], list[dict]]:
+        self._check_fields(fields)
+        with self.store.lock:
+            if events_ids is None:
+                events = self._all_events(include_archived)
+            else:
+                events = []
+                for event_id in dict.fromkeys(events_ids):
+                    event = self.store.events.get(event_id)
+                    if event is None and include_archived:
+                        event = self.store.events_archive.get(event_id)
+                    if event is not None:
+                        events.append(event)
+            return self._fetch(events, fields)
+
+    def get_events(self, sort_by_attribute: Optional[str] = None, reverse: bool = False,
+                   fields: Optional[list[str]] = None, include_archived: bool = False,
+                   **filters) -> Union[list[Event], list[dict]]:
+        self._check_fields(fields)
+        filters = {key: self._decode_value(key, value) for key, value in filters.items()
+                   if key in Event.__annotations__.keys()}
+        if sort_by_attribute and sort_by_attribute not in Event.__annotations__.keys():
+            raise InvalidAttribute(sort_by_attribute)
+
+        with self.store.lock:
+            events = [event for event in self._all_events(include_archived)
+                      if all(getattr(event, key) == value for key, value in filters.items())]
+            if sort_by_attribute == "subscribers":
+                events.sort(key=lambda event: len(event.subscribers), reverse=reverse)
+            elif sort_by_attribute:
+                # Missing values first, like the NULLs of sqlite.
+                events.sort(key=lambda event: (getattr(event, sort_by_attribute) is not None,
+                                               getattr(event, sort_by_attribute)), reverse=reverse)
+            return self._fetch(events, fields)
+
+    def get_upcoming_events(self, start: datetime, limit: int, fields: Optional[list[str]] = None,
+                            end: Optional[datetime] = None) -> Union[list[Event], list[dict]]:
+        self._check_fields(fields)
+        start = as_utc(start)
+        end = as_utc(end) if end is not None else None
+        with self.store.lock:
+            events = heapq.nsmallest(limit, (event for event in self.store.events.values()
+                                             if as_utc(event.event_start_time) >= start and
+                                             (end is None or as_utc(event.event_start_time) <= end)),
+                                     key=lambda event: as_utc(event.event_start_time))
+            return self._fetch(events, fields)
+
+    def get_user_events(self, user_id: str) -> list[Event]:
+        with self.store.lock:
+            return self._fetch([self.store.events[event_id]
+                                for event_id in self.store.events_by_user.get(user_id, ())], None)
+
+    def archive_events(self, ended_before: datetime, batch_size: int = 500) -> int:
+        ended_before = as_utc(ended_before)
+        with self.store.lock:
+            events_ids = [event.event_id for event in self.store.events.values()
+                          if as_utc(event.event_end_time) < ended_before]
+            for event_id in events_ids:
+                self.store.events_archive[event_id] = self._delete(event_id)
+                self._record_change("events", event_id, "archive")
+        return len(events_ids)
+
+    def add_subscriber(self, event_id: str, user_id: str) -> None:
+        self._update_subscribers(event_id, user_id, "add")
+
+    def remove_subscriber(self, event_id: str, user_id: str) -> None:
+        self._update_subscribers(event_id, user_id, "remove")
+
+    def _update_subscribers(self, event_id: str, user_id: str, action: str) -> None:
+        """
+        Add or remove a subscriber, the store lock makes the read-modify-write atomic.
+        :param event_id: ID of the event.
+        :param user_id: ID of the subscriber.
+        :param action: 'add' or 'remove'.
+        """
+        with self.store.lock:
+            event = self.store.events.get(event_id)
+            if event is None:
+                raise EventDoesNotExist(event_id)
+            if action == "add" and user_id in event.subscribers:
+                raise UserAlreadySubscriber(user_id)
+            if action == "remove" and user_id not in event.subscribers:
+                raise UserDoesNotASubscriber(user_id)
+            self._apply_subscriber(event, action, user_id)
+            event.version += 1
+
+    def apply_subscriber_changes(self, operations: list[tuple[str, str, str]]) -> list[Optional[Exception]]:
+        with self.store.lock:
+            results = []
+            changed_events = set()
+            for action, event_id, user_id in operations:
+                event = self.store.events.get(event_id)
+                if event is None:
+                    results.append(EventDoesNotExist(event_id))
+                elif action == "add" and user_id in event.subscribers:
+                    results.append(UserAlreadySubscriber(user_id))
+                elif action == "remove" and user_id not in event.subscribers:
+                    results.append(UserDoesNotASubscriber(user_id))
+                elif action not in ("add", "remove"):
+                    results.append(InvalidAttribute(action))
+                else:
+                    self._apply_subscriber(event, action, user_id)
+                    changed_events.add(event_id)
+                    results.append(None)
+
+            for event_id in changed_events:
+                self.store.events[event_id].version += 1
+            return results
+
+    def get_stats(self, top: int = 10, from_day: Optional[str] = None, days: int = 30,
+                  rankings_top: Optional[int] = None) -> dict:
+        rankings_top = top if rankings_top is None else rankings_top
+        rankings_top = rankings_top if rankings_top >= 0 else None
+        from_day = from_day if from_day is not None else datetime.now().strftime('%Y-%m-%d')
+        top = top if top >= 0 else None
+        with self.store.lock:
+            stats = self.store.stats
+            popular_events = [{"event_id": event_id, "event_name": self.store.events[event_id].event_name,
+                               "subscribers": count}
+                              for event_id, count in stats[STAT_SUBSCRIBERS].most_common(top)]
+            rankings = {kind: [{kind: key, "events": count} for key, count in stats[kind].most_common(rankings_top)]
+                        for kind in (STAT_LOCATION, STAT_HOST)}
+            upcoming_days = [{"day": day, "events": stats[STAT_DAY][day]}
+                             for day in sorted(day for day in stats[STAT_DAY] if day >= from_day)[:days]]
+
+        return {"popular_events": popular_events,
+                "locations": rankings[STAT_LOCATION],
+                "hosts": rankings[STAT_HOST],
+                "upcoming_days": upcoming_days}
+
+    def _all_events(self, include_archived: bool) -> list[Event]:
+        """
+        Get the stored events, should be called with the store lock.
+        :param include_archived: If True, return the archived events as well.
+        :return: The stored (not copied) events.
+        """
+        events = list(self.store.events.values())
+        if include_archived:
+            events.extend(self.store.events_archive.values())
+        return events
+
+    def _insert(self, event: Event):
+        """
+        Store an event and add it to the indexes and the aggregates, should be called with the store lock.
+        :param event: The event to store.
+        """
+        self.store.events[event.event_id] = event
+        self.store.events_by_name[event.event_name] = event.event_id
+        for user_id in {event.created_user_id, *event.subscribers}:
+            self.store.events_by_user.setdefault(user_id, set()).add(event.event_id)
+        self._count_event(event, 1)
+
+    def _delete(self, event_id: str) -> Event:
+        """
+        Remove an event from the events, the indexes and the aggregates, should be called with the store lock.
+        :param event_id: ID of the event.
+        :return: The removed event.
+        """
+        event = self.store.events.pop(event_id)
+        del self.store.events_by_name[event.event_name]
+        for user_id in {event.created_user_id, *event.subscribers}:
+            self.store.events_by_user[user_id].discard(event_id)
+        self._count_event(event, -1)
+        return event
+
+    def _apply_subscriber(self, event: Event, action: str, user_id: str):
+        """
+        Add or remove a validated subscriber, should be called with the store lock.
+        :param event: The stored event.
+        :param action: 'add' or 'remove'.
+        :param user_id: ID of the subscriber.
+        """
+        if action == "add":
+            event.subscribers.append(user_id)
+            self.store.events_by_user.setdefault(user_id, set()).add(event.event_id)
+        else:
+            event.subscribers.remove(user_id)
+            if user_id != event.created_user_id:
+                self.store.events_by_user[user_id].discard(event.event_id)
+        self._adjust_stat(STAT_SUBSCRIBERS, event.event_id, 1 if action == "add" else -1)
+        self._record_change("events", event.event_id, f"{action}_subscriber", {"user_id": user_id})
+
+    def _adjust_stat(self, kind: str, key: str, delta: int):
+        """
+        Add to an aggregate, the keys that reach zero are removed.
+        :param kind: Kind of the aggregate.
+        :param key: What is counted.
+        :param delta: Value to add.
+        """
+        if delta == 0:
+            return
+        counter = self.store.stats[kind]
+        counter[key] += delta
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _count_event(self, event: Event, sign: int):
+        """
+        Add (or subtract) an event in the aggregates.
+        :param event: The event.
+        :param sign: 1 to add the event, -1 to subtract it.
+        """
+        self._adjust_stat(STAT_LOCATION, event.location, sign)
+        self._adjust_stat(STAT_HOST, event.created_user_id, sign)
+        self._adjust_stat(STAT_DAY, str(event.event_start_time)[:10], sign)
+        self._adjust_stat(STAT_SUBSCRIBERS, event.event_id, sign * len(event.subscribers))
+
+    @classmethod
+    def _decode(cls, event: Event) -> Event:
+        """
+        Convert the attributes of an event to the types the sqlite engine returns.
+        :param event: The event.
+        :return: The same event.
+        """
+        for key in COLUMN_DECODERS:
+            if key != "subscribers":
+                setattr(event, key, cls._decode_value(key, getattr(event, key)))
+        return event
+
+    @staticmethod
+    def _decode_value(key: str, value):
+        """
+        Convert an attribute value that is given as it is stored in sqlite (e.g. a time string).
+        :param key: Name of the attribute.
+        :param value: The value.
+        :return: The decoded value.
+        """
+        if isinstance(value, str) and key in COLUMN_DECODERS:
+            return COLUMN_DECODERS[key](value)
+        return value
+
+    @staticmethod
+    def _check_fields(fields: Optional[list[str]]):
+        """
+        Validate the requested attributes.
+        :param fields: The requested attributes, None for all of them.
+        """
+        for field in fields or ():
+            if field not in Event.__annotations__.keys():
+                raise InvalidAttribute(field)
+
+    @staticmethod
+    def _fetch(events: list[Event], fields: Optional[list[str]]) -> Union[list[Event], list[dict]]:
+        """
+        Copy stored events, so the callers can not change the store.
+        :param events: The stored events.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :return: Copies of the events, or records of the requested attributes.
+        """
+        if fields:
+            return [{field: list(event.subscribers) if field == "subscribers" else getattr(event, field)
+                     for field in fields} for event in events]
+        return [dataclasses.replace(event, subscribers=list(event.subscribers)) for event in events]
@@ -5,34 +5,109 @@ Date: 22/10/2023
 """
 # ----- Imports ----- #
 
-from datetime import datetime
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Union, Optional
+from typing import Iterator, Union, Optional
 
 from common.events_handler import EventsHandler
+from common.memory_handlers import MemoryUsersHandler, MemoryEventsHandler
+from common.sharded_handlers import ShardedUsersHandler, ShardedEventsHandler, DEFAULT_SHARDS
 from common.users_handler import UsersHandler
-from core.user import User
-from core.event import Event
+from core.interval_index import IntervalIndex
+from core.storage import STORAGE_SQLITE, STORAGE_MEMORY, STORAGE_SHARDED, UsersStorage, EventsStorage, \
+    UnknownStorage
+from core.user import User, UserDoesNotExist
+from core.event import Event, EventConflict
+from core.utils import as_utc
 
 # ----- Constants ----- #
 
 USERS_DATABASE_NAME = "data.db"
 EVENTS_DATABASE_NAME = "data.db"
+SCHEDULE_CACHE_SIZE = 1024  # Users whose interval index is kept.
+
+# The users and the events handlers of each storage engine.
+STORAGE_ENGINES = {
+    STORAGE_SQLITE: (UsersHandler, EventsHandler),
+    STORAGE_MEMORY: (MemoryUsersHandler, MemoryEventsHandler),
+    STORAGE_SHARDED: (ShardedUsersHandler, ShardedEventsHandler),
+}
 
 
 # ----- Classes ----- #
 
+class ScheduleCache:
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: Number of schedules to keep.
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, version: int) -> Optional[IntervalIndex]:
+        """
+        Get the schedule of a user.
+        :param key: The events database and the user.
+        :param version: The current version of the events table.
+        :return: The schedule if it was built in the current version, None otherwise.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: tuple, version: int, schedule: IntervalIndex):
+        """
+        Store the schedule of a user, evicting the least recently used one.
+        """
+        with self.lock:
+            self.entries[key] = (version, schedule)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
 class CombinedHandler:
+    # Schedules of the users, shared by the handlers of the process (a handler is created for every request).
+    _schedules = ScheduleCache(SCHEDULE_CACHE_SIZE)
+
     def __init__(self,
                  users_database_file: Union[str, Path] = USERS_DATABASE_NAME,
-                 events_database_file: Union[str, Path] = EVENTS_DATABASE_NAME):
+                 events_database_file: Union[str, Path] = EVENTS_DATABASE_NAME,
+                 storage: str = STORAGE_SQLITE,
+                 shards: int = DEFAULT_SHARDS,
+                 read_only: bool = False,
+                 pooled: bool = False):
         """
         Initialize the combined handler class.
         :param users_database_file: The user database.
         :param events_database_file: The event database.
+        :param storage: The storage engine, 'sqlite', 'memory' (the database names are kept per process) or
+                        'sharded' (the rows are partitioned across files next to the databases).
+        :param shards: Number of shards of the 'sharded' engine.
+        :param read_only: If True, read from snapshots that do not block the writers (for reporting queries).
+                          Only the 'sqlite' engine has snapshots, the other engines ignore it.
+        :param pooled: If True, take idle connections of the process, they are given back by close for the next
+                       handlers. Only the 'sqlite' engine pools its connections, the other engines ignore it.
         """
-        self.users_handler = UsersHandler(users_database_file)
-        self.events_handler = EventsHandler(events_database_file)
+        if storage not in STORAGE_ENGINES:
+            raise UnknownStorage(storage)
+        users_handler_class, events_handler_class = STORAGE_ENGINES[storage]
+        if read_only and storage == STORAGE_SQLITE:
+            self.users_handler: UsersStorage = users_handler_class.open_snapshot(users_database_file)
+            self.events_handler: EventsStorage = events_handler_class.open_snapshot(events_database_file)
+        else:
+            # The sharded handlers route every user and event to its shard.
+            engine_options = {"shards": shards} if storage == STORAGE_SHARDED else \
+                {"pooled": pooled} if storage == STORAGE_SQLITE else {}
+            self.users_handler: UsersStorage = users_handler_class(users_database_file, **engine_options)
+            self.events_handler: EventsStorage = events_handler_class(events_database_file, **engine_options)
+        self._events_database = (storage, str(Path(events_database_file).resolve()))
 
     def add_user(self, username: str, mail: str, password: str) -> str:
         """
@@ -72,7 +147,8 @@ class CombinedHandler:
             location: str,
             subscribers: list[str],
             start: datetime,
-            end: datetime = None
+            end: datetime = None,
+            check_conflicts: bool = False
     ) -> str:
         """
         Add event to the database.
@@ -83,9 +159,12 @@ class CombinedHandler:
         :param subscribers: who invited?
         :param start: start time.
         :param end: end time.
+        :param check_conflicts: If True, refuse to add an event that overlaps other events of the user.
         :return: Event id.
         """
         end = end if end is not None else start
+        if check_conflicts:
+            self._raise_on_conflicts(user_id, start, end)
 
         start = start.strftime('%Y-%m-%d %H:%M:%S+00:00')
         end = end.strftime('%Y-%m-%d %H:%M:%S+00:00')
@@ -97,21 +176,33 @@ class CombinedHandler:
         self.assign_event_to_user(event.created_user_id, event_id)
         return event_id
 
-    def get_event(self, event_id: str) -> Event:
+    def get_event(self, event_id: str, include_archived: bool = False) -> Event:
         """
         Get event by id from the database.
         :param event_id: Given event id.
+        :param include_archived: If True, look for the event in the archive as well.
         :return: Event.
         """
-        return self.events_handler.get_event(event_id)
+        return self.events_handler.get_event(event_id, include_archived)
+
+    def get_event_by_name(self, event_name: str, fields: Optional[list[str]] = None) -> Union[Event, dict, None]:
+        """
+        Get event by its unique name from the database.
+        :param event_name: Name of the event.
+        :param fields: If entered, return only these attributes of the event as a dict.
+        :return: The event, None if it does not exist.
+        """
+        return self.events_handler.get_event_by_name(event_name, fields)
 
-    def remove_event(self, event_id: str):
+    def remove_event(self, event_id: str, created_user_id: Optional[str] = None):
         """
         Remove event from the database.
         :param event_id: Given event id to remove.
+        :param created_user_id: The host of the event, if the caller already has it, the event is not read again.
         """
-        event = self.get_event(event_id)
-        self.remove_event_from_user(event.created_user_id, event_id)
+        if created_user_id is None:
+            created_user_id = self.get_event(event_id, include_archived=True).created_user_id
+        self.remove_event_from_user(created_user_id, event_id)
         self.events_handler.remove_event(event_id)
 
     def assign_event_to_user(self, user_id: str, event_id: str):
@@ -138,22 +229,25 @@ class CombinedHandler:
         """
         return self.users_handler.get_user_id_by_name(user_name)
 
-    def modify_event(self, event_id: str, **changes) -> None:
+    def modify_event(self, event_id: str, expected_version: Optional[int] = None, **changes) -> None:
         """
         Modify an existing event in the database by its event ID.
         :param event_id: ID of the event to modify.
+        :param expected_version: If entered, modify the event only if it is still in this version.
         :param changes: Key Value pairs of the fields you want to update and their new values.
         """
-        self.events_handler.modify_event(event_id, **changes)
+        self.events_handler.modify_event(event_id, expected_version, **changes)
 
     def get_events_by_attribute(
             self,
             sort_by_attribute: Optional[str] = None,
             reverse: bool = False,
             location_filter: str = None,
+            fields: Optional[list[str]] = None,
+            include_archived: bool = False,
             **filters
 
-        ) -> list[Event]:
+        ) -> Union[list[Event], list[dict]]:
         """
         Fetch all events with a specific attribute.
         :param sort_by_attribute: The attribute to sort by (examples:
@@ -161,19 +255,104 @@ class CombinedHandler:
         :param reverse: If True, sort in descending order. otherwise, sort in ascending order.
         :param filters: Key Value pairs of the attributes and values you want to filter by.
         :param location_filter:
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param include_archived: If True, return the archived events as well.
         :return: List of events that match the given attributes.
         """
         if location_filter:
             filters["location"] = location_filter
-        return self.events_handler.get_events(sort_by_attribute, reverse, **filters)
+        return self.events_handler.get_events(sort_by_attribute, reverse, fields, include_archived, **filters)
+
+    def get_upcoming_events(self, limit: int, fields: Optional[list[str]] = None, start: Optional[datetime] = None,
+                            end: Optional[datetime] = None) -> Union[list[Event], list[dict]]:
+        """
+        Get the next events by their start time.
+        :param limit: Max number of events to return.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param start: Return the events that start at this time or later, defaults to now.
+        :param end: If entered, return only the events that start at this time or earlier.
+        :return: The events, sorted by their start time.
+        """
+        start = start if start is not None else datetime.now(timezone.utc)
+        return self.events_handler.get_upcoming_events(start, limit, fields, end)
+
+    def get_stats(self, top: int = 10, days: int = 30) -> dict:
+        """
+        Get the aggregates of the (not archived) events.
+        :param top: Number of entries in each ranking.
+        :param days: Max number of days in the upcoming counts.
+        :return: The rankings of the events by subscribers, the locations and the hosts, and the events per day.
+        """
+        return self.events_handler.get_stats(top, datetime.now(timezone.utc).strftime('%Y-%m-%d'), days)
+
+    def archive_past_events(self, retention: timedelta, now: Optional[datetime] = None) -> int:
+        """
+        Move the events that ended more than the retention period ago to the archive.
+        :param retention: How long to keep finished events in the events table.
+        :param now: The current time (UTC), defaults to now.
+        :return: Number of archived events.
+        """
+        now = now if now is not None else datetime.now(timezone.utc)
+        return self.events_handler.archive_events(now - retention)
+
+    def get_versions(self) -> tuple[int, int]:
+        """
+        Get the versions of the data, every mutation of the events or the users increases them.
+        :return: Tuple of (events version, users version).
+        """
+        return self.events_handler.get_version("events"), self.users_handler.get_version("users")
+
+    def get_event_version_by_name(self, event_name: str) -> Optional[tuple[str, int]]:
+        """
+        Get the id and the version of an event by its name.
+        :param event_name: Name of the event.
+        :return: Tuple of (event id, version), None if the event does not exist.
+        """
+        return self.events_handler.get_event_version_by_name(event_name)
+
+    def get_changes(self, since: int = 0, limit: int = 100) -> list[dict]:
+        """
+        Get the changes of the events database after the given sequence number.
+        When the users are stored in the same database file, their changes are included as well.
+        :param since: Sequence number of the last known change.
+        :param limit: Max number of changes to return.
+        :return: The changes, ordered by their sequence number.
+        """
+        return self.events_handler.get_changes(since, limit)
+
+    def get_last_change_sequence(self) -> int:
+        """
+        Get the sequence number of the latest change of the events database.
+        :return: The sequence number, 0 if there are no changes.
+        """
+        return self.events_handler.get_last_change_sequence()
 
-    def add_subscriber_to_event(self, event_id: str, user_id: str) -> None:
+    def get_first_change_sequence(self) -> int:
+        """
+        Get the sequence number of the oldest retained change of the events database.
+        :return: The sequence number, 0 if there are no changes.
+        """
+        return self.events_handler.get_first_change_sequence()
+
+    def trim_changes(self, keep: int) -> int:
+        """
+        Delete the oldest changes of the users and the events change logs.
+        :param keep: Number of the latest changes to keep in every log.
+        :return: Number of deleted changes.
+        """
+        return self.users_handler.trim_changes(keep) + self.events_handler.trim_changes(keep)
+
+    def add_subscriber_to_event(self, event_id: str, user_id: str, check_conflicts: bool = False) -> None:
         """
         Add a subscriber to an event.
         :param event_id: ID of the event.
         :param user_id: ID of the new subscriber.
+        :param check_conflicts: If True, refuse to subscribe to an event that overlaps other events of the user.
         """
         self.get_user(user_id)
+        if check_conflicts:
+            event = self.get_event(event_id)
+            self._raise_on_conflicts(user_id, event.event_start_time, event.event_end_time, ignore_event_id=event_id)
         self.events_handler.add_subscriber(event_id, user_id)
 
     def remove_subscriber_from_event(self, event_id: str, user_id: str) -> None:
@@ -185,6 +364,69 @@ class CombinedHandler:
         self.get_user(user_id)
         self.events_handler.remove_subscriber(event_id, user_id)
 
+    def apply_subscriptions(self, operations: list[tuple[str, str, str]]) -> list[Optional[Exception]]:
+        """
+        Add and remove many subscribers at once.
+        All the users are validated in one query and all the changes are applied in one transaction.
+        :param operations: Tuples of (action, event id, user id), where action is 'add' or 'remove'.
+        :return: For each operation, None if it was applied, otherwise the error.
+        """
+        existing_users = self.users_handler.get_existing_user_ids([user_id for _, _, user_id in operations])
+        valid_operations = [operation for operation in operations if operation[2] in existing_users]
+        valid_results = iter(self.events_handler.apply_subscriber_changes(valid_operations))
+        return [next(valid_results) if user_id in existing_users else UserDoesNotExist(user_id)
+                for _, _, user_id in operations]
+
+    def get_user_schedule(self, user_id: str) -> IntervalIndex:
+        """
+        Get the interval index of all the events the user hosts or subscribed to.
+        :param user_id: ID of the user.
+        :return: Index of the user events by their start and end times.
+        """
+        # Every mutation of the events changes the version, so a cached schedule of an older version is rebuilt.
+        events_version = self.events_handler.get_version("events")
+        key = (self._events_database, user_id)
+        schedule = CombinedHandler._schedules.get(key, events_version)
+        if schedule is None:
+            self.get_user(user_id)  # Check if user exist
+            events = self.events_handler.get_user_events(user_id)
+            schedule = IntervalIndex(
+                (as_utc(event.event_start_time), as_utc(event.event_end_time), event) for event in events)
+            CombinedHandler._schedules.put(key, events_version, schedule)
+        return schedule
+
+    def iter_user_events(self, user_id: str) -> Iterator[Event]:
+        """
+        Iterate over all the events the user hosts or subscribed to, without loading them at once.
+        :param user_id: ID of the user.
+        :return: Iterator of the user events.
+        """
+        return self.events_handler.iter_user_events(user_id)
+
+    def get_free_busy(self, user_id: str, start: datetime, end: datetime) -> list[Event]:
+        """
+        Get the events of the user that overlap the given time range.
+        :param user_id: ID of the user.
+        :param start: Start of the range.
+        :param end: End of the range.
+        :return: The overlapping events sorted by their start time.
+        """
+        events = self.get_user_schedule(user_id).overlapping(as_utc(start), as_utc(end))
+        return sorted(events, key=lambda event: as_utc(event.event_start_time))
+
+    def _raise_on_conflicts(self, user_id: str, start: datetime, end: datetime, ignore_event_id: str = None):
+        """
+        Raise if the given time range overlaps other events of the user.
+        :param user_id: ID of the user.
+        :param start: Start of the range.
+        :param end: End of the range.
+        :param ignore_event_id: Event to exclude from the check.
+        """
+        conflicts = [event.event_id for event in self.get_free_busy(user_id, start, end)
+                     if event.event_id != ignore_event_id]
+        if conflicts:
+            raise EventConflict(conflicts)
+
     def send_message(self, event_id, message):
         event = self.get_event(event_id)
         for user_id in event.subscribers:
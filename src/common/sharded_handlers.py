@@ -0,0 +1,628 @@
+"""
+Sharded storage engine file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import copy
+import heapq
+import json
+import sqlite3
+import zlib
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from common.events_handler import EventsHandler, STAT_LOCATION, STAT_HOST
+from common.users_handler import UsersHandler
+from core.database_handler import DatabaseHandler
+from core.event import Event, EventAlreadyExist, ModifyChangesAreInvalid, InvalidAttribute
+from core.migrations import Migration
+from core.storage import UsersStorage, EventsStorage
+from core.user import User, UserAlreadyExist, UserDoesNotExist
+from core.utils import generate_unique_id
+
+# ----- Constants ----- #
+
+DEFAULT_SHARDS = 4
+COLLECT_BATCH_SIZE = 1000  # Changes read from every shard log in each collection transaction.
+# Tables that are partitioned, by the column their rows are routed by.
+SHARDED_TABLES = {"users": "user_id", "events": "event_id", "events_archive": "event_id"}
+
+
+# ----- Functions ----- #
+
+def shard_index(key: str, shards: int) -> int:
+    """
+    Route a key to a shard, the same key is always routed to the same shard.
+    :param key: ID of a user or an event.
+    :param shards: Number of shards.
+    :return: Index of the shard.
+    """
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def shard_files(database_file: Union[str, Path], shards: int) -> list[Path]:
+    """
+    Get the files of the shards of a database, next to it (e.g. data.db -> data.shard0.db, data.shard1.db).
+    :param database_file: The main database, that keeps the change log and the names directory.
+    :param shards: Number of shards.
+    :return: The shard files.
+    """
+    database_file = Path(database_file)
+    return [database_file.with_name(f"{database_file.stem}.shard{index}{database_file.suffix}")
+            for index in range(shards)]
+
+
+def sort_key(value):
+    """
+    Key that orders the values of an attribute the way sqlite orders the stored column.
+    :param value: Value of the attribute.
+    :return: The key.
+    """
+    if value is None:
+        return 0, ""
+    if isinstance(value, datetime):
+        # Times are stored, and so ordered, as text.
+        return 1, str(value)
+    if isinstance(value, list):
+        # The subscribers are ordered by their number.
+        return 1, len(value)
+    return 1, value
+
+
+def rebalance_shards(database_file: Union[str, Path], old_shards: int, new_shards: int) -> int:
+    """
+    Move the rows of the sharded tables to the shards they are routed to with a new number of shards.
+    Should run while the server is stopped.
+    :param database_file: The main database.
+    :param old_shards: Current number of shards.
+    :param new_shards: New number of shards.
+    :return: Number of moved rows.
+    """
+    # The changes of the removed shards are not lost, they are collected, and their versions are kept by the main
+    # database.
+    handler = ShardedEventsHandler(database_file, old_shards)
+    handler.collect_changes()
+    handler.close()
+    conn = sqlite3.connect(database_file)
+    for path in shard_files(database_file, max(old_shards, new_shards)):
+        if not path.exists():
+            continue
+        conn.execute("ATTACH DATABASE ? AS shard", (str(path),))
+        conn.execute("INSERT INTO table_versions (table_name, version) "
+                     "SELECT table_name, version FROM shard.table_versions WHERE true "
+                     "ON CONFLICT(table_name) DO UPDATE SET version = version + excluded.version")
+        conn.execute("DELETE FROM shard.table_versions")
+        conn.commit()
+        conn.execute("DETACH DATABASE shard")
+    conn.close()
+
+    targets = shard_files(database_file, new_shards)
+    # Create the tables of the new shards, and the missing tables of the old shards.
+    for path in shard_files(database_file, max(old_shards, new_shards)):
+        UsersShard(path).close()
+        EventsShard(path).close()
+
+    moved = 0
+    for source_index, source_path in enumerate(shard_files(database_file, old_shards)):
+        conn = sqlite3.connect(source_path)
+        cursor = conn.cursor()
+        for table_name, key_column in SHARDED_TABLES.items():
+            cursor.execute(f"SELECT {key_column} FROM {table_name}")
+            moves: dict[int, list[str]] = {}
+            for (key,) in cursor.fetchall():
+                target_index = shard_index(key, new_shards)
+                if target_index != source_index:
+                    moves.setdefault(target_index, []).append(key)
+
+            for target_index, keys in moves.items():
+                cursor.execute("ATTACH DATABASE ? AS target", (str(targets[target_index]),))
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ', '.join(['?'] * len(chunk))
+                    cursor.execute(f"INSERT OR REPLACE INTO target.{table_name} SELECT * FROM {table_name} "
+                                   f"WHERE {key_column} IN ({placeholders})", chunk)
+                    cursor.execute(f"DELETE FROM {table_name} WHERE {key_column} IN ({placeholders})", chunk)
+                conn.commit()
+                cursor.execute("DETACH DATABASE target")
+                moved += len(keys)
+        conn.close()
+
+    # The aggregates and the user events index are kept per shard.
+    for path in shard_files(database_file, max(old_shards, new_shards)):
+        shard = EventsShard(path)
+        shard.rebuild_stats()
+        shard.rebuild_user_events()
+        shard.close()
+    return moved
+
+
+# ----- Classes ----- #
+
+class UsersShard(UsersHandler):
+    """
+    Handler of the users of a single shard, with the change log and the versions of the shard.
+    """
+    pass
+
+
+class EventsShard(EventsHandler):
+    """
+    Handler of the events of a single shard, with the change log and the versions of the shard.
+    """
+    pass
+
+
+class ShardedDatabaseHandler(DatabaseHandler):
+    """
+    Base of the sharded handlers. The rows are partitioned across shard files by the hash of their id, every shard
+    records the changes and the versions of its rows with its mutations, and the main database keeps the unique
+    names directory. The readers of the change log merge the logs of the shards into the log of the main database,
+    so a writer never waits for the writers of other shards.
+    """
+
+    def __init__(self, database_file: Union[str, Path], shards: int, shard_class: type):
+        """
+        Init the handler class.
+        :param database_file: The main database.
+        :param shards: Number of shards.
+        :param shard_class: Handler of a single shard.
+        """
+        super().__init__(database_file)
+        self.shards = [shard_class(path) for path in shard_files(database_file, shards)]
+        self._migrate("shard_changes", [
+            Migration(1, "Create the collected positions of the shards change logs",
+                      ShardedDatabaseHandler._create_collected_positions),
+        ])
+
+    def _create_collected_positions(self):
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS collected_changes (shard TEXT PRIMARY KEY, "
+                            "sequence INTEGER NOT NULL)")
+
+    def _shard(self, key: str):
+        """
+        Get the shard of a user or an event.
+        :param key: ID of the user or the event.
+        :return: The shard handler.
+        """
+        return self.shards[shard_index(key, len(self.shards))]
+
+    def _group_by_shard(self, keys: list[str]) -> dict[int, list[str]]:
+        """
+        Split ids by their shards.
+        :param keys: IDs of users or events.
+        :return: The ids of each shard index.
+        """
+        groups: dict[int, list[str]] = {}
+        for key in dict.fromkeys(keys):
+            groups.setdefault(shard_index(key, len(self.shards)), []).append(key)
+        return groups
+
+    def _get_collected_positions(self) -> dict[str, int]:
+        """
+        Get the sequence of the last collected change of every shard.
+        :return: The sequence of every shard file name.
+        """
+        self.cursor.execute("SELECT shard, sequence FROM collected_changes")
+        return dict(self.cursor.fetchall())
+
+    def collect_changes(self) -> int:
+        """
+        Append the changes of the shards that were not collected yet to the change log of the main database, merged
+        by their time. Each shard is read before the main database is locked, so only the appends hold the lock.
+        :return: Number of collected changes.
+        """
+        names = [shard._users_database_path.name for shard in self.shards]
+        collected = 0
+        while True:
+            positions = self._get_collected_positions()
+            batches = [shard.get_changes(positions.get(name, 0), COLLECT_BATCH_SIZE)
+                       for name, shard in zip(names, self.shards)]
+            if not any(batches):
+                return collected
+
+            self.cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Another reader may have collected some of the changes meanwhile.
+                positions = self._get_collected_positions()
+                batches = [[change for change in batch if change["sequence"] > positions.get(name, 0)]
+                           for name, batch in zip(names, batches)]
+                for change in heapq.merge(*batches, key=lambda change: change["time"]):
+                    self.cursor.execute("INSERT INTO changes (table_name, entity_id, operation, data, change_time) "
+                                        "VALUES (?, ?, ?, ?, ?)",
+                                        (change["table"], change["entity_id"], change["operation"],
+                                         json.dumps(change["data"]), change["time"]))
+                    self._collect_change(change)
+                    collected += 1
+                for name, batch in zip(names, batches):
+                    if batch:
+                        self.cursor.execute("INSERT INTO collected_changes (shard, sequence) VALUES (?, ?) "
+                                            "ON CONFLICT(shard) DO UPDATE SET sequence = excluded.sequence",
+                                            (name, batch[-1]["sequence"]))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            if all(len(batch) < COLLECT_BATCH_SIZE for batch in batches):
+                return collected
+
+    def _collect_change(self, change: dict):
+        """
+        Update the main database by a collected change, called inside the collection transaction.
+        :param change: The change of a shard.
+        """
+        pass
+
+    def get_changes(self, since: int = 0, limit: int = 100) -> list[dict]:
+        self.collect_changes()
+        return super().get_changes(since, limit)
+
+    def get_last_change_sequence(self) -> int:
+        self.collect_changes()
+        return super().get_last_change_sequence()
+
+    def trim_changes(self, keep: int) -> int:
+        """
+        Trim the change log of the main database, and delete the collected changes from the logs of the shards.
+        """
+        self.collect_changes()
+        deleted = super().trim_changes(keep)
+        positions = self._get_collected_positions()
+        for shard in self.shards:
+            position = positions.get(shard._users_database_path.name)
+            if position:
+                shard.cursor.execute("DELETE FROM changes WHERE sequence <= ?", (position,))
+                shard.conn.commit()
+        return deleted
+
+    def get_version(self, table_name: str) -> int:
+        """
+        Sum the versions of the shards, and the versions that the main database kept for the removed shards.
+        """
+        return super().get_version(table_name) + sum(shard.get_version(table_name) for shard in self.shards)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        super().close()
+
+
+class ShardedUsersHandler(ShardedDatabaseHandler, UsersStorage):
+    def __init__(self, users_database_file: Union[str, Path], shards: int = DEFAULT_SHARDS):
+        """
+        Init the sharded user handler class.
+        :param users_database_file: The main database.
+        :param shards: Number of shards.
+        """
+        super().__init__(users_database_file, shards, UsersShard)
+        self._migrate("user_names", [
+            Migration(1, "Create the users names directory", ShardedUsersHandler._create_names_directory),
+        ])
+
+    def _create_names_directory(self):
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS user_names (user_name TEXT PRIMARY KEY, user_id TEXT)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS user_names_id ON user_names (user_id)")
+
+    def _collect_change(self, change: dict):
+        # A user that was removed by a handler that stopped before it released the name.
+        if change["table"] == "users" and change["operation"] == "remove":
+            self.cursor.execute("DELETE FROM user_names WHERE user_id=?", (change["entity_id"],))
+
+    def _release_names(self, user_id: str):
+        """
+        Remove the names of a user from the names directory, in its own transaction.
+        :param user_id: ID of the user.
+        """
+        self.cursor.execute("DELETE FROM user_names WHERE user_id=?", (user_id,))
+        self.conn.commit()
+
+    def add_user(self, user: User, password: str) -> str:
+        user.user_id = user.user_id or generate_unique_id()
+        # The name is claimed in its own transaction, the main database is not locked while the password is hashed.
+        try:
+            self.cursor.execute("INSERT INTO user_names (user_name, user_id) VALUES (?, ?)",
+                                (user.user_name, user.user_id))
+            self.conn.commit()
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            raise UserAlreadyExist("A user with this name already exists.")
+        try:
+            return self._shard(user.user_id).add_user(user, password)
+        except Exception:
+            self._release_names(user.user_id)
+            raise
+
+    def get_user(self, user_id: str) -> User:
+        return self._shard(user_id).get_user(user_id)
+
+    def remove_user(self, user_id: str):
+        self._shard(user_id).remove_user(user_id)
+        self._release_names(user_id)
+
+    def add_event_to_user(self, user_id: str, event_id: str):
+        self._shard(user_id).add_event_to_user(user_id, event_id)
+
+    def remove_event_from_user(self, user_id: str, event_id: str):
+        self._shard(user_id).remove_event_from_user(user_id, event_id)
+
+    def get_existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        existing = set()
+        for index, shard_user_ids in self._group_by_shard(user_ids).items():
+            existing.update(self.shards[index].get_existing_user_ids(shard_user_ids))
+        return existing
+
+    def get_user_id_by_name(self, user_name: str) -> str:
+        self.cursor.execute("SELECT user_id FROM user_names WHERE user_name=?", (user_name,))
+        result = self.cursor.fetchone()
+        if not result:
+            raise UserDoesNotExist(user_name)
+        return result[0]
+
+    def login(self, user_name: str, password: str) -> str:
+        self.cursor.execute("SELECT user_id FROM user_names WHERE user_name=?", (user_name,))
+        result = self.cursor.fetchone()
+        if not result:
+            raise UserDoesNotExist(f"User with name '{user_name}' does not exist.")
+        return self._shard(result[0]).login(user_name, password)
+
+
+class ShardedEventsHandler(ShardedDatabaseHandler, EventsStorage):
+    # The last merged aggregates of every main database, with the arguments and the version of the events they
+    # were merged for.
+    _stats_cache: dict[str, tuple[tuple, dict]] = {}
+
+    def __init__(self, events_database_file: Union[str, Path], shards: int = DEFAULT_SHARDS):
+        """
+        Init the sharded event handler class.
+        :param events_database_file: The main database.
+        :param shards: Number of shards.
+        """
+        super().__init__(events_database_file, shards, EventsShard)
+        self._migrate("event_names", [
+            Migration(1, "Create the events names directory", ShardedEventsHandler._create_names_directory),
+        ])
+
+    def _create_names_directory(self):
+        # Names of the not archived events, unique across the shards.
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS event_names (event_name TEXT PRIMARY KEY, event_id TEXT)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS event_names_id ON event_names (event_id)")
+
+    def _collect_change(self, change: dict):
+        # The names of the archived events, and of the events that were removed by a handler that stopped before it
+        # released the name.
+        if change["table"] == "events" and change["operation"] in ("remove", "archive"):
+            self.cursor.execute("DELETE FROM event_names WHERE event_id=?", (change["entity_id"],))
+
+    def _claim_name(self, event_name: str, event_id: str) -> bool:
+        """
+        Add an event name to the names directory, in its own transaction before the shard is written, so the main
+        database is not locked while the shard is written.
+        :param event_name: Name of the event.
+        :param event_id: ID of the event.
+        :return: True if the name was claimed, False if the event already has the name.
+        """
+        try:
+            self.cursor.execute("INSERT INTO event_names (event_name, event_id) VALUES (?, ?)", (event_name, event_id))
+            self.conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+        self.cursor.execute("SELECT event_id FROM event_names WHERE event_name=?", (event_name,))
+        result = self.cursor.fetchone()
+        if result and result[0] == event_id:
+            return False
+        raise EventAlreadyExist(event_name)
+
+    def _release_names(self, event_id: str, keep: Optional[str] = None, name: Optional[str] = None):
+        """
+        Remove names of an event from the names directory, in its own transaction.
+        :param event_id: ID of the event.
+        :param keep: Name of the event that is not removed.
+        :param name: The only name that is removed, all the names of the event if None.
+        """
+        if name is not None:
+            self.cursor.execute("DELETE FROM event_names WHERE event_id=? AND event_name=?", (event_id, name))
+        else:
+            self.cursor.execute("DELETE FROM event_names WHERE event_id=? AND event_name IS NOT ?", (event_id, keep))
+        self.conn.commit()
+
+    def add_event(self, event: Event) -> str:
+        event.event_id = event.event_id or generate_unique_id()
+        self._claim_name(event.event_name, event.event_id)
+        try:
+            return self._shard(event.event_id).add_event(event)
+        except Exception:
+            self._release_names(event.event_id, name=event.event_name)
+            raise
+
+    def remove_event(self, event_id: str):
+        self._shard(event_id).remove_event(event_id)
+        self._release_names(event_id)
+
+    def modify_event(self, event_id: str, expected_version: Optional[int] = None, **changes) -> None:
+        if "event_id" in changes:
+            # The id decides the shard of the event.
+            raise ModifyChangesAreInvalid(changes)
+        if "event_name" not in changes:
+            self._shard(event_id).modify_event(event_id, expected_version, **changes)
+            return
+
+        # The new name is claimed before the shard is written, and the old name is released after it.
+        event_name = changes["event_name"]
+        claimed = self._claim_name(event_name, event_id)
+        try:
+            self._shard(event_id).modify_event(event_id, expected_version, **changes)
+        except Exception:
+            if claimed:
+                self._release_names(event_id, name=event_name)
+            raise
+        self._release_names(event_id, keep=event_name)
+
+    def get_event(self, event_id: str, include_archived: bool = False) -> Event:
+        return self._shard(event_id).get_event(event_id, include_archived)
+
+    def get_event_by_name(self, event_name: str, fields: Optional[list[str]] = None) -> Union[Event, dict, None]:
+        self.cursor.execute("SELECT event_id FROM event_names WHERE event_name=?", (event_name,))
+        result = self.cursor.fetchone()
+        if not result:
+            return None
+        return self._shard(result[0]).get_event_by_name(event_name, fields)
+
+    def get_event_version_by_name(self, event_name: str) -> Optional[tuple[str, int]]:
+        self.cursor.execute("SELECT event_id FROM event_names WHERE event_name=?", (event_name,))
+        result = self.cursor.fetchone()
+        if not result:
+            return None
+        return self._shard(result[0]).get_event_version_by_name(event_name)
+
+    def get_events_by_ids(self, events_ids: list[str] = None, fields: Optional[list[str]] = None,
+                          include_archived: bool = False) -> Union[list[Event], list[dict]]:
+        if events_ids is None:
+            return [event for shard in self.shards for event in shard.get_events_by_ids(None, fields, include_archived)]
+        return [event for index, shard_events_ids in self._group_by_shard(events_ids).items()
+                for event in self.shards[index].get_events_by_ids(shard_events_ids, fields, include_archived)]
+
+    def get_events(self, sort_by_attribute: Optional[str] = None, reverse: bool = False,
+                   fields: Optional[list[str]] = None, include_archived: bool = False,
+                   **filters) -> Union[list[Event], list[dict]]:
+        """
+        Fetch the events of all the shards, the sorted results of the shards are merged by the sort attribute.
+        """
+        if sort_by_attribute and sort_by_attribute not in Event.__annotations__.keys():
+            raise InvalidAttribute(sort_by_attribute)
+        # The merge needs the sort attribute even if it was not requested.
+        extra_field = bool(fields and sort_by_attribute and sort_by_attribute not in fields)
+        shard_fields = fields + [sort_by_attribute] if extra_field else fields
+        results = [shard.get_events(sort_by_attribute, reverse, shard_fields, include_archived, **filters)
+                   for shard in self.shards]
+        if not sort_by_attribute:
+            return [event for shard_events in results for event in shard_events]
+
+        if fields:
+            events = list(heapq.merge(*results, key=lambda record: sort_key(record[sort_by_attribute]),
+                                      reverse=reverse))
+            if extra_field:
+                for record in events:
+                    del record[sort_by_attribute]
+            return events
+        return list(heapq.merge(*results, key=lambda event: sort_key(getattr(event, sort_by_attribute)),
+                                reverse=reverse))
+
+    def get_upcoming_events(self, start: datetime, limit: int, fields: Optional[list[str]] = None,
+                            end: Optional[datetime] = None) -> Union[list[Event], list[dict]]:
+        """
+        Merge the next events of every shard, each shard reads at most the limit.
+        """
+        extra_field = bool(fields and "event_start_time" not in fields)
+        shard_fields = fields + ["event_start_time"] if extra_field else fields
+        results = [shard.get_upcoming_events(start, limit, shard_fields, end) for shard in self.shards]
+        if fields:
+            events = list(heapq.merge(*results, key=lambda record: sort_key(record["event_start_time"])))[:limit]
+            if extra_field:
+                for record in events:
+                    del record["event_start_time"]
+            return events
+        return list(heapq.merge(*results, key=lambda event: sort_key(event.event_start_time)))[:limit]
+
+    def get_user_events(self, user_id: str) -> list[Event]:
+        return [event for shard in self.shards for event in shard.get_user_events(user_id)]
+
+    def iter_user_events(self, user_id: str, batch_size: int = 500) -> Iterator[Event]:
+        for shard in self.shards:
+            yield from shard.iter_user_events(user_id, batch_size)
+
+    def archive_events(self, ended_before: datetime, batch_size: int = 500) -> int:
+        archived = sum(shard.archive_events(ended_before, batch_size) for shard in self.shards)
+        if archived:
+            # The names of the archived events are released by their collected changes.
+            self.collect_changes()
+        return archived
+
+    def add_subscriber(self, event_id: str, user_id: str) -> None:
+        self._shard(event_id).add_subscriber(event_id, user_id)
+
+    def remove_subscriber(self, event_id: str, user_id: str) -> None:
+        self._shard(event_id).remove_subscriber(event_id, user_id)
+
+    def apply_subscriber_changes(self, operations: list[tuple[str, str, str]]) -> list[Optional[Exception]]:
+        """
+        Apply the operations of every shard in one transaction of the shard.
+        """
+        positions: dict[int, list[int]] = {}
+        for position, (_, event_id, _) in enumerate(operations):
+            positions.setdefault(shard_index(event_id, len(self.shards)), []).append(position)
+
+        results: list[Optional[Exception]] = [None] * len(operations)
+        for index, shard_positions in positions.items():
+            shard_results = self.shards[index].apply_subscriber_changes(
+                [operations[position] for position in shard_positions])
+            for position, result in zip(shard_positions, shard_results):
+                results[position] = result
+        return results
+
+    def get_stats(self, top: int = 10, from_day: Optional[str] = None, days: int = 30,
+                  rankings_top: Optional[int] = None) -> dict:
+        """
+        Combine the aggregates of the shards, the result is kept until the version of the events changes. Every event
+        is in one shard, so the top events are the top of the top events of the shards and the first days are the
+        first of the first days of the shards, while the counts of a location or a host are summed across the shards.
+        """
+        rankings_top = top if rankings_top is None else rankings_top
+        from_day = from_day if from_day is not None else datetime.now().strftime('%Y-%m-%d')
+        path = str(self._users_database_path.resolve())
+        # The version is read first, a write during the merge makes the kept result stale for the next request.
+        key = (len(self.shards), top, from_day, days, rankings_top, self.get_version("events"))
+        cached = ShardedEventsHandler._stats_cache.get(path)
+        if cached and cached[0] == key:
+            return copy.deepcopy(cached[1])
+
+        shard_stats = [shard.get_stats(top, from_day, days, rankings_top=0) for shard in self.shards]
+        limit = top if top >= 0 else None
+        popular_events = sorted((event for stats in shard_stats for event in stats["popular_events"]),
+                                key=lambda event: event["subscribers"], reverse=True)[:limit]
+        days_counts = Counter()
+        for stats in shard_stats:
+            for entry in stats["upcoming_days"]:
+                days_counts[entry["day"]] += entry["events"]
+
+        stats = {"popular_events": popular_events,
+                 "locations": self._merge_ranking(STAT_LOCATION, rankings_top),
+                 "hosts": self._merge_ranking(STAT_HOST, rankings_top),
+                 "upcoming_days": [{"day": day, "events": days_counts[day]} for day in sorted(days_counts)[:days]]}
+        ShardedEventsHandler._stats_cache[path] = (key, stats)
+        return copy.deepcopy(stats)
+
+    def _merge_ranking(self, kind: str, limit: int) -> list[dict]:
+        """
+        Get the largest counts of an aggregate summed across the shards, without reading all of its keys. The top of
+        every shard is read and the sums of the returned keys are read by their keys. More of every shard is read only
+        while a key that no shard returned could still have a larger sum, which is at most the sum of the last counts
+        the shards returned.
+        :param kind: Kind of the aggregate.
+        :param limit: Number of entries, negative for all of them.
+        :return: The ranking.
+        """
+        if limit == 0:
+            return []
+        size = limit
+        while True:
+            rankings = [shard.get_ranking(kind, size) for shard in self.shards]
+            exhausted = [size < 0 or len(ranking) < size for ranking in rankings]
+            candidates = list(dict.fromkeys(key for ranking in rankings for key, _ in ranking))
+            totals = Counter()
+            for shard, ranking, done in zip(self.shards, rankings, exhausted):
+                counts = dict(ranking)
+                # A shard that returned all its keys has no count for the others.
+                missing = [key for key in candidates if key not in counts]
+                if missing and not done:
+                    counts.update(shard.get_stat_counts(kind, missing))
+                totals.update(counts)
+
+            ranked = totals.most_common(limit if limit >= 0 else None)
+            threshold = sum(ranking[-1][1] for ranking, done in zip(rankings, exhausted) if not done)
+            if all(exhausted) or (len(ranked) == limit and ranked[-1][1] >= threshold):
+                return [{kind: key, "events": count} for key, count in ranked]
+            size *= 2
@@ -0,0 +1,107 @@
+"""
+Subscription write combining file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import threading
+from typing import Callable, Optional
+
+from common.server_handler import CombinedHandler
+
+
+# ----- Classes ----- #
+
+class _PendingOperation:
+    __slots__ = ("action", "event_id", "user_id", "error", "leading", "done")
+
+    def __init__(self, action: str, event_id: str, user_id: str):
+        self.action = action
+        self.event_id = event_id
+        self.user_id = user_id
+        self.error: Optional[Exception] = None
+        self.leading = False  # Set when the operation is woken to flush the queue of its event.
+        self.done = threading.Event()
+
+
+class SubscriptionCombiner:
+    def __init__(self, handler_factory: Callable[[], CombinedHandler]):
+        """
+        Init the combiner, that merges the subscribe and unsubscribe requests of an event that arrive while an
+        update of the event is written into its next update.
+        :param handler_factory: Creates the handler of every update.
+        """
+        self.handler_factory = handler_factory
+        self.pending: dict[str, list[_PendingOperation]] = {}
+        self.flushing: set[str] = set()  # Events with an update in progress.
+        self.pending_lock = threading.Lock()
+
+    def add_subscriber(self, event_id: str, user_id: str) -> None:
+        """
+        Add a subscriber to an event.
+        :param event_id: ID of the event.
+        :param user_id: ID of the new subscriber.
+        """
+        self._submit(_PendingOperation("add", event_id, user_id))
+
+    def remove_subscriber(self, event_id: str, user_id: str) -> None:
+        """
+        Remove a subscriber from an event.
+        :param event_id: ID of the event.
+        :param user_id: ID of the subscriber to be removed.
+        """
+        self._submit(_PendingOperation("remove", event_id, user_id))
+
+    def _submit(self, operation: _PendingOperation):
+        """
+        Queue the operation and wait until it is applied.
+        When no update of the event is in progress the operation is applied at once. Otherwise it waits in the queue
+        of the event, and the first queued request applies the whole queue when the update in progress is done.
+        :param operation: The operation.
+        """
+        with self.pending_lock:
+            self.pending.setdefault(operation.event_id, []).append(operation)
+            is_leader = operation.event_id not in self.flushing
+            if is_leader:
+                self.flushing.add(operation.event_id)
+
+        if not is_leader:
+            operation.done.wait()
+            is_leader = operation.leading
+        if is_leader:
+            self._flush(operation.event_id)
+
+        if operation.error is not None:
+            raise operation.error
+
+    def _flush(self, event_id: str):
+        """
+        Apply all the queued operations of an event in one update, and pass the flush of the operations that were
+        queued meanwhile to the first of them.
+        :param event_id: ID of the event.
+        """
+        with self.pending_lock:
+            operations = self.pending.pop(event_id)
+
+        try:
+            handler = self.handler_factory()
+            try:
+                errors = handler.apply_subscriptions(
+                    [(operation.action, operation.event_id, operation.user_id) for operation in operations])
+            finally:
+                handler.close()
+        except Exception as e:
+            errors = [e] * len(operations)
+
+        for operation, error in zip(operations, errors):
+            operation.error = error
+            operation.done.set()
+
+        with self.pending_lock:
+            queue = self.pending.get(event_id)
+            if queue:
+                queue[0].leading = True
+                queue[0].done.set()
+            else:
+                self.flushing.discard(event_id)
@@ -9,20 +9,35 @@ import json
 from pathlib import Path
 from typing import Union
 
-from core.database_handler import DatabaseHandler
+from core.database_handler import DatabaseHandler, in_list_chunks
+from core.migrations import Migration
+from core.storage import UsersStorage
 from core.user import User, UserAlreadyExist, UserDoesNotExist, EventAlreadyInUser, EventDoesNotInUser
 from core.utils import generate_unique_id, hash_password, compare_hashes
 
-
 # ----- Classes ----- #
 
-class UsersHandler(DatabaseHandler):
-    def __init__(self, users_database_file: Union[str, Path]):
+class UsersHandler(DatabaseHandler, UsersStorage):
+    def __init__(self, users_database_file: Union[str, Path], pooled: bool = False):
         """
         Init the user handler class.
         :param users_database_file: The user database.
+        :param pooled: If True, take a connection of the pool, it is given back by close.
+        """
+        super().__init__(users_database_file, pooled)
+        self._migrate("users", self._users_migrations())
+
+    @classmethod
+    def _users_migrations(cls) -> list[Migration]:
         """
-        super().__init__(users_database_file)
+        Get the migrations of the users table, in the order they were introduced.
+        :return: The migrations.
+        """
+        return [
+            Migration(1, "Create the users table", cls._create_users_table),
+        ]
+
+    def _create_users_table(self):
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS users
             (user_id TEXT PRIMARY KEY, 
@@ -43,11 +58,12 @@ class UsersHandler(DatabaseHandler):
         if self.cursor.fetchone():
             raise UserAlreadyExist("A user with this name already exists.")
 
-        user.user_id = generate_unique_id()
+        user.user_id = user.user_id or generate_unique_id()
         user.hashed_password = hash_password(password)
 
         self.cursor.execute("INSERT INTO users (user_id, user_name, user_mail, hashed_password) VALUES (?, ?, ?, ?)",
                             (user.user_id, user.user_name, user.user_mail, user.hashed_password))
+        self._record_change("users", user.user_id, "add", {"user_name": user.user_name})
         self.conn.commit()
         return user.user_id
 
@@ -71,6 +87,7 @@ class UsersHandler(DatabaseHandler):
         """
         self.get_user(user_id)
         self.cursor.execute("DELETE FROM users WHERE user_id=?", (user_id,))
+        self._record_change("users", user_id, "remove")
         self.conn.commit()
 
     def add_event_to_user(self, user_id: str, event_id: str):
@@ -95,6 +112,7 @@ class UsersHandler(DatabaseHandler):
 
         # Update the user's events list in the database.
         self.cursor.execute("UPDATE users SET hosts_events=? WHERE user_id=?", (serialized_events, user_id))
+        self._record_change("users", user_id, "add_event", {"event_id": event_id})
         self.conn.commit()
 
     def remove_event_from_user(self, user_id: str, event_id: str):
@@ -120,8 +138,23 @@ class UsersHandler(DatabaseHandler):
 
         # Update the user's events list in the database.
         self.cursor.execute("UPDATE users SET hosts_events=? WHERE user_id=?", (serialized_events, user_id))
+        self._record_change("users", user_id, "remove_event", {"event_id": event_id})
         self.conn.commit()
 
+    def get_existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        """
+        Check which of the given users exist, in one query.
+        :param user_ids: Given users ids.
+        :return: The ids of the users that exist.
+        """
+        user_ids = list(set(user_ids))
+        existing = set()
+        # The chunks are below the sqlite host parameters limit, and of a few sizes that share their statements.
+        for placeholders, chunk in in_list_chunks(user_ids):
+            self.cursor.execute(f"SELECT user_id FROM users WHERE user_id IN ({placeholders})", chunk)
+            existing.update(result[0] for result in self.cursor.fetchall())
+        return existing
+
     def get_user_id_by_name(self, user_name: str) -> str:
         """
         Get user ID by its name from the database.
@@ -154,7 +187,3 @@ class UsersHandler(DatabaseHandler):
             raise ValueError("Incorrect password.")
 
         return result[0]  # Return the user id
-
-    @staticmethod
-    def send_mail(user: User, message: str):
-        print(f"Sending mail with {message} to {user.user_mail}")
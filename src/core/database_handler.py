@@ -5,26 +5,479 @@ Date: 22/10/2023
 """
 # ----- Imports ----- #
 
+import itertools
+import json
+import logging
+import os
+import re
 import sqlite3
+import threading
+import time
+from functools import lru_cache
+from datetime import datetime
 from pathlib import Path
-from typing import Union
+from typing import Callable, Iterator, Optional, Sequence, Union
+
+from core.exceptions import RemindMeBaseException
+from core.metrics import REGISTRY, record_query
+from core.migrations import BACKFILL_BATCH_SIZE, Migration, run_migrations
+from core.utils import DateTimeEncoder
 
 # ----- Constants ----- #
 
 DATABASE_NAME = "data.db"
+BACKUP_PAGES = 1024  # Pages copied in each step of an online backup.
+BACKUP_PAUSE = 0.01  # Seconds between two steps, so the writers get the database in between.
+# Statements that take longer (including the fetching of their rows) are logged.
+SLOW_QUERY_SECONDS = float(os.environ.get("REMIND_ME_SLOW_QUERY_MS", "100")) / 1000
+# Every Nth statement is added to the per statement histogram, the request stats and the slow queries count all.
+QUERY_SAMPLE_EVERY = max(int(os.environ.get("REMIND_ME_QUERY_SAMPLE_EVERY", "10")), 1)
+STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", re.IGNORECASE)
+# Prepared statements kept by every connection, the statements are built once per query shape so they are reused.
+STATEMENT_CACHE_SIZE = 256
+POOL_SIZE = 16  # Idle connections kept for the pooled handlers of every database.
+# Sizes of the IN lists, a list is padded to the next size so its statement is shared with the lists of that size.
+IN_LIST_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+# Test mode: explain the plan of every new statement and raise FullTableScan if it scans a table it could search.
+CHECK_QUERY_PLANS = os.environ.get("REMIND_ME_CHECK_QUERY_PLANS", "0") == "1"
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+CONSTRAINED_COLUMN = re.compile(r"(\w+)\s*(?:=|<|>|\bIN\b|\bBETWEEN\b)", re.IGNORECASE)
+WHERE_CLAUSE = re.compile(r"\bWHERE\b(.*?)(?:\bORDER BY\b|\bGROUP BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL)
+
+query_duration = REGISTRY.histogram("remind_me_query_duration_seconds",
+                                    "Duration of a sample of the database statements, including the fetching of "
+                                    "their rows.",
+                                    ("operation", "table"))
+slow_queries = REGISTRY.counter("remind_me_slow_queries_total",
+                                "Database statements slower than REMIND_ME_SLOW_QUERY_MS.", ("operation", "table"))
+slow_query_log = logging.getLogger("remind_me.slow_queries")
+_statements_counter = itertools.count()
+
+
+# ----- Exceptions ----- #
+
+
+class FullTableScan(RemindMeBaseException):
+    """
+    A statement scans a whole table although an index of the table covers its conditions exception.
+    """
+    pass
 
 
 # ----- Classes ----- #
 
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that records the latency of every statement. Most of the work of a query happens while its rows are
+    fetched, so a query is measured until all of its rows are read (fetchall, or fetchone returned None), until the
+    next statement or until the cursor is closed.
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._statement = None
+        self._elapsed = 0.0
+
+    def execute(self, sql: str, parameters=()):
+        self.finish()
+        if CHECK_QUERY_PLANS:
+            check_query_plan(self.connection, sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._statement, self._elapsed = sql, time.perf_counter() - start
+            if self.description is None:
+                # The statement returns no rows, it is done.
+                self.finish()
+
+    def executemany(self, sql: str, seq_of_parameters):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._statement, self._elapsed = sql, time.perf_counter() - start
+            self.finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        result = None
+        try:
+            result = super().fetchone()
+            return result
+        finally:
+            self._elapsed += time.perf_counter() - start
+            if result is None:
+                self.finish()
+
+    def fetchmany(self, size: int = 1):
+        start = time.perf_counter()
+        try:
+            return super().fetchmany(size)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._elapsed += time.perf_counter() - start
+            self.finish()
+
+    def close(self):
+        self.finish()
+        super().close()
+
+    def finish(self):
+        """
+        Record the last statement, if it was not recorded yet.
+        """
+        if self._statement is None:
+            return
+        record_query(self._elapsed)
+        if next(_statements_counter) % QUERY_SAMPLE_EVERY == 0:
+            query_duration.observe(self._elapsed, *classify_statement(self._statement))
+        if self._elapsed >= SLOW_QUERY_SECONDS:
+            slow_queries.inc(*classify_statement(self._statement))
+            slow_query_log.warning("Slow query (%.1f ms): %s", self._elapsed * 1000,
+                                   " ".join(self._statement.split())[:500])
+        self._statement = None
+
+
 class DatabaseHandler:
-    def __init__(self, database_file: Union[str, Path] = DATABASE_NAME):
+    # Reporting hook and batch size of the migrations backfills, set by the migrate job.
+    migration_progress: Optional[Callable] = None
+    backfill_batch_size: int = BACKFILL_BATCH_SIZE
+    # Schema version (the sqlite schema cookie) of every (database, scope) that was migrated by this process. A
+    # handler is created for every request, when the schema did not change since, its setup is skipped.
+    _migrated_schemas: dict[tuple[str, str], int] = {}
+    # Idle connections of every database, a pooled handler takes one and gives it back when it is closed, so the
+    # prepared statements of a connection are reused by the handlers of the next requests.
+    _pool: dict[str, list[sqlite3.Connection]] = {}
+    _pool_lock = threading.Lock()
+
+    def __init__(self, database_file: Union[str, Path] = DATABASE_NAME, pooled: bool = False):
         """
         Init the handler class.
         :param database_file: The database.
+        :param pooled: If True, take an idle connection of the process, and give it back when the handler is closed.
         """
         self._users_database_path: Path = Path(database_file)
-        self.conn = sqlite3.connect(database_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self.pooled = pooled
+        self._closed = False
+        self.conn = self._take_connection(database_file) if pooled else \
+            sqlite3.connect(database_file, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        self.cursor = self.conn.cursor(TimedCursor)
+        self._schema_version = self._read_schema_version()
+        if not self._is_migrated("core"):
+            # With a write ahead log, readers (and backups) see a snapshot and do not block the writers.
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations
+                (scope TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                backfill_key TEXT)
+            ''')
+        self._migrate("core", self._core_migrations())
+
+    @staticmethod
+    def _take_connection(database_file: Union[str, Path]) -> sqlite3.Connection:
+        """
+        Take an idle connection to a database from the pool, or open a new one.
+        :param database_file: The database.
+        :return: The connection, used only by the handler until it gives it back.
+        """
+        with DatabaseHandler._pool_lock:
+            idle = DatabaseHandler._pool.get(str(Path(database_file).resolve()))
+            if idle:
+                return idle.pop()
+        return sqlite3.connect(database_file, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+
+    def _give_back_connection(self):
+        """
+        Return the connection of a pooled handler to the pool, or close it if the pool of its database is full.
+        """
+        # The next handler gets the connection without a pending transaction or an unfinished statement.
+        self.cursor.close()
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        with DatabaseHandler._pool_lock:
+            idle = DatabaseHandler._pool.setdefault(str(self._users_database_path.resolve()), [])
+            if len(idle) < POOL_SIZE:
+                idle.append(self.conn)
+                return
+        self.conn.close()
+
+    @classmethod
+    def _core_migrations(cls) -> list[Migration]:
+        """
+        Get the migrations of the tables of every database, in the order they were introduced.
+        :return: The migrations.
+        """
+        return [
+            Migration(1, "Create the table versions and the change log", cls._create_change_tables),
+        ]
+
+    def _create_change_tables(self):
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS table_versions
+            (table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0)
+        ''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changes
+            (sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT,
+            entity_id TEXT,
+            operation TEXT,
+            data TEXT,
+            change_time DATETIME)
+        ''')
+
+    def _migrate(self, scope: str, migrations: list[Migration]) -> int:
+        """
+        Apply the pending migrations of the tables of the handler.
+        :param scope: The migrated tables.
+        :param migrations: All the migrations of the scope.
+        :return: Number of applied migrations.
+        """
+        if self._is_migrated(scope):
+            return 0
+        applied = run_migrations(self, scope, migrations, self.backfill_batch_size, type(self).migration_progress)
+        previous_version, self._schema_version = self._schema_version, self._read_schema_version()
+        if str(self._users_database_path) not in ("", ":memory:"):
+            path = str(self._users_database_path.resolve())
+            schemas = DatabaseHandler._migrated_schemas
+            verified = [key for key, version in list(schemas.items()) if key[0] == path and version == previous_version]
+            for key in verified:
+                # Migrated by this handler before the schema was changed by the migrations of the scope.
+                schemas[key] = self._schema_version
+            schemas[(path, scope)] = self._schema_version
+        return applied
+
+    def _read_schema_version(self) -> int:
+        self.cursor.execute("PRAGMA schema_version")
+        return self.cursor.fetchone()[0]
+
+    def _is_migrated(self, scope: str) -> bool:
+        """
+        Check if this process already migrated the scope in the database, and its schema did not change since.
+        """
+        key = (str(self._users_database_path.resolve()), scope)
+        return DatabaseHandler._migrated_schemas.get(key) == self._schema_version
+
+    @classmethod
+    def open_snapshot(cls, database_file: Union[str, Path] = DATABASE_NAME):
+        """
+        Open a read only handler that sees the database as it was when it was opened, for heavy reporting queries.
+        The snapshot does not block the writers, and does not create or migrate the tables.
+        :param database_file: The database, its tables should already exist.
+        :return: The handler, its mutations raise sqlite3.OperationalError.
+        """
+        handler = cls.__new__(cls)
+        handler._users_database_path = Path(database_file)
+        handler.pooled = False
+        handler._closed = False
+        handler.conn = sqlite3.connect(f"{handler._users_database_path.resolve().as_uri()}?mode=ro", uri=True,
+                                       check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        handler.cursor = handler.conn.cursor(TimedCursor)
+        handler.refresh_snapshot()
+        return handler
+
+    def refresh_snapshot(self):
+        """
+        Move a snapshot handler to the current state of the database.
+        """
+        self.conn.rollback()
+        self.cursor.execute("BEGIN")
+        # The snapshot is taken by the first read of the transaction.
+        self.cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+
+    def backup(self, target_file: Union[str, Path], pages: int = BACKUP_PAGES, pause: float = BACKUP_PAUSE):
+        """
+        Copy the database to a file while it is in use, a batch of pages at a time.
+        :param target_file: The backup file, it is overwritten.
+        :param pages: Pages copied in each step.
+        :param pause: Seconds to wait between two steps.
+        """
+        target = sqlite3.connect(target_file)
+        try:
+            self.conn.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+        finally:
+            target.close()
+
+    def _bump_version(self, table_name: str):
+        """
+        Increase the version of a table, should be called by every mutation before its commit.
+        :param table_name: The mutated table.
+        """
+        self.cursor.execute("INSERT INTO table_versions (table_name, version) VALUES (?, 1) "
+                            "ON CONFLICT(table_name) DO UPDATE SET version = version + 1", (table_name,))
+
+    def _record_change(self, table_name: str, entity_id: str, operation: str, data: Optional[dict] = None):
+        """
+        Append a mutation to the change log and increase the table version, should be called by every mutation
+        before its commit.
+        :param table_name: The mutated table.
+        :param entity_id: ID of the mutated row.
+        :param operation: What was done (e.g. 'add', 'remove', 'modify').
+        :param data: The changed values.
+        """
+        self._bump_version(table_name)
+        self.cursor.execute("INSERT INTO changes (table_name, entity_id, operation, data, change_time) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (table_name, entity_id, operation, json.dumps(data, cls=DateTimeEncoder),
+                             datetime.now()))
+
+    def get_changes(self, since: int = 0, limit: int = 100) -> list[dict]:
+        """
+        Get the mutations that were recorded after the given sequence number.
+        :param since: Sequence number of the last known change.
+        :param limit: Max number of changes to return.
+        :return: The changes, ordered by their sequence number.
+        """
+        self.cursor.execute("SELECT sequence, table_name, entity_id, operation, data, change_time FROM changes "
+                            "WHERE sequence > ? ORDER BY sequence LIMIT ?", (since, limit))
+        return [{"sequence": result[0],
+                 "table": result[1],
+                 "entity_id": result[2],
+                 "operation": result[3],
+                 "data": json.loads(result[4]),
+                 "time": result[5]} for result in self.cursor.fetchall()]
+
+    def get_last_change_sequence(self) -> int:
+        """
+        Get the sequence number of the latest change.
+        :return: The sequence number, 0 if there are no changes.
+        """
+        self.cursor.execute("SELECT MAX(sequence) FROM changes")
+        return self.cursor.fetchone()[0] or 0
+
+    def get_first_change_sequence(self) -> int:
+        """
+        Get the sequence number of the oldest change that was not trimmed.
+        :return: The sequence number, 0 if there are no changes.
+        """
+        self.cursor.execute("SELECT MIN(sequence) FROM changes")
+        return self.cursor.fetchone()[0] or 0
+
+    def trim_changes(self, keep: int) -> int:
+        """
+        Delete the oldest changes of the change log.
+        :param keep: Number of the latest changes to keep.
+        :return: Number of deleted changes.
+        """
+        self.cursor.execute("DELETE FROM changes WHERE sequence <= (SELECT MAX(sequence) FROM changes) - ?", (keep,))
+        deleted = self.cursor.rowcount
+        self.conn.commit()
+        return deleted
+
+    def _add_missing_column(self, table_name: str, column_name: str, column_definition: str):
+        """
+        Add a column to a table that may have been created with the column already, should be called by a migration.
+        :param table_name: The table.
+        :param column_name: The column.
+        :param column_definition: Type and constraints of the column.
+        """
+        self.cursor.execute(f"PRAGMA table_info({table_name})")
+        if column_name not in [column[1] for column in self.cursor.fetchall()]:
+            self.cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}")
+
+    def get_version(self, table_name: str) -> int:
+        """
+        Get the version of a table.
+        :param table_name: The table.
+        :return: The number of mutations of the table.
+        """
+        self.cursor.execute("SELECT version FROM table_versions WHERE table_name=?", (table_name,))
+        result = self.cursor.fetchone()
+        return result[0] if result else 0
 
     def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.pooled:
+            self._give_back_connection()
+            return
+        self.cursor.finish()
         self.conn.close()
+
+
+# ----- Functions ----- #
+
+@lru_cache(maxsize=1024)
+def classify_statement(sql: str) -> tuple[str, str]:
+    """
+    Get the labels of a statement for the metrics.
+    :param sql: The statement.
+    :return: Tuple of (operation, e.g. 'SELECT', first table of the statement, '' if it has none).
+    """
+    words = sql.split(maxsplit=1)
+    table = STATEMENT_TABLE.search(sql)
+    return (words[0].upper() if words else ""), (table.group(1) if table else "")
+
+
+@lru_cache(maxsize=None)
+def placeholders(count: int) -> str:
+    """
+    Get the placeholders of an IN list of the given size.
+    """
+    return ", ".join(["?"] * count)
+
+
+def in_list_chunks(values: Sequence) -> Iterator[tuple[str, list]]:
+    """
+    Split the values of an IN list to lists of the fixed sizes of IN_LIST_SIZES, so a query has a few statements
+    instead of one per number of values. The chunks are padded by repeating their last value, which does not change
+    the result of an IN condition.
+    :param values: The values, may be empty.
+    :return: Iterator of (placeholders, values of the chunk).
+    """
+    max_size = IN_LIST_SIZES[-1]
+    for index in range(0, len(values), max_size):
+        chunk = list(values[index:index + max_size])
+        size = next(size for size in IN_LIST_SIZES if size >= len(chunk))
+        chunk.extend([chunk[-1]] * (size - len(chunk)))
+        yield placeholders(size), chunk
+
+
+_checked_plans: set[tuple[str, str]] = set()
+# Statements (with their whitespace collapsed) that are known to scan a table although they compare an indexed
+# column, e.g. an OR with a branch that has no index. Every entry should say why the scan is acceptable.
+SCANNING_STATEMENTS: frozenset[str] = frozenset()
+
+
+def check_query_plan(conn: sqlite3.Connection, sql: str, parameters=()):
+    """
+    Explain the plan of a statement, once per statement and database, and fail if it reads a whole table while its
+    WHERE clause compares a column that leads an index of that table, unless it is one of SCANNING_STATEMENTS.
+    :param conn: The connection the statement runs on.
+    :param sql: The statement.
+    :param parameters: Its parameters, the plan may depend on them.
+    :raise FullTableScan: If an expected index is not used.
+    """
+    database = conn.execute("PRAGMA database_list").fetchone()[2]
+    if (database, sql) in _checked_plans:
+        return
+    operation = sql.split(maxsplit=1)[0].upper() if sql.strip() else ""
+    where = WHERE_CLAUSE.search(sql)
+    if operation not in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH") or where is None or \
+            " ".join(sql.split()) in SCANNING_STATEMENTS:
+        _checked_plans.add((database, sql))
+        return
+
+    constrained = {column.lower() for column in CONSTRAINED_COLUMN.findall(where.group(1))}
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall():
+        scan = FULL_SCAN.match(row[-1])
+        if scan is None:
+            continue
+        table = scan.group(1)
+        # The leading column of every index, None for an expression.
+        indexed = {str(conn.execute(f"PRAGMA index_info({index[1]})").fetchone()[2]).lower()
+                   for index in conn.execute(f"PRAGMA index_list({table})").fetchall()}
+        if constrained & indexed:
+            raise FullTableScan(table, " ".join(sql.split()))
+    _checked_plans.add((database, sql))
@@ -10,6 +10,7 @@ from datetime import datetime
 from typing import Optional
 
 from core.exceptions import RemindMeBaseException
+from core.utils import slotted
 
 
 # ----- Exceptions ----- #
@@ -71,9 +72,31 @@ class UserDoesNotASubscriber(RemindMeBaseException):
     pass
 
 
+class EventConflict(RemindMeBaseException):
+    """
+    Event conflicts with other events of the user exception.
+    """
+    pass
+
+
+class EventModifiedConcurrently(RemindMeBaseException):
+    """
+    Event kept being modified by other writers exception.
+    """
+    pass
+
+
+class EventVersionMismatch(RemindMeBaseException):
+    """
+    Event was modified since the expected version exception.
+    """
+    pass
+
+
 # ----- Classes ----- #
 
 
+@slotted
 @dataclasses.dataclass
 class Event:
     """
@@ -88,3 +111,4 @@ class Event:
     event_start_time: datetime
     event_end_time: datetime
     creation_time: Optional[datetime]
+    version: int = 0  # Increased by every modification of the event.
@@ -0,0 +1,96 @@
+"""
+iCalendar (RFC 5545) rendering file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from core.event import Event
+from core.utils import as_utc
+
+# ----- Constants ----- #
+
+PRODUCT_ID = "-//RemindMe//Calendar//EN"
+UID_DOMAIN = "remindme"
+MAX_LINE_OCTETS = 75  # Longer content lines are folded.
+CHUNK_SIZE = 64 * 1024  # Characters of the feed sent at once.
+
+
+# ----- Functions ----- #
+
+def escape_text(value: str) -> str:
+    """
+    Escape a TEXT property value.
+    """
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n").replace("\r", "\\n"))
+
+
+def format_time(value: datetime) -> str:
+    """
+    Format a time in UTC, naive times are treated as UTC like the stored events times.
+    """
+    return as_utc(value).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def fold_line(line: str) -> str:
+    """
+    Fold a content line to lines of up to 75 octets, without splitting a multi byte character.
+    :param line: The content line.
+    :return: The line with its CRLF, the continuation lines start with a space.
+    """
+    if len(line.encode()) <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+    parts = []
+    start = 0
+    limit = MAX_LINE_OCTETS
+    while start < len(line):
+        # An ASCII part fits as it is, a part with multi byte characters is shortened until it fits.
+        end = start + limit
+        while len(line[start:end].encode()) > limit:
+            end -= 1
+        parts.append(line[start:end])
+        start = end
+        limit = MAX_LINE_OCTETS - 1  # The leading space of a continuation line.
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def event_component(event: Event) -> str:
+    """
+    Render an event as a VEVENT component.
+    """
+    lines = ["BEGIN:VEVENT",
+             f"UID:{event.event_id}@{UID_DOMAIN}",
+             f"DTSTAMP:{format_time(event.creation_time)}",
+             f"DTSTART:{format_time(event.event_start_time)}",
+             f"DTEND:{format_time(event.event_end_time)}",
+             f"SEQUENCE:{event.version}",
+             f"SUMMARY:{escape_text(event.event_name)}",
+             f"DESCRIPTION:{escape_text(event.event_description)}",
+             f"LOCATION:{escape_text(event.location)}",
+             "END:VEVENT"]
+    return "".join(fold_line(line) for line in lines)
+
+
+def calendar_chunks(events: Iterable[Event], calendar_name: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Render a calendar of the given events, without keeping more than one chunk of it in memory.
+    :param events: The events, may be a lazy iterator.
+    :param calendar_name: Name the calendar applications show.
+    :param chunk_size: Characters to collect before yielding them.
+    :return: Iterator of the parts of the calendar.
+    """
+    chunk = "".join(fold_line(line) for line in ["BEGIN:VCALENDAR",
+                                                 "VERSION:2.0",
+                                                 f"PRODID:{PRODUCT_ID}",
+                                                 "CALSCALE:GREGORIAN",
+                                                 f"X-WR-CALNAME:{escape_text(calendar_name)}"])
+    for event in events:
+        chunk += event_component(event)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = ""
+    yield chunk + fold_line("END:VCALENDAR")
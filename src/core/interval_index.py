@@ -0,0 +1,122 @@
+"""
+Interval index file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, Optional
+
+
+# ----- Classes ----- #
+
+class _IntervalNode:
+    """
+    Node of a centered interval tree.
+    """
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center, intervals: list[tuple]):
+        """
+        Init the node.
+        :param center: The center point of the node.
+        :param intervals: The intervals that contain the center point.
+        """
+        self.center = center
+        self.by_start = sorted(intervals, key=lambda interval: interval[0])
+        self.by_end = sorted(intervals, key=lambda interval: interval[1], reverse=True)
+        self.left: Optional[_IntervalNode] = None
+        self.right: Optional[_IntervalNode] = None
+
+
+class IntervalIndex:
+    """
+    Static index of half open [start, end) intervals.
+    Overlap queries run in O(log n + k), where k is the number of reported intervals.
+    """
+
+    def __init__(self, intervals: Iterable[tuple[Any, Any, Any]] = ()):
+        """
+        Build the index.
+        :param intervals: Tuples of (start, end, item).
+        """
+        self._intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self._intervals]
+        self._root = self._build(self._intervals)
+
+    def __len__(self) -> int:
+        return len(self._intervals)
+
+    @classmethod
+    def _build(cls, intervals: list[tuple]) -> Optional[_IntervalNode]:
+        """
+        Build a centered interval tree from the given intervals.
+        :param intervals: Tuples of (start, end, item).
+        :return: The root node.
+        """
+        if not intervals:
+            return None
+
+        points = sorted([interval[0] for interval in intervals] + [interval[1] for interval in intervals])
+        center = points[len(points) // 2]
+
+        left, right, middle = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                middle.append(interval)
+
+        node = _IntervalNode(center, middle)
+        node.left = cls._build(left)
+        node.right = cls._build(right)
+        return node
+
+    def _stab(self, point, result: list):
+        """
+        Collect the items of all the intervals that satisfy start < point < end.
+        :param point: The query point.
+        :param result: List to append the items to.
+        """
+        node = self._root
+        while node is not None:
+            if point < node.center:
+                for start, end, item in node.by_start:
+                    if start >= point:
+                        break
+                    result.append(item)
+                node = node.left
+            elif point > node.center:
+                for start, end, item in node.by_end:
+                    if end <= point:
+                        break
+                    result.append(item)
+                node = node.right
+            else:
+                for start, end, item in node.by_start:
+                    if start >= point:
+                        break
+                    if end > point:
+                        result.append(item)
+                break
+
+    def overlapping(self, start, end) -> list:
+        """
+        Find all the intervals that overlap the given range.
+        A zero length range (or interval) is treated as a single point.
+        :param start: Start of the range.
+        :param end: End of the range.
+        :return: Items of the overlapping intervals.
+        """
+        result = []
+        # Intervals that started before the range and are still open at its start.
+        self._stab(start, result)
+
+        # Intervals that start inside the range.
+        low = bisect_left(self._starts, start)
+        high = bisect_left(self._starts, end) if end > start else bisect_right(self._starts, start)
+        result.extend(interval[2] for interval in self._intervals[low:high])
+        return result
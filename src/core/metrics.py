@@ -0,0 +1,200 @@
+"""
+Metrics file, counters, gauges and histograms rendered in the Prometheus text format.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# ----- Constants ----- #
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+# ----- Classes ----- #
+
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        """
+        :param name: Name of the metric.
+        :param description: The HELP line.
+        :param label_names: Names of the labels, their values are given in the same order.
+        """
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        """
+        Render the metric in the Prometheus text format.
+        :return: The lines.
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{self._format_labels(labels)} {format_value(value)}")
+        return lines
+
+    def _format_labels(self, labels: tuple, extra: Optional[tuple[str, str]] = None) -> str:
+        pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Increase the counter of the given label values.
+        """
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, *labels):
+        """
+        Set the gauge of the given label values.
+        """
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        :param buckets: Upper bounds of the buckets, in ascending order.
+        """
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        """
+        Add an observation to the histogram of the given label values.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # Count of every bucket (not cumulative) and the +Inf bucket, the sum and the count.
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        with self.lock:
+            values = sorted((labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self.values.items())
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, ('le', format_value(bound)))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            # Modules may be reloaded (e.g. by the tests), keep the values of the existing metric.
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def render(self) -> str:
+        """
+        Render all the metrics in the Prometheus text format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+class RequestStats:
+    """
+    Breakdown of the time of the current request, filled by the database cursors and the timed stages.
+    """
+    __slots__ = ("queries", "query_seconds", "stages")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.stages = {}
+
+
+REGISTRY = MetricsRegistry()
+# Set by the requests middleware, the route handlers run in copies of its context and share the object.
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+# ----- Functions ----- #
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def record_query(seconds: float):
+    """
+    Add a database statement to the stats of the current request, if there is one.
+    """
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.query_seconds += seconds
+
+
+@contextmanager
+def timed_stage(name: str):
+    """
+    Add the time of the block to the given stage (e.g. 'serialization') of the current request.
+    """
+    stats = current_request.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.stages[name] = stats.stages.get(name, 0.0) + time.perf_counter() - start
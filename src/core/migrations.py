@@ -0,0 +1,177 @@
+"""
+Schema migrations file.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import dataclasses
+from typing import Callable, Optional
+
+from core.exceptions import RemindMeBaseException
+from core.utils import slotted
+
+# ----- Constants ----- #
+
+BACKFILL_BATCH_SIZE = 1000  # Rows updated in each transaction of a backfill.
+
+
+# ----- Exceptions ----- #
+
+
+class InvalidMigrations(RemindMeBaseException):
+    """
+    Migrations versions are not unique exception.
+    """
+    pass
+
+
+# ----- Classes ----- #
+
+
+@slotted
+@dataclasses.dataclass
+class Backfill:
+    """
+    Update of the existing rows of a table, in batches ordered by a unique key, each batch in its own transaction.
+    The update should be idempotent and set absolute values, so the writers can keep running while it runs.
+    The rows with a NULL key are not updated.
+    """
+    table_name: str
+    key_column: str
+    update: Callable  # Called with (handler, keys of the batch), inside the transaction of the batch.
+
+
+@slotted
+@dataclasses.dataclass
+class Migration:
+    """
+    Step of a schema, the steps of a scope run once and in the order of their versions.
+    """
+    version: int
+    description: str
+    upgrade: Callable  # Called with the handler, inside one transaction with the version update.
+    backfill: Optional[Backfill] = None
+
+
+# ----- Functions ----- #
+
+def get_schema_version(cursor, scope: str) -> tuple[int, Optional[str]]:
+    """
+    Get the migration state of a scope.
+    :param cursor: Cursor of the database.
+    :param scope: The migrated tables (e.g. 'events').
+    :return: Tuple of (last applied version, last backfilled key of the next version, None if it is not started).
+    """
+    cursor.execute("SELECT version, backfill_key FROM schema_migrations WHERE scope=?", (scope,))
+    result = cursor.fetchone()
+    return (result[0], result[1]) if result else (0, None)
+
+
+def set_schema_version(cursor, scope: str, version: int, backfill_key: Optional[str]):
+    """
+    Set the migration state of a scope, should be called inside the transaction of the migration step.
+    :param cursor: Cursor of the database.
+    :param scope: The migrated tables.
+    :param version: Last applied version.
+    :param backfill_key: Last backfilled key of the next version, None if no backfill is in progress.
+    """
+    cursor.execute("INSERT INTO schema_migrations (scope, version, backfill_key) VALUES (?, ?, ?) "
+                   "ON CONFLICT(scope) DO UPDATE SET version = excluded.version, "
+                   "backfill_key = excluded.backfill_key", (scope, version, backfill_key))
+
+
+def run_migrations(handler, scope: str, migrations: list[Migration], batch_size: int = BACKFILL_BATCH_SIZE,
+                   progress: Optional[Callable] = None) -> int:
+    """
+    Apply the pending migrations of a scope. Every step takes the write lock and checks the state again, so
+    handlers that start together apply every step once, and an interrupted backfill resumes from its last batch.
+    :param handler: Handler of the database, with conn and cursor.
+    :param scope: The migrated tables (e.g. 'events').
+    :param migrations: All the migrations of the scope.
+    :param batch_size: Rows updated in each transaction of a backfill.
+    :param progress: Called with (scope, migration, done rows, total rows) after every backfill batch.
+    :return: Number of applied migrations.
+    """
+    migrations = sorted(migrations, key=lambda migration: migration.version)
+    if len({migration.version for migration in migrations}) != len(migrations):
+        raise InvalidMigrations(scope)
+
+    version, backfill_key = get_schema_version(handler.cursor, scope)
+    applied = 0
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        try:
+            if backfill_key is None:
+                handler.cursor.execute("BEGIN IMMEDIATE")
+                version, backfill_key = get_schema_version(handler.cursor, scope)
+                if migration.version <= version:
+                    # Applied by another handler meanwhile.
+                    handler.conn.commit()
+                    continue
+                if backfill_key is None:
+                    migration.upgrade(handler)
+                    if migration.backfill:
+                        backfill_key = ""
+                        set_schema_version(handler.cursor, scope, version, backfill_key)
+                    else:
+                        set_schema_version(handler.cursor, scope, migration.version, None)
+                handler.conn.commit()
+
+            if migration.backfill:
+                _run_backfill(handler, scope, migration, batch_size, progress)
+        except Exception:
+            handler.conn.rollback()
+            raise
+        version, backfill_key = migration.version, None
+        applied += 1
+    return applied
+
+
+def _run_backfill(handler, scope: str, migration: Migration, batch_size: int, progress: Optional[Callable]):
+    """
+    Run the backfill of a migration from its last batch, and mark the migration as applied when it is done.
+    :param handler: Handler of the database.
+    :param scope: The migrated tables.
+    :param migration: The migration.
+    :param batch_size: Rows updated in each transaction.
+    :param progress: Called with (scope, migration, done rows, total rows) after every batch.
+    """
+    backfill = migration.backfill
+    handler.cursor.execute(f"SELECT COUNT(*) FROM {backfill.table_name}")
+    total = handler.cursor.fetchone()[0]
+    done = None
+    while True:
+        handler.cursor.execute("BEGIN IMMEDIATE")
+        version, backfill_key = get_schema_version(handler.cursor, scope)
+        if backfill_key is None or version >= migration.version:
+            # Finished by another handler, which may already run the backfill of a later migration.
+            handler.conn.commit()
+            return
+        # An empty key marks a backfill that did not start, it starts from the smallest key of any type (a stored
+        # key is compared by the affinity of the key column, but an empty string is greater than every number).
+        started = backfill_key != ""
+        if done is None:
+            done = 0
+            if started:
+                handler.cursor.execute(f"SELECT COUNT(*) FROM {backfill.table_name} "
+                                       f"WHERE {backfill.key_column} <= ?", (backfill_key,))
+                done = handler.cursor.fetchone()[0]
+
+        condition = f"{backfill.key_column} > ?" if started else f"{backfill.key_column} IS NOT NULL"
+        handler.cursor.execute(f"SELECT {backfill.key_column} FROM {backfill.table_name} WHERE {condition} "
+                               f"ORDER BY {backfill.key_column} LIMIT ?",
+                               (backfill_key, batch_size) if started else (batch_size,))
+        keys = [result[0] for result in handler.cursor.fetchall()]
+        if not keys:
+            set_schema_version(handler.cursor, scope, migration.version, None)
+            handler.conn.commit()
+            return
+
+        backfill.update(handler, keys)
+        set_schema_version(handler.cursor, scope, version, keys[-1])
+        handler.conn.commit()
+        done += len(keys)
+        if progress:
+            progress(scope, migration, done, max(total, done))
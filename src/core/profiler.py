@@ -0,0 +1,105 @@
+"""
+Sampling profiler file, for the diagnosis of a running server.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from core.exceptions import RemindMeBaseException
+
+# ----- Constants ----- #
+
+DEFAULT_INTERVAL = 0.01  # Seconds between two samples.
+# Frames a thread waits in when it has nothing to do, e.g. an idle worker of the threads pool.
+IDLE_FRAMES = {("threading.py", "wait"), ("selectors.py", "select"), ("queue.py", "get"),
+               ("base_events.py", "_run_once")}
+
+
+# ----- Exceptions ----- #
+
+
+class ProfilerBusy(RemindMeBaseException):
+    """
+    A profile is already running exception.
+    """
+    pass
+
+
+# ----- Classes ----- #
+
+class StackSampler:
+    """
+    Profiler that periodically records the stack of every thread of the process, without tracing the calls, so
+    the overhead does not depend on the running code.
+    """
+    lock = threading.Lock()  # One profile at a time in the process.
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, include_idle: bool = False):
+        """
+        :param interval: Seconds between two samples.
+        :param include_idle: If True, record the threads that are waiting for work as well.
+        """
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+
+    def run(self, seconds: float) -> Counter:
+        """
+        Sample the stacks of all the threads for the given time, in the calling thread.
+        :param seconds: Duration of the profile.
+        :return: Number of samples of every stack, the stacks are tuples of frames from the thread to the leaf.
+        """
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                self.sample()
+                time.sleep(self.interval)
+        finally:
+            self.lock.release()
+        return self.stacks
+
+    def sample(self):
+        """
+        Record the current stack of every thread, except the sampling thread.
+        """
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        current = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == current:
+                continue
+            if not self.include_idle and (Path(frame.f_code.co_filename).name, frame.f_code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        """
+        Render the stacks in the collapsed format ('thread;outer;...;leaf count' lines) of flamegraph.pl, that
+        speedscope and most of the flame graph tools accept.
+        """
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+# ----- Functions ----- #
+
+def frame_label(frame) -> str:
+    """
+    Name a frame by its function, file and first line, so the samples of different lines of a function add up.
+    """
+    code = frame.f_code
+    path = Path(code.co_filename)
+    return f"{code.co_name} ({path.parent.name}/{path.name}:{code.co_firstlineno})".replace(";", ":")
@@ -0,0 +1,313 @@
+"""
+Storage interface definition.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Iterator, Optional, Union
+
+from core.event import Event
+from core.exceptions import RemindMeBaseException
+from core.user import User
+
+# ----- Constants ----- #
+
+STORAGE_SQLITE = "sqlite"
+STORAGE_MEMORY = "memory"
+STORAGE_SHARDED = "sharded"
+
+
+# ----- Exceptions ----- #
+
+
+class UnknownStorage(RemindMeBaseException):
+    """
+    Unknown storage engine exception.
+    """
+    pass
+
+
+# ----- Classes ----- #
+
+class Storage(ABC):
+    """
+    Operations every storage engine provides, for the users and the events alike.
+    """
+
+    @abstractmethod
+    def get_version(self, table_name: str) -> int:
+        """
+        Get the version of a table.
+        :param table_name: The table.
+        :return: The number of mutations of the table.
+        """
+
+    @abstractmethod
+    def get_changes(self, since: int = 0, limit: int = 100) -> list[dict]:
+        """
+        Get the mutations that were recorded after the given sequence number.
+        :param since: Sequence number of the last known change.
+        :param limit: Max number of changes to return.
+        :return: The changes, ordered by their sequence number.
+        """
+
+    @abstractmethod
+    def get_last_change_sequence(self) -> int:
+        """
+        Get the sequence number of the latest change.
+        :return: The sequence number, 0 if there are no changes.
+        """
+
+    @abstractmethod
+    def get_first_change_sequence(self) -> int:
+        """
+        Get the sequence number of the oldest change that was not trimmed.
+        :return: The sequence number, 0 if there are no changes.
+        """
+
+    @abstractmethod
+    def trim_changes(self, keep: int) -> int:
+        """
+        Delete the oldest changes of the change log.
+        :param keep: Number of the latest changes to keep.
+        :return: Number of deleted changes.
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        Release the resources of the engine.
+        """
+
+
+class UsersStorage(Storage):
+    """
+    Storage of the users.
+    """
+
+    @abstractmethod
+    def add_user(self, user: User, password: str) -> str:
+        """
+        Add user to the storage.
+        :param user: Given user to add, it gets a new id unless it already has one.
+        :param password: Password.
+        :return: User id.
+        """
+
+    @abstractmethod
+    def get_user(self, user_id: str) -> User:
+        """
+        Get user by id.
+        :param user_id: Given user id.
+        :return: User.
+        """
+
+    @abstractmethod
+    def remove_user(self, user_id: str):
+        """
+        Remove user from the storage.
+        :param user_id: Given user id to remove.
+        """
+
+    @abstractmethod
+    def add_event_to_user(self, user_id: str, event_id: str):
+        """
+        Add event id to user.
+        :param user_id: Given user to add the event.
+        :param event_id: Given event id to add.
+        """
+
+    @abstractmethod
+    def remove_event_from_user(self, user_id: str, event_id: str):
+        """
+        Remove event id from user.
+        :param user_id: Given user to remove the event.
+        :param event_id: Given event id to remove.
+        """
+
+    @abstractmethod
+    def get_existing_user_ids(self, user_ids: list[str]) -> set[str]:
+        """
+        Check which of the given users exist.
+        :param user_ids: Given users ids.
+        :return: The ids of the users that exist.
+        """
+
+    @abstractmethod
+    def get_user_id_by_name(self, user_name: str) -> str:
+        """
+        Get user ID by its name.
+        :param user_name: Name of the user.
+        :return: User ID.
+        """
+
+    @abstractmethod
+    def login(self, user_name: str, password: str) -> str:
+        """
+        Check if the user exist and if the password matches the saved hashed password.
+        :param user_name: Name of the user.
+        :param password: Password of the user.
+        :return: User id.
+        """
+
+    @staticmethod
+    def send_mail(user: User, message: str):
+        print(f"Sending mail with {message} to {user.user_mail}")
+
+
+class EventsStorage(Storage):
+    """
+    Storage of the events, the archived events and their aggregates.
+    """
+
+    @abstractmethod
+    def add_event(self, event: Event) -> str:
+        """
+        Add event to the storage.
+        :param event: Given event to add, it gets a new id unless it already has one.
+        :return: Event id.
+        """
+
+    @abstractmethod
+    def remove_event(self, event_id: str):
+        """
+        Remove event, whether it is archived or not.
+        :param event_id: Given event id to remove.
+        """
+
+    @abstractmethod
+    def modify_event(self, event_id: str, expected_version: Optional[int] = None, **changes) -> None:
+        """
+        Modify an existing event by its event ID.
+        :param event_id: ID of the event to modify.
+        :param expected_version: If entered, modify the event only if it is still in this version.
+        :param changes: Key Value pairs of the fields you want to update and their new values.
+        """
+
+    @abstractmethod
+    def get_event(self, event_id: str, include_archived: bool = False) -> Event:
+        """
+        Get event by id.
+        :param event_id: Given event id.
+        :param include_archived: If True, look for the event in the archive as well.
+        :return: Event.
+        """
+
+    @abstractmethod
+    def get_event_version_by_name(self, event_name: str) -> Optional[tuple[str, int]]:
+        """
+        Get the id and the version of an event by its name.
+        :param event_name: Name of the event.
+        :return: Tuple of (event id, version), None if the event does not exist.
+        """
+
+    @abstractmethod
+    def get_event_by_name(self, event_name: str, fields: Optional[list[str]] = None) -> Union[Event, dict, None]:
+        """
+        Get an event by its unique name, with a single lookup of the name.
+        :param event_name: Name of the event.
+        :param fields: If entered, return only these attributes of the event as a dict.
+        :return: The event, None if it does not exist.
+        """
+
+    @abstractmethod
+    def get_events_by_ids(self, events_ids: list[str] = None, fields: Optional[list[str]] = None,
+                          include_archived: bool = False) -> Union[list[Event], list[dict]]:
+        """
+        Return the given events.
+        :param events_ids: If entered, return all the events that were given. if not return all.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param include_archived: If True, return the archived events as well.
+        """
+
+    @abstractmethod
+    def get_events(self, sort_by_attribute: Optional[str] = None, reverse: bool = False,
+                   fields: Optional[list[str]] = None, include_archived: bool = False,
+                   **filters) -> Union[list[Event], list[dict]]:
+        """
+        Fetch all events with optional filtering and sorting.
+        :param sort_by_attribute: The attribute to sort by (e.g., 'event_start_time', 'creation_time', 'subscribers').
+        :param reverse: If True, sort in descending order. otherwise, sort in ascending order.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param include_archived: If True, return the archived events as well.
+        :param filters: Key Value pairs of the attributes and values you want to filter by.
+        :return: List of events that match the given filters and sorted by the provided attribute.
+        """
+
+    @abstractmethod
+    def get_upcoming_events(self, start: datetime, limit: int, fields: Optional[list[str]] = None,
+                            end: Optional[datetime] = None) -> Union[list[Event], list[dict]]:
+        """
+        Fetch the next events by their start time, without reading the events that started before.
+        :param start: Return the events that start at this time (UTC) or later.
+        :param limit: Max number of events to return.
+        :param fields: If entered, return only these attributes of each event as a dict.
+        :param end: If entered, return only the events that start at this time (UTC) or earlier.
+        :return: The events, sorted by their start time.
+        """
+
+    @abstractmethod
+    def get_user_events(self, user_id: str) -> list[Event]:
+        """
+        Fetch all the events the user hosts or subscribed to.
+        :param user_id: ID of the user.
+        :return: List of the user events.
+        """
+
+    def iter_user_events(self, user_id: str, batch_size: int = 500) -> Iterator[Event]:
+        """
+        Iterate over all the events the user hosts or subscribed to, reading them in batches, so the memory does not
+        grow with the number of events.
+        :param user_id: ID of the user.
+        :param batch_size: Number of events to read at once.
+        :return: Iterator of the user events.
+        """
+        yield from self.get_user_events(user_id)
+
+    @abstractmethod
+    def archive_events(self, ended_before: datetime, batch_size: int = 500) -> int:
+        """
+        Move the events that ended before the given time to the archive.
+        :param ended_before: Archive the events that ended before this time (UTC).
+        :param batch_size: Number of events to move in each transaction.
+        :return: Number of archived events.
+        """
+
+    @abstractmethod
+    def add_subscriber(self, event_id: str, user_id: str) -> None:
+        """
+        Add a subscriber to an event.
+        :param event_id: ID of the event.
+        :param user_id: ID of the new subscriber.
+        """
+
+    @abstractmethod
+    def remove_subscriber(self, event_id: str, user_id: str) -> None:
+        """
+        Remove a subscriber from an event.
+        :param event_id: ID of the event.
+        :param user_id: ID of the subscriber to be removed.
+        """
+
+    @abstractmethod
+    def apply_subscriber_changes(self, operations: list[tuple[str, str, str]]) -> list[Optional[Exception]]:
+        """
+        Add and remove many subscribers at once, either all the valid operations are applied or none.
+        :param operations: Tuples of (action, event id, user id), where action is 'add' or 'remove'.
+        :return: For each operation, None if it was applied, otherwise the error.
+        """
+
+    @abstractmethod
+    def get_stats(self, top: int = 10, from_day: Optional[str] = None, days: int = 30,
+                  rankings_top: Optional[int] = None) -> dict:
+        """
+        Get the maintained aggregates of the (not archived) events.
+        :param top: Number of entries in each ranking, negative for all of them.
+        :param from_day: First day (YYYY-MM-DD) of the upcoming counts, defaults to today.
+        :param days: Max number of days in the upcoming counts.
+        :param rankings_top: Number of entries in the locations and the hosts rankings, if it is not top.
+        :return: The rankings of the events by subscribers, the locations and the hosts, and the events per day.
+        """
@@ -9,6 +9,7 @@ import dataclasses
 from typing import Optional
 
 from core.exceptions import RemindMeBaseException
+from core.utils import slotted
 
 
 # ----- Exceptions ----- #
@@ -44,6 +45,7 @@ class EventDoesNotInUser(RemindMeBaseException):
 # ----- Classes ----- #
 
 
+@slotted
 @dataclasses.dataclass
 class User:
     """
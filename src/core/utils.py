@@ -8,11 +8,28 @@ import dataclasses
 import datetime
 import json
 import uuid
-import bcrypt
 
 
 # ----- Functions ----- #
 
+def slotted(cls):
+    """
+    Recreate a dataclass with __slots__, the same as dataclass(slots=True) that requires python 3.10.
+    The instances have no per instance __dict__, which makes them smaller and faster to create.
+    :param cls: Given dataclass.
+    :return: The slotted dataclass.
+    """
+    field_names = tuple(field.name for field in dataclasses.fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = field_names
+    for name in field_names + ("__dict__", "__weakref__"):
+        # Remove the default values, they are kept by the generated __init__.
+        cls_dict.pop(name, None)
+    new_cls = type(cls)(cls.__name__, cls.__bases__, cls_dict)
+    new_cls.__qualname__ = cls.__qualname__
+    return new_cls
+
+
 def generate_unique_id() -> str:
     """
     Generate a unique id for an item.
@@ -28,6 +45,7 @@ def compare_hashes(hash1: str, hash2: str) -> bool:
     :param hash2: Second given hash.
     :return: Does the hashes equals?
     """
+    import bcrypt  # Imported on the first use, most of the processes (and requests) never hash a password.
     return bcrypt.checkpw(hash1.encode('utf-8'), hash2.encode('utf-8'))
 
 
@@ -37,10 +55,22 @@ def hash_password(password: str) -> str:
     :param password: Given password.
     :return: The hashed input.
     """
+    import bcrypt
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
     return hashed_password.decode('utf-8')
 
 
+def as_utc(value: datetime.datetime) -> datetime.datetime:
+    """
+    Make a datetime comparable with the stored events times.
+    :param value: Given datetime, naive datetimes are treated as UTC.
+    :return: Timezone aware datetime.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
 class DateTimeEncoder(json.JSONEncoder):
     """
     Encoder datetime for json parse.
@@ -48,4 +78,17 @@ class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime.datetime):
             return obj.isoformat()
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            # Shallow conversion, unlike dataclasses.asdict that deep copies every field.
+            return {field: getattr(obj, field) for field in obj.__dataclass_fields__}
         return super(DateTimeEncoder, self).default(obj)
+
+
+def to_json_bytes(payload) -> bytes:
+    """
+    Encode a response payload directly, without the pydantic validation pass.
+    :param payload: Json compatible payload, may contain dataclasses (Event, User) and datetimes.
+    :return: The encoded payload, in the same format as FastAPI JSONResponse.
+    """
+    return json.dumps(payload, cls=DateTimeEncoder, ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,41 @@
+"""
+Migration job, applies the pending schema migrations and reports the progress of their backfills.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+
+from common.server_handler import CombinedHandler, USERS_DATABASE_NAME, EVENTS_DATABASE_NAME, STORAGE_ENGINES
+from common.sharded_handlers import DEFAULT_SHARDS
+from core.database_handler import DatabaseHandler
+from core.migrations import BACKFILL_BATCH_SIZE, Migration
+from core.storage import STORAGE_SQLITE
+
+
+# ----- Functions ----- #
+
+def print_progress(scope: str, migration: Migration, done: int, total: int):
+    print(f"{scope} {migration.version} ({migration.description}): {done}/{total} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the pending schema migrations. The handlers apply them on "
+                                                 "start as well, run it before deploying a version with a long "
+                                                 "backfill. An interrupted backfill resumes from its last batch.")
+    parser.add_argument("--users-database", default=USERS_DATABASE_NAME)
+    parser.add_argument("--events-database", default=EVENTS_DATABASE_NAME)
+    parser.add_argument("--storage", choices=list(STORAGE_ENGINES), default=STORAGE_SQLITE)
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Rows in each transaction.")
+    args = parser.parse_args()
+
+    DatabaseHandler.migration_progress = print_progress
+    DatabaseHandler.backfill_batch_size = args.batch_size
+    CombinedHandler(args.users_database, args.events_database, args.storage, args.shards).close()
+    print("The databases are up to date.")
+
+
+if __name__ == "__main__":
+    main()
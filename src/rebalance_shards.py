@@ -0,0 +1,29 @@
+"""
+Rebalancing job, moves the rows of the sharded engine after the number of shards changes.
+Author: Oron Moshe
+Date: 19/10/2026
+"""
+# ----- Imports ----- #
+
+import argparse
+
+from common.server_handler import EVENTS_DATABASE_NAME
+from common.sharded_handlers import rebalance_shards
+
+
+# ----- Functions ----- #
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the users and the events to their shards after changing the "
+                                                 "number of shards. Run it while the server is stopped.")
+    parser.add_argument("--database", default=EVENTS_DATABASE_NAME, help="The main database of the shards.")
+    parser.add_argument("--from-shards", type=int, required=True, help="Current number of shards.")
+    parser.add_argument("--to-shards", type=int, required=True, help="New number of shards.")
+    args = parser.parse_args()
+
+    moved = rebalance_shards(args.database, args.from_shards, args.to_shards)
+    print(f"Moved {moved} rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,82 @@ Date: 22/10/2023
 """
 # ----- Imports ----- #
 
+import hmac
+import json
+import os
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Callable, Literal, Optional, Union
 
-import uvicorn
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
+from common.change_feed import ChangeFeed, ChangeListener, TooManyListeners
+from common.idempotency_handler import (IdempotencyHandler, IdempotencyKeyReused, IdempotentRequestInProgress,
+                                        hash_request)
 from common.server_handler import CombinedHandler
-from core.user import UserDoesNotExist
+from common.sharded_handlers import DEFAULT_SHARDS
+from common.subscription_combiner import SubscriptionCombiner
+from core.compression import compress, negotiate_encoding
+from core.event import Event, EventConflict, InvalidAttribute, EventVersionMismatch
+from core.ical import calendar_chunks
+from core.metrics import COUNT_BUCKETS, REGISTRY, RequestStats, current_request, timed_stage
+from core.storage import STORAGE_SQLITE
+from core.user import User, UserDoesNotExist
+from core.utils import to_json_bytes
+
+# ----- Constants ----- #
+
+# Encode Event / User responses directly instead of the jsonable_encoder and pydantic pass.
+RAW_RESPONSES = os.environ.get("REMIND_ME_RAW_RESPONSES", "1") == "1"
+STREAM_KEEPALIVE = 15  # Seconds between two keepalive comments of an idle changes stream.
+MAX_BATCH_OPERATIONS = 1000
+# Merge concurrent subscribe / unsubscribe requests of the same event into one update.
+COMBINE_SUBSCRIPTIONS = os.environ.get("REMIND_ME_COMBINE_SUBSCRIPTIONS", "1") == "1"
+# 'sqlite' (data.db), 'memory' for ephemeral deployments that keep everything in the process, or 'sharded' to
+# partition the rows across REMIND_ME_SHARDS files.
+STORAGE = os.environ.get("REMIND_ME_STORAGE", STORAGE_SQLITE)
+SHARDS = int(os.environ.get("REMIND_ME_SHARDS", DEFAULT_SHARDS))
+RATE_LIMIT = int(os.environ.get("REMIND_ME_RATE_LIMIT", "50"))  # Requests per minute of a client, 0 to disable.
+REMINDER_INTERVAL = 60  # Seconds between two checks of the upcoming events.
+REMINDER_MAX_EVENTS = 10000  # Max number of events reminded in one check.
+# Latest changes kept by the change log, the older ones are deleted by the reminder task.
+CHANGES_RETENTION = int(os.environ.get("REMIND_ME_CHANGES_RETENTION", "100000"))
+# Budget of the preloading of the hot events and users after the startup, 0 seconds to disable it.
+WARM_UP_SECONDS = float(os.environ.get("REMIND_ME_WARM_UP_SECONDS", "10"))
+WARM_UP_EVENTS = int(os.environ.get("REMIND_ME_WARM_UP_EVENTS", "100"))  # Rendered into the response cache.
+WARM_UP_USERS = int(os.environ.get("REMIND_ME_WARM_UP_USERS", "100"))
+# Enables GET /debug/profile for the requests with this token in the X-Admin-Token header.
+PROFILER_TOKEN = os.environ.get("REMIND_ME_PROFILER_TOKEN")
+MAX_PROFILE_SECONDS = 60
+# Bodies smaller than this are sent uncompressed, the compression would save less than it costs.
+COMPRESSION_MIN_SIZE = int(os.environ.get("REMIND_ME_COMPRESSION_MIN_SIZE", "1024"))
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4"  # The response adds the charset.
+
+request_duration = REGISTRY.histogram("remind_me_http_request_duration_seconds", "Duration of the HTTP requests.",
+                                      ("method", "route", "status"))
+request_queries = REGISTRY.histogram("remind_me_http_request_queries", "Database statements of every HTTP request.",
+                                     ("route",), COUNT_BUCKETS)
+request_query_duration = REGISTRY.histogram("remind_me_http_request_query_seconds",
+                                            "Time of every HTTP request in database statements.", ("route",))
+request_stage_duration = REGISTRY.histogram("remind_me_http_request_stage_seconds",
+                                            "Time of every HTTP request in the decoding of rows and the "
+                                            "serialization of the response.", ("route", "stage"))
+reminder_tick_duration = REGISTRY.histogram("remind_me_reminder_tick_duration_seconds",
+                                            "Duration of the checks of the upcoming events.")
+reminder_lag = REGISTRY.gauge("remind_me_reminder_lag_seconds",
+                              "Delay of the last check of the upcoming events after its scheduled time.")
+reminder_last_tick = REGISTRY.gauge("remind_me_reminder_last_tick_timestamp_seconds",
+                                    "Unix time of the last check of the upcoming events.")
+reminders_sent = REGISTRY.counter("remind_me_reminders_sent_total", "Reminders of upcoming events.")
+warm_up_items = REGISTRY.gauge("remind_me_warm_up_items", "Events and users preloaded after the startup.", ("kind",))
+warm_up_duration = REGISTRY.gauge("remind_me_warm_up_seconds", "Duration of the preloading after the startup.")
 
 # ----- FastAPI server ----- #
 
@@ -22,6 +88,113 @@ app = FastAPI()
 router = APIRouter()
 
 
+class MetricsMiddleware:
+    def __init__(self, app):
+        """
+        Record the duration of every request, and how much of it went to the database, to the decoding of the rows
+        and to the serialization of the response.
+        :param app: The ASGI application
+        """
+        self.app = app
+        self.routes = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route = self.route_template(scope)
+            request_duration.observe(elapsed, scope["method"], route, str(status))
+            request_queries.observe(stats.queries, route)
+            request_query_duration.observe(stats.query_seconds, route)
+            for stage, seconds in stats.stages.items():
+                request_stage_duration.observe(seconds, route, stage)
+
+    def route_template(self, scope) -> str:
+        """
+        Get the path template of the route that handled the request, to keep the number of labels bounded.
+        :param scope: The request scope, the router sets its endpoint.
+        :return: The template, 'unmatched' if there is no route.
+        """
+        if self.routes is None:
+            self.routes = {route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")}
+        return self.routes.get(scope.get("endpoint"), "unmatched")
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        """
+        Compress the responses by the Accept-Encoding of the request. Streamed responses (e.g. server sent events)
+        and responses that are already compressed are sent as they are.
+        :param app: The ASGI application
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            response_start, start_message = start_message, None
+            response_headers = [(name, value) for name, value in response_start["headers"]
+                                if name.lower() != b"content-length"]
+            names = {name.lower() for name, _ in response_headers}
+            content_type = dict((name.lower(), value) for name, value in response_headers).get(b"content-type", b"")
+            body = message.get("body", b"")
+            if message.get("more_body") or b"content-encoding" in names or \
+                    content_type.startswith(b"text/event-stream") or len(body) < COMPRESSION_MIN_SIZE:
+                await send(response_start)
+                await send(message)
+                return
+
+            with timed_stage("compression"):
+                body = compress(body, encoding)
+            response_headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode())]
+            if b"vary" not in names:
+                response_headers.append((b"vary", b"Accept-Encoding"))
+            await send({**response_start, "headers": response_headers})
+            await send({**message, "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+# The last added middleware runs first, the metrics include the compression.
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
 class RateLimiter:
     def __init__(self, requests: int, window: int):
         """
@@ -54,18 +227,227 @@ class RateLimiter:
         return False
 
 
-rate_limiter = RateLimiter(requests=50, window=60)  # 50 requests per minute
+rate_limiter = RateLimiter(requests=RATE_LIMIT, window=60)
 
 
 def rate_limit(request: Request):
     client_ip = request.client.host
-    if not rate_limiter.request(client_ip):
+    if RATE_LIMIT and not rate_limiter.request(client_ip):
         raise HTTPException(status_code=429, detail="Too many requests")
     return True
 
 
+class ResponseCache:
+    def __init__(self, max_entries: int):
+        """
+        :param max_entries: Number of rendered responses to keep
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[bytes]:
+        """
+        Get a rendered response body.
+
+        :param key: The request path and query
+        :param etag: The current ETag of the resource
+        :return: The body if it was rendered for the current ETag, None otherwise
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, etag: str, body: bytes):
+        """
+        Store a rendered response body, evicting the least recently used one.
+        """
+        with self.lock:
+            self.entries[key] = (etag, body)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+response_cache = ResponseCache(max_entries=256)
+
+
+def open_handler(pooled: bool = False) -> CombinedHandler:
+    """
+    Open a handler of the configured storage, for the background tasks and the streams, the caller closes it.
+    :param pooled: If True, take connections of the pool, so their prepared statements are reused.
+    """
+    return CombinedHandler(storage=STORAGE, shards=SHARDS, pooled=pooled)
+
+
 def get_handler():
-    return CombinedHandler()
+    handler = open_handler(pooled=True)
+    try:
+        yield handler
+    finally:
+        # The connections go back to the pool for the next requests.
+        handler.close()
+
+
+def get_snapshot_handler():
+    handler = CombinedHandler(storage=STORAGE, shards=SHARDS, read_only=True)
+    try:
+        yield handler
+    finally:
+        # An open snapshot keeps the write ahead log from being checkpointed.
+        handler.close()
+
+
+def get_idempotency_handler():
+    handler = IdempotencyHandler(pooled=True)
+    try:
+        yield handler
+    finally:
+        handler.close()
+
+
+def run_idempotent(idempotency_handler: IdempotencyHandler, idempotency_key: Optional[str], route: str,
+                   parameters: dict, create: Callable[[], dict]) -> dict:
+    """
+    Run a create request once per idempotency key, a retry returns the response of the first request.
+    :param idempotency_handler: The idempotency keys store.
+    :param idempotency_key: The Idempotency-Key header, None to always run the request.
+    :param route: The route of the request.
+    :param parameters: The parameters of the request, a retry should send the same ones.
+    :param create: Run the request.
+    :return: The json response.
+    """
+    if idempotency_key is None:
+        return create()
+    try:
+        stored_response, claimed_at = idempotency_handler.begin(idempotency_key, route, hash_request(parameters))
+    except IdempotentRequestInProgress:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="The Idempotency-Key was used with other parameters")
+    if stored_response is not None:
+        return stored_response
+
+    try:
+        response = create()
+    except Exception:
+        idempotency_handler.abort(idempotency_key, route, claimed_at)
+        raise
+    # A request that lost its claim returns its own response, the key keeps the response of the retry that took it
+    # over.
+    idempotency_handler.complete(idempotency_key, route, claimed_at, response)
+    return response
+
+
+def event_etag(event_id: str, version: int, users_version: int) -> str:
+    """
+    Build the ETag of GET /get_event, also accepted by the If-Match header of PUT /modify_event.
+    """
+    return f'W/"event-{event_id}-{version}-{users_version}"'
+
+
+def event_version_from_etag(etag: str, event_id: str) -> Optional[int]:
+    """
+    Extract the event version from an ETag of GET /get_event.
+    :param etag: The ETag.
+    :param event_id: ID of the event.
+    :return: The version, None if the ETag is not of this event.
+    """
+    prefix = f'"event-{event_id}-'
+    etag = etag.strip().removeprefix("W/")
+    if not etag.startswith(prefix):
+        return None
+    version = etag[len(prefix):].split("-")[0]
+    return int(version) if version.isdigit() else None
+
+
+change_feed = ChangeFeed(open_handler)
+subscription_combiner = SubscriptionCombiner(lambda: open_handler(pooled=True))
+
+
+def encode_payload(payload) -> bytes:
+    """
+    Encode the response of a route that returns events or users.
+    :param payload: The route result.
+    :return: The json body.
+    """
+    with timed_stage("serialization"):
+        if not RAW_RESPONSES:
+            payload = jsonable_encoder(payload)
+        return to_json_bytes(payload)
+
+
+def json_response(payload):
+    """
+    Build the response of a route that returns events or users.
+    :param payload: The route result.
+    :return: Pre encoded response in raw responses mode, otherwise the payload itself.
+    """
+    if not RAW_RESPONSES:
+        return payload
+    return Response(content=encode_payload(payload), media_type="application/json")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Check if the client already has the given version of the resource.
+    """
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """
+    Evaluate the conditional headers of a GET, If-Modified-Since is only used without If-None-Match.
+    :param request: The request.
+    :param etag: ETag of the current version of the resource.
+    :param last_modified: Last modification time of the resource, None if unknown.
+    :return: True if the client has the current version.
+    """
+    if "if-none-match" in request.headers:
+        return etag_matches(request, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    return since.tzinfo is not None and last_modified.replace(microsecond=0) <= since
+
+
+def cached_response(request: Request, etag: str, render: Callable[[], object]) -> Response:
+    """
+    Answer a conditional GET from the ETag, or from the cached rendered body.
+    :param request: The request.
+    :param etag: ETag of the current version of the resource.
+    :param render: Build the route result, called only if the body is not cached.
+    :return: 304 if the client has the current version, otherwise the body.
+    """
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    key = f"{request.url.path}?{request.url.query}"
+    body = response_cache.get(key, etag)
+    if body is None:
+        body = encode_payload(render())
+        response_cache.put(key, etag, body)
+
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+        # The compressed body is cached as well, the middleware leaves a compressed response as it is.
+        compressed = response_cache.get(f"{key}#{encoding}", etag)
+        if compressed is None:
+            with timed_stage("compression"):
+                compressed = compress(body, encoding)
+            response_cache.put(f"{key}#{encoding}", etag, compressed)
+        body = compressed
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # ----- Routs ----- #
@@ -91,13 +473,17 @@ def register(
         username: str,
         mail: str,
         password: str,
-        handler: CombinedHandler = Depends(get_handler)):
-    return {"user_id": handler.add_user(username, mail, password)}
+        idempotency_key: Optional[str] = Header(None),
+        handler: CombinedHandler = Depends(get_handler),
+        idempotency_handler: IdempotencyHandler = Depends(get_idempotency_handler)):
+    # The password is left out of the stored hash, it would be an unsalted hash of the password.
+    return run_idempotent(idempotency_handler, idempotency_key, "register", {"username": username, "mail": mail},
+                          lambda: {"user_id": handler.add_user(username, mail, password)})
 
 
 @router.get("/get_user/{user_id}/", dependencies=[Depends(rate_limit)])
 def get_user(user_id: str, handler: CombinedHandler = Depends(get_handler)):
-    return handler.get_user(user_id)
+    return json_response(handler.get_user(user_id))
 
 
 @router.delete("/remove_user/{user_id}/", dependencies=[Depends(rate_limit)])
@@ -114,23 +500,35 @@ def schedule_event(
         location: str,
         start: datetime,
         end: datetime = None,
-        handler: CombinedHandler = Depends(get_handler)):
-    return {"event_id": handler.add_event(user_id,
-                                          name,
-                                          description,
-                                          location,
-                                          [],
-                                          start,
-                                          end)}
+        check_conflicts: bool = False,
+        idempotency_key: Optional[str] = Header(None),
+        handler: CombinedHandler = Depends(get_handler),
+        idempotency_handler: IdempotencyHandler = Depends(get_idempotency_handler)):
+    try:
+        parameters = {"user_id": user_id, "name": name, "description": description, "location": location,
+                      "start": start, "end": end, "check_conflicts": check_conflicts}
+        return run_idempotent(idempotency_handler, idempotency_key, "schedule_event", parameters,
+                              lambda: {"event_id": handler.add_event(user_id,
+                                                                     name,
+                                                                     description,
+                                                                     location,
+                                                                     [],
+                                                                     start,
+                                                                     end,
+                                                                     check_conflicts)})
+    except EventConflict as e:
+        raise HTTPException(status_code=409, detail={"conflicts": e.args[0]})
 
 
 @router.delete("/remove_event/{event_name}/", dependencies=[Depends(rate_limit)])
 def remove_event(user_id: str, event_name: str, handler: CombinedHandler = Depends(get_handler)):
-    event = handler.get_events_by_attribute(event_name=event_name)[0]
-    if event.created_user_id != user_id:
+    event = handler.get_event_by_name(event_name, fields=["event_id", "created_user_id"])
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event does not exist.")
+    if event["created_user_id"] != user_id:
         raise Exception("Only the user who created this event can remove it. Invalid user id.")
-    handler.remove_event(event.event_id)
-    handler.send_message(event.event_id, "The event is cancelled.")
+    handler.remove_event(event["event_id"], event["created_user_id"])
+    handler.send_message(event["event_id"], "The event is cancelled.")
     return {"message": "Event removed successfully"}
 
 
@@ -143,33 +541,77 @@ def modify_event(
         location: str = None,
         start: datetime = None,
         end: datetime = None,
+        if_match: Optional[str] = Header(None),
         handler: CombinedHandler = Depends(get_handler)
 ):
-    event = handler.get_events_by_attribute(event_name=event_name)[0]
-    if event.created_user_id != user_id:
+    event = handler.get_event_by_name(event_name, fields=["event_id", "created_user_id"])
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event does not exist.")
+    if event["created_user_id"] != user_id:
         raise Exception("Only the user who created this event can modify it. Invalid user id.")
 
+    expected_version = None
+    if if_match is not None and if_match.strip() != "*":
+        expected_version = event_version_from_etag(if_match, event["event_id"])
+        if expected_version is None:
+            raise HTTPException(status_code=412, detail="If-Match does not match the event")
+
     changes = {}
     if name: changes["event_name"] = name
     if description: changes["event_description"] = description
     if location: changes["location"] = location
     if start: changes["event_start_time"] = start
     if end: changes["event_end_time"] = end
-    handler.modify_event(event.event_id, **changes)
+    try:
+        handler.modify_event(event["event_id"], expected_version, **changes)
+    except EventVersionMismatch:
+        raise HTTPException(status_code=412, detail="The event was modified since the If-Match version")
 
     # Update all the users who invited.
-    handler.send_message(event.event_id, "The event have been modify. please check this out.")
+    handler.send_message(event["event_id"], "The event have been modify. please check this out.")
     return {"message": "Event modified successfully"}
 
 
 @router.get("/events", dependencies=[Depends(rate_limit)])
 def get_events_by_attribute(
+        request: Request,
         sort_by_attribute: str = None,  # Event
         reverse: bool = False,
         location: Optional[str] = None,
+        fields: Optional[str] = None,  # Comma separated Event attributes.
+        include_archived: bool = False,
+        response_format: Literal["full", "compact"] = Query("full", alias="format"),
         handler: CombinedHandler = Depends(get_handler)
 ):
-    events = handler.get_events_by_attribute(sort_by_attribute, reverse, location_filter=location)
+    events_version, users_version = handler.get_versions()
+    etag = f'W/"events-{events_version}-{users_version}"'
+    return cached_response(request, etag,
+                           lambda: render_events(handler, sort_by_attribute, reverse, location, fields,
+                                                 include_archived, response_format == "compact"))
+
+
+def render_events(handler: CombinedHandler, sort_by_attribute: Optional[str], reverse: bool, location: Optional[str],
+                  fields: Optional[str], include_archived: bool, compact: bool = False):
+    events = resolve_events(handler, sort_by_attribute, reverse, location, fields, include_archived)
+    return compact_events(events) if compact else events
+
+
+def resolve_events(handler: CombinedHandler, sort_by_attribute: Optional[str], reverse: bool, location: Optional[str],
+                   fields: Optional[str], include_archived: bool):
+    selected_fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    try:
+        events = handler.get_events_by_attribute(sort_by_attribute, reverse, location_filter=location,
+                                                 fields=selected_fields, include_archived=include_archived)
+    except InvalidAttribute as e:
+        raise HTTPException(status_code=400, detail=f"Invalid attribute: {e}")
+
+    if selected_fields:
+        if "subscribers" in selected_fields:
+            for event in events:
+                event["subscribers"] = [handler.get_user(subscriber_id).user_name
+                                        for subscriber_id in event["subscribers"]]
+        return events
+
     users = []
     for event in events:
         for subscriber_id in event.subscribers:
@@ -179,27 +621,67 @@ def get_events_by_attribute(
     return events
 
 
+def compact_events(events: Union[list[Event], list[dict]]) -> dict:
+    """
+    Build the compact format of a list of events: the user names and the locations, that repeat across the events,
+    are sent once and referenced by their index, and every event is a list of values in the order of 'fields'.
+    :param events: The events, or their records with the selected fields.
+    :return: Dict of 'fields', 'users', 'locations' and 'events'.
+    """
+    fields = list(events[0].keys() if isinstance(events[0], dict) else Event.__dataclass_fields__) if events else []
+    users, locations = {}, {}
+    rows = []
+    for event in events:
+        row = []
+        for field in fields:
+            value = event[field] if isinstance(event, dict) else getattr(event, field)
+            if field == "subscribers":
+                value = [users.setdefault(name, len(users)) for name in value]
+            elif field == "location":
+                value = locations.setdefault(value, len(locations))
+            row.append(value)
+        rows.append(row)
+    return {"fields": fields, "users": list(users), "locations": list(locations), "events": rows}
+
+
 @router.get("/get_event/{event_name}/", dependencies=[Depends(rate_limit)])
-def get_event(event_name: str, handler: CombinedHandler = Depends(get_handler)):
-    event = handler.get_events_by_attribute(event_name=event_name)
-    if len(event) != 1:
+def get_event(request: Request, event_name: str, handler: CombinedHandler = Depends(get_handler)):
+    event_version = handler.get_event_version_by_name(event_name)
+    if event_version is None:
+        return None
+    event_id, version = event_version
+    _, users_version = handler.get_versions()
+    etag = event_etag(event_id, version, users_version)
+    return cached_response(request, etag, lambda: render_event(handler, event_name))
+
+
+def render_event(handler: CombinedHandler, event_name: str):
+    event = handler.get_event_by_name(event_name)
+    if event is None:
         return None
-    event[0].created_user_id = handler.get_user(event[0].created_user_id).user_name
+    event.created_user_id = handler.get_user(event.created_user_id).user_name
 
     users = []
-    for subscriber_id in event[0].subscribers:
+    for subscriber_id in event.subscribers:
         users.append(handler.get_user(subscriber_id).user_name)
-    event[0].subscribers = users
-    return event[0]
+    event.subscribers = users
+    return event
 
 
 @router.post("/add_subscriber/", dependencies=[Depends(rate_limit)])
 def add_subscriber_to_event(
         event_id: str,
         user_id: str,
+        check_conflicts: bool = False,
         handler: CombinedHandler = Depends(get_handler)
 ):
-    handler.add_subscriber_to_event(event_id, user_id)
+    if COMBINE_SUBSCRIPTIONS and not check_conflicts:
+        subscription_combiner.add_subscriber(event_id, user_id)
+        return {"message": "Subscriber added successfully"}
+    try:
+        handler.add_subscriber_to_event(event_id, user_id, check_conflicts)
+    except EventConflict as e:
+        raise HTTPException(status_code=409, detail={"conflicts": e.args[0]})
     return {"message": "Subscriber added successfully"}
 
 
@@ -209,10 +691,217 @@ def remove_subscriber_from_event(
         user_id: str,
         handler: CombinedHandler = Depends(get_handler)
 ):
-    handler.remove_subscriber_from_event(event_id, user_id)
+    if COMBINE_SUBSCRIPTIONS:
+        subscription_combiner.remove_subscriber(event_id, user_id)
+    else:
+        handler.remove_subscriber_from_event(event_id, user_id)
     return {"message": "Subscriber removed successfully"}
 
 
+class SubscriptionOperation(BaseModel):
+    action: Literal["add", "remove"]
+    event_id: str
+    user_id: str
+
+
+@router.post("/subscriptions/batch", dependencies=[Depends(rate_limit)])
+def apply_subscriptions(
+        operations: list[SubscriptionOperation],
+        handler: CombinedHandler = Depends(get_handler)
+):
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_OPERATIONS} operations per batch")
+    errors = handler.apply_subscriptions([(operation.action, operation.event_id, operation.user_id)
+                                          for operation in operations])
+    results = []
+    for operation, error in zip(operations, errors):
+        result = {"action": operation.action, "event_id": operation.event_id, "user_id": operation.user_id,
+                  "status": "success" if error is None else "error"}
+        if error is not None:
+            result["detail"] = type(error).__name__
+        results.append(result)
+    return {"results": results}
+
+
+@router.get("/stats", dependencies=[Depends(rate_limit)])
+def get_stats(top: int = 10, days: int = 30, handler: CombinedHandler = Depends(get_snapshot_handler)):
+    return handler.get_stats(min(top, 100), min(days, 366))
+
+
+@router.get("/metrics")
+def get_metrics():
+    # Not rate limited, it is scraped periodically. The metrics are per process.
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/debug/profile")
+async def profile(
+        seconds: float = 10,
+        interval_ms: float = 10,
+        include_idle: bool = False,
+        x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Sample the stacks of all the threads of the process (the requests, the reminders loop, the event loop) for the
+    given time, and return them in the collapsed format of the flame graph tools.
+    """
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token.encode(), PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or interval_ms < 1:
+        raise HTTPException(status_code=400, detail=f"seconds should be up to {MAX_PROFILE_SECONDS} and "
+                                                    f"interval_ms at least 1")
+
+    from core.profiler import ProfilerBusy, StackSampler  # Rarely used, imported on demand.
+
+    sampler = StackSampler(interval_ms / 1000, include_idle)
+    try:
+        # The sampling thread does not appear in the samples.
+        await run_in_threadpool(sampler.run, seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(sampler.collapsed(), headers={
+        "Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"',
+        "X-Profile-Samples": str(sampler.samples)})
+
+
+@router.get("/users/{user_id}/freebusy", dependencies=[Depends(rate_limit)])
+def get_free_busy(
+        user_id: str,
+        start: datetime,
+        end: datetime,
+        handler: CombinedHandler = Depends(get_handler)
+):
+    try:
+        events = handler.get_free_busy(user_id, start, end)
+    except UserDoesNotExist:
+        raise HTTPException(status_code=404, detail="User does not exist.")
+    busy = [{"event_id": event.event_id,
+             "event_name": event.event_name,
+             "start": event.event_start_time,
+             "end": event.event_end_time} for event in events]
+    return json_response({"user_id": user_id, "busy": busy})
+
+
+@router.get("/users/{user_id}/calendar.ics", dependencies=[Depends(rate_limit)])
+def get_calendar(request: Request, user_id: str, handler: CombinedHandler = Depends(get_handler)):
+    """
+    iCalendar feed of the events the user hosts or subscribed to, for calendar applications.
+    """
+    try:
+        user = handler.get_user(user_id)
+    except UserDoesNotExist:
+        raise HTTPException(status_code=404, detail="User does not exist.")
+
+    # The validators are read without reading the events, so a poll of an unchanged calendar is cheap. The users
+    # version is included, since the calendar is named after the user.
+    events_version, users_version = handler.get_versions()
+    etag = f'W/"calendar-{user_id}-{events_version}-{users_version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    last_modified = last_change_time(handler)
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return StreamingResponse(calendar_feed(handler, user), media_type="text/calendar", headers=headers)
+
+
+def last_change_time(handler: CombinedHandler) -> Optional[datetime]:
+    """
+    Get the time of the latest change of the change log.
+    :return: The time in UTC, None if nothing was changed.
+    """
+    sequence = handler.get_last_change_sequence()
+    changes = handler.get_changes(sequence - 1, 1) if sequence else []
+    if not changes:
+        return None
+    # The changes are recorded in the local time of the server.
+    return datetime.fromisoformat(str(changes[0]["time"])).astimezone(timezone.utc)
+
+
+def calendar_feed(handler: CombinedHandler, user: User):
+    """
+    Stream the calendar of the user, the events are read in batches while it is sent.
+    """
+    try:
+        yield from calendar_chunks(handler.iter_user_events(user.user_id), f"RemindMe - {user.user_name}")
+    finally:
+        handler.close()
+
+
+def changes_are_retained(handler: CombinedHandler, since: int) -> bool:
+    """
+    Check that none of the changes after the given sequence number was trimmed from the change log.
+    """
+    first_sequence = handler.get_first_change_sequence()
+    return not first_sequence or since >= first_sequence - 1
+
+
+@router.get("/changes", dependencies=[Depends(rate_limit)])
+def get_changes(since: int = 0, limit: int = 100, handler: CombinedHandler = Depends(get_handler)):
+    if not changes_are_retained(handler, since):
+        # The client missed trimmed changes, it should read the current state and resume from 'next_since'.
+        raise HTTPException(status_code=410, detail={"message": "The changes after 'since' were trimmed",
+                                                     "next_since": handler.get_last_change_sequence()})
+    changes = handler.get_changes(since, min(limit, 1000))
+    next_since = changes[-1]["sequence"] if changes else since
+    return {"changes": changes, "next_since": next_since}
+
+
+@router.get("/changes/stream", dependencies=[Depends(rate_limit)])
+async def stream_changes(request: Request, since: Optional[int] = None):
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)  # Reconnection of an EventSource.
+    try:
+        listener = change_feed.subscribe()
+    except TooManyListeners:
+        raise HTTPException(status_code=503, detail="Too many change stream listeners")
+    return StreamingResponse(server_sent_changes(listener, since), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+async def server_sent_changes(listener: ChangeListener, since: Optional[int]):
+    """
+    Stream the changes after the given sequence number as server sent events.
+    """
+    try:
+        handler = await run_in_threadpool(open_handler)
+        if since is not None and not await run_in_threadpool(changes_are_retained, handler, since):
+            # The client should read the current state and resume from 'since'.
+            since = await run_in_threadpool(handler.get_last_change_sequence)
+            handler.close()
+            yield f"event: reset\ndata: {json.dumps({'since': since, 'resync': True})}\n\n"
+            return
+        if since is None:
+            since = await run_in_threadpool(handler.get_last_change_sequence)
+
+        # Catch up from the change log, the listener already collects the newer changes.
+        changes = await run_in_threadpool(handler.get_changes, since, 500)
+        while changes:
+            for change in changes:
+                yield f"id: {change['sequence']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            since = changes[-1]["sequence"]
+            changes = await run_in_threadpool(handler.get_changes, since, 500)
+        handler.close()
+
+        while not listener.overflowed:
+            changes = await listener.get(STREAM_KEEPALIVE)
+            if changes is None:
+                yield ": keepalive\n\n"
+                continue
+            for change in changes:
+                if change["sequence"] > since:
+                    yield f"id: {change['sequence']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+                    since = change["sequence"]
+
+        # The listener fell behind, the client should resume with 'since'.
+        yield f"event: reset\ndata: {json.dumps({'since': since})}\n\n"
+    finally:
+        change_feed.unsubscribe(listener)
+
+
 def check_for_upcoming_events(handler: CombinedHandler):
     """
     Check for events starting in the next 30 minutes and send reminders.
@@ -221,38 +910,120 @@ def check_for_upcoming_events(handler: CombinedHandler):
     twenty_nine_minutes_from_now = now + timedelta(minutes=29, hours=3)
     thirty_minutes_from_now = now + timedelta(minutes=30, hours=3)
 
-    # Fetch all events starting between 29 and 30 minutes from now.
-    upcoming_events = handler.events_handler.get_events(sort_by_attribute='event_start_time',
-                                                        location_filter=None)
+    # Fetch the events starting between 29 and 30 minutes from now, a range of the start time index.
+    upcoming_events = handler.get_upcoming_events(REMINDER_MAX_EVENTS, fields=["event_id"],
+                                                  start=twenty_nine_minutes_from_now, end=thirty_minutes_from_now)
     for event in upcoming_events:
-        if twenty_nine_minutes_from_now <= event.event_start_time <= thirty_minutes_from_now:
-            handler.send_message(event.event_id, "It will start in 30 minutes.")
+        handler.send_message(event["event_id"], "It will start in 30 minutes.")
+        reminders_sent.inc()
 
 
-def reminder_background_task(handler: CombinedHandler):
+def reminder_background_task(handler: Optional[CombinedHandler] = None):
     """
     Background task to run every minute and check for events starting in the next 30 minutes.
     """
+    handler = handler or open_handler()
+    next_tick = time.monotonic()
     while True:
+        start = time.monotonic()
+        reminder_lag.set(start - next_tick)
+        reminder_last_tick.set(time.time())
         check_for_upcoming_events(handler)
-        time.sleep(60)  # Check every minute
+        handler.trim_changes(CHANGES_RETENTION)
+        reminder_tick_duration.observe(time.monotonic() - start)
+        # Keep a fixed rate, a slow check delays the next one instead of every one after it.
+        next_tick = max(next_tick + REMINDER_INTERVAL, start)
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+
+def warm_up():
+    """
+    Prepare the process after it started serving: set up the schema of the databases, that is checked once per
+    process, load the modules that are imported on their first use and preload the hot events and users.
+    """
+    import bcrypt  # noqa: F401
+    handler = open_handler()
+    try:
+        warm_caches(handler)
+    finally:
+        handler.close()
+
+
+def warm_caches(handler: CombinedHandler, seconds: float = WARM_UP_SECONDS, max_events: int = WARM_UP_EVENTS,
+                max_users: int = WARM_UP_USERS) -> int:
+    """
+    Preload what the first requests after a deploy are likely to read: GET /get_event of the next and the most
+    popular events is rendered into the response cache, which reads the records of their subscribers as well, and
+    the records of the most active hosts are read, so the database pages of all of them are in the page cache.
+    :param handler: The handler.
+    :param seconds: Time budget, the preloading stops when it is over.
+    :param max_events: Max number of events to render.
+    :param max_users: Max number of most active hosts to read.
+    :return: Number of preloaded events and users.
+    """
+    start = time.monotonic()
+    deadline = start + seconds
+    events, users = 0, 0
+    if time.monotonic() >= deadline:
+        return 0
+
+    # A range of the start time index, the past events are not read.
+    upcoming = handler.get_upcoming_events(max_events, fields=["event_id", "event_name"])
+    if time.monotonic() > deadline:
+        return 0
+    stats = handler.get_stats(top=max(max_events, max_users))
+    hot_events = [(event["event_id"], event["event_name"]) for event in upcoming] + \
+                 [(event["event_id"], event["event_name"]) for event in stats["popular_events"]]
+
+    _, users_version = handler.get_versions()
+    for event_id, event_name in list(dict.fromkeys(hot_events))[:max_events]:
+        if time.monotonic() > deadline:
+            break
+        event_version = handler.get_event_version_by_name(event_name)
+        if event_version is None:
+            continue
+        # The key and the ETag of the request, as in cached_response.
+        key = f"/get_event/{event_name}/?"
+        etag = event_etag(event_version[0], event_version[1], users_version)
+        if response_cache.get(key, etag) is None:
+            try:
+                response_cache.put(key, etag, encode_payload(render_event(handler, event_name)))
+            except UserDoesNotExist:
+                continue
+        events += 1
+
+    for host in stats["hosts"][:max_users]:
+        if time.monotonic() > deadline:
+            break
+        try:
+            handler.get_user(host["host"])
+        except UserDoesNotExist:
+            continue
+        users += 1
+
+    warm_up_items.set(events, "events")
+    warm_up_items.set(users, "users")
+    warm_up_duration.set(time.monotonic() - start)
+    return events + users
 
 
 @app.on_event("startup")
 async def on_startup():
-    handler = get_handler()
-    thread = threading.Thread(target=reminder_background_task, args=(handler,))
-    thread.daemon = True
-    thread.start()
+    # The server accepts requests without waiting for them, a request that comes first sets up the schema itself.
+    for task in (warm_up, reminder_background_task):
+        thread = threading.Thread(target=task, name=task.__name__)
+        thread.daemon = True
+        thread.start()
 
 
 @app.on_event("shutdown")
 def shutdown():
-    handler = get_handler()
-    handler.close()
+    change_feed.stop()
 
 
 app.include_router(router)
 
 if __name__ == "__main__":
+    import uvicorn  # Not needed when the app is served by the uvicorn command.
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from starlette.requests import Request
+import remind_me_api
+from common.server_handler import CombinedHandler
+from core.event import Event
+from core.ical import calendar_chunks, escape_text, fold_line
+import tempfile
+import os
+
+now = datetime.utcnow()
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def handler(temp_db_file):
+    handler = CombinedHandler(temp_db_file, temp_db_file)
+    yield handler
+    handler.close()
+
+
+def make_request(**headers) -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "query_string": b"",
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def read_body(response) -> str:
+    async def read():
+        return "".join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(read())
+
+
+def test_escape_text():
+    assert escape_text("a,b;c\\d\ne") == r"a\,b\;c\\d\ne"
+
+
+def test_fold_line():
+    assert fold_line("SUMMARY:short") == "SUMMARY:short\r\n"
+    folded = fold_line("DESCRIPTION:" + "שלום" * 30)
+    lines = folded[:-2].split("\r\n")
+    assert all(len(line.encode()) <= 75 for line in lines)
+    assert all(line.startswith(" ") for line in lines[1:])
+    assert "".join(line[1:] if index else line for index, line in enumerate(lines)) == "DESCRIPTION:" + "שלום" * 30
+
+
+def test_calendar_chunks():
+    events = (Event(f"id{index}", "user1", f"Event{index}", "Description", "Holon", [], now, now, now)
+              for index in range(100))
+    chunks = list(calendar_chunks(events, "Calendar", chunk_size=1000))
+    assert len(chunks) > 1
+    calendar = "".join(chunks)
+    assert calendar.startswith("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+    assert calendar.endswith("END:VCALENDAR\r\n")
+    assert calendar.count("BEGIN:VEVENT") == 100
+    assert "UID:id7@remindme\r\n" in calendar
+
+
+def test_calendar_feed(handler):
+    host_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    subscriber_id = handler.add_user("Dana", "dana@gmail.com", "111")
+    handler.add_event(host_id, "Hosted", "Description", "Holon", [], now + timedelta(days=1))
+    handler.add_event(subscriber_id, "Subscribed", "Description", "Haifa, Israel", [host_id], now + timedelta(days=2))
+    handler.add_event(subscriber_id, "Other", "Description", "Holon", [], now + timedelta(days=3))
+
+    response = remind_me_api.get_calendar(make_request(), host_id, handler)
+    assert response.media_type == "text/calendar"
+    calendar = read_body(response)
+    assert "SUMMARY:Hosted" in calendar
+    assert "LOCATION:Haifa\\, Israel" in calendar
+    assert "Other" not in calendar
+    assert "X-WR-CALNAME:RemindMe - Oron" in calendar
+
+
+def test_calendar_conditional_requests(handler):
+    host_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    handler.add_event(host_id, "Hosted", "Description", "Holon", [], now + timedelta(days=1))
+
+    response = remind_me_api.get_calendar(make_request(), host_id, handler)
+    etag = response.headers["etag"]
+    last_modified = response.headers["last-modified"]
+    assert remind_me_api.get_calendar(make_request(if_none_match=etag), host_id, handler).status_code == 304
+    assert remind_me_api.get_calendar(make_request(if_modified_since=last_modified), host_id, handler).status_code \
+           == 304
+    earlier = format_datetime(datetime.now().astimezone() - timedelta(hours=1), usegmt=False)
+    assert remind_me_api.get_calendar(make_request(if_modified_since=earlier), host_id, handler).status_code == 200
+
+    handler.add_user("Dana", "dana@gmail.com", "111")
+    response = remind_me_api.get_calendar(make_request(if_none_match=etag), host_id, handler)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    handler.add_event(host_id, "Another", "Description", "Holon", [], now + timedelta(days=2))
+    response = remind_me_api.get_calendar(make_request(if_none_match=etag), host_id, handler)
+    assert response.status_code == 200
+    assert "SUMMARY:Another" in read_body(response)
+
+
+def test_calendar_of_missing_user(handler):
+    with pytest.raises(remind_me_api.HTTPException) as error:
+        remind_me_api.get_calendar(make_request(), "missing", handler)
+    assert error.value.status_code == 404
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+
+import pytest
+
+import remind_me_api
+from common.change_feed import ChangeFeed, TooManyListeners
+from common.server_handler import CombinedHandler
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def handler(temp_db_file):
+    return CombinedHandler(temp_db_file, temp_db_file)
+
+
+def test_changes_are_recorded(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    event_id = handler.add_event(user_id, "event", "Hello", "Holon", [], datetime.now())
+    handler.modify_event(event_id, location="Tel Aviv")
+
+    changes = handler.get_changes()
+    assert [(change["table"], change["operation"]) for change in changes] == [
+        ("users", "add"), ("events", "add"), ("users", "add_event"), ("events", "modify")]
+    assert changes[-1]["data"] == {"location": "Tel Aviv"}
+    assert handler.get_changes(since=changes[1]["sequence"], limit=1) == [changes[2]]
+    assert handler.get_last_change_sequence() == changes[-1]["sequence"]
+
+
+def test_change_feed_fan_out(handler, temp_db_file):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    feed = ChangeFeed(lambda: CombinedHandler(temp_db_file, temp_db_file), poll_interval=3600, max_listeners=2,
+                      queue_size=1)
+
+    async def scenario():
+        first = feed.subscribe()
+        second = feed.subscribe()
+        with pytest.raises(TooManyListeners):
+            feed.subscribe()
+
+        handler.add_event(user_id, "event", "Hello", "Holon", [], datetime.now())
+        feed.poll()
+        assert [change["operation"] for change in await first.get(1)] == ["add", "add_event"]
+
+        # The second listener did not consume the first batch, the next one overflows its queue.
+        handler.add_event(user_id, "event2", "Hello", "Holon", [], datetime.now())
+        feed.poll()
+        await asyncio.sleep(0)
+        assert second.overflowed
+        assert not first.overflowed
+        feed.unsubscribe(second)
+        assert feed.listeners == {first}
+
+    asyncio.run(scenario())
+    feed.stop()
+
+
+def test_change_feed_survives_failed_reads(handler, temp_db_file):
+    handlers = []
+
+    def failed_read(since, limit):
+        raise sqlite3.OperationalError("database is locked")
+
+    def handler_factory():
+        handlers.append(CombinedHandler(temp_db_file, temp_db_file))
+        if len(handlers) == 1:
+            handlers[-1].get_changes = failed_read
+        return handlers[-1]
+
+    feed = ChangeFeed(handler_factory, poll_interval=0.01)
+
+    async def scenario():
+        listener = feed.subscribe()
+        handler.add_user("Oron", "oron@gmail.com", "111")
+        assert [change["operation"] for change in await listener.get(5)] == ["add"]
+
+    asyncio.run(scenario())
+    feed.stop()
+    # The failed handler was replaced.
+    assert len(handlers) == 2
+
+
+def test_change_feed_cuts_off_listeners_that_missed_trimmed_changes(handler, temp_db_file):
+    handler.add_user("Oron", "oron@gmail.com", "111")
+    feed = ChangeFeed(lambda: CombinedHandler(temp_db_file, temp_db_file), poll_interval=3600)
+
+    async def scenario():
+        listener = feed.subscribe()
+        handler.add_user("Dana", "dana@gmail.com", "222")
+        handler.add_user("Noa", "noa@gmail.com", "333")
+        handler.trim_changes(keep=1)
+        feed.poll()
+        assert await listener.get(1) == []
+        assert listener.overflowed
+
+    asyncio.run(scenario())
+    feed.stop()
+
+
+def test_trimmed_since_must_resync(handler):
+    for name in ("Oron", "Dana", "Noa"):
+        handler.add_user(name, f"{name}@gmail.com", "111")
+    handler.trim_changes(keep=1)
+    last_sequence = handler.get_last_change_sequence()
+
+    assert remind_me_api.get_changes(since=last_sequence - 1, handler=handler)["next_since"] == last_sequence
+    with pytest.raises(HTTPException) as error:
+        remind_me_api.get_changes(since=0, handler=handler)
+    assert error.value.status_code == 410
+    assert error.value.detail["next_since"] == last_sequence
@@ -0,0 +1,57 @@
+import pytest
+import gzip
+import zlib
+from datetime import datetime
+from core.compression import compress, negotiate_encoding
+from core.event import Event
+import remind_me_api
+
+now = datetime.now()
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("deflate, gzip", "gzip"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("br", None),
+    ("*", "gzip"),
+    ("gzip;q=0, *", "deflate"),
+    ("identity", None),
+    ("GZIP;q=bad, deflate;q=0.1", "deflate"),
+])
+def test_negotiate_encoding(accept_encoding, encoding):
+    assert negotiate_encoding(accept_encoding) == encoding
+
+
+def test_compress():
+    body = b'{"events": []}' * 100
+    assert gzip.decompress(compress(body, "gzip")) == body
+    assert compress(body, "gzip") == compress(body, "gzip")
+    assert zlib.decompress(compress(body, "deflate")) == body
+    with pytest.raises(ValueError):
+        compress(body, "br")
+
+
+def test_compact_events():
+    events = [Event(f"event{index}", "user1", f"Event{index}", "Description", location, subscribers, now, now, now)
+              for index, (location, subscribers) in enumerate([("Holon", ["Oron", "Dana"]),
+                                                               ("Haifa", ["Dana"]),
+                                                               ("Holon", [])])]
+    compact = remind_me_api.compact_events(events)
+
+    assert compact["users"] == ["Oron", "Dana"]
+    assert compact["locations"] == ["Holon", "Haifa"]
+    assert len(compact["events"]) == 3
+    record = dict(zip(compact["fields"], compact["events"][1]))
+    assert record["event_name"] == "Event1"
+    assert record["subscribers"] == [1]
+    assert record["location"] == 1
+
+
+def test_compact_records():
+    records = [{"event_name": "Event1", "location": "Holon"}, {"event_name": "Event2", "location": "Holon"}]
+    assert remind_me_api.compact_events(records) == {"fields": ["event_name", "location"], "users": [],
+                                                     "locations": ["Holon"],
+                                                     "events": [["Event1", 0], ["Event2", 0]]}
+    assert remind_me_api.compact_events([])["events"] == []
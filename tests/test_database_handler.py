@@ -0,0 +1,91 @@
+import pytest
+from datetime import datetime
+from common.events_handler import EventsHandler
+from core.event import Event
+from core.metrics import RequestStats, current_request
+import sqlite3
+import tempfile
+import os
+
+now = datetime.now()
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+def add_event(handler, name):
+    return handler.add_event(Event(event_id=None, created_user_id="user1", event_name=name,
+                                   event_description="Description", location="Holon", subscribers=[],
+                                   event_start_time=now, event_end_time=now, creation_time=now))
+
+
+def test_backup(temp_db_file):
+    handler = EventsHandler(temp_db_file)
+    for index in range(200):
+        add_event(handler, f"Event{index}")
+
+    target = temp_db_file + ".backup"
+    handler.backup(target, pages=2, pause=0)
+    assert len(EventsHandler(target).get_events()) == 200
+    os.remove(target)
+
+
+def test_snapshot_does_not_block_writers(temp_db_file):
+    handler = EventsHandler(temp_db_file)
+    add_event(handler, "Event1")
+
+    snapshot = EventsHandler.open_snapshot(temp_db_file)
+    add_event(handler, "Event2")
+    assert [event.event_name for event in snapshot.get_events()] == ["Event1"]
+    snapshot.refresh_snapshot()
+    assert len(snapshot.get_events()) == 2
+
+    with pytest.raises(sqlite3.OperationalError):
+        add_event(snapshot, "Event3")
+
+
+def test_schema_setup_once_per_process(temp_db_file):
+    EventsHandler(temp_db_file).close()
+
+    stats = RequestStats()
+    token = current_request.set(stats)
+    try:
+        EventsHandler(temp_db_file).close()
+    finally:
+        current_request.reset(token)
+    # Only the schema version is read.
+    assert stats.queries == 1
+
+
+def test_schema_change_is_migrated_again(temp_db_file):
+    handler = EventsHandler(temp_db_file)
+    handler.cursor.execute("DROP TABLE event_stats")
+    handler.cursor.execute("UPDATE schema_migrations SET version=3 WHERE scope='events'")
+    handler.conn.commit()
+    handler.close()
+
+    handler = EventsHandler(temp_db_file)
+    handler.cursor.execute("SELECT version FROM schema_migrations WHERE scope='events'")
+    assert handler.cursor.fetchone()[0] == len(EventsHandler._events_migrations())
+
+
+def test_pooled_connections_are_reused(temp_db_file):
+    handler = EventsHandler(temp_db_file, pooled=True)
+    conn = handler.conn
+    other_handler = EventsHandler(temp_db_file, pooled=True)
+    # A connection is used by one handler at a time.
+    assert other_handler.conn is not conn
+
+    handler.cursor.execute("BEGIN")
+    handler.cursor.execute("DELETE FROM events")
+    handler.close()
+    handler.close()
+    reused_handler = EventsHandler(temp_db_file, pooled=True)
+    assert reused_handler.conn is conn
+    # The pending transaction of the first handler was rolled back.
+    assert not conn.in_transaction
+    assert EventsHandler(temp_db_file, pooled=True).conn is not conn
@@ -1,8 +1,12 @@
 import pytest
-from core.event import Event, EventAlreadyExist, ModifyChangesAreInvalid, UserDoesNotASubscriber, UserAlreadySubscriber
+from core.event import (Event, EventAlreadyExist, ModifyChangesAreInvalid, UserDoesNotASubscriber,
+                        UserAlreadySubscriber, InvalidAttribute, EventVersionMismatch, EventDoesNotExist)
 from common.events_handler import EventsHandler
+from common.memory_handlers import MemoryEventsHandler
 import tempfile
+import threading
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 now = datetime.now()
@@ -15,9 +19,10 @@ def temp_db_file():
     os.close(fd)
 
 
-@pytest.fixture
-def events_handler(temp_db_file):
-    return EventsHandler(temp_db_file)
+@pytest.fixture(params=[EventsHandler, MemoryEventsHandler])
+def events_handler(request, temp_db_file):
+    yield request.param(temp_db_file)
+    MemoryEventsHandler.drop(temp_db_file)
 
 
 def test_add_event(events_handler):
@@ -104,5 +109,148 @@ def test_get_events(events_handler):
     assert events[0].location == "Tel Aviv"
 
 
+def test_get_events_fields(events_handler):
+    event = Event(event_id=None, created_user_id="user1", event_name="Event1", event_description="Description",
+                  location="Holon", subscribers=["user1"], event_start_time=now, event_end_time=now, creation_time=now)
+    event_id = events_handler.add_event(event)
+
+    records = events_handler.get_events(fields=["event_id", "event_start_time", "subscribers"], location="Holon")
+    assert records == [{"event_id": event_id, "event_start_time": now, "subscribers": ["user1"]}]
+
+    records = events_handler.get_events_by_ids([event_id], fields=["event_name"])
+    assert records == [{"event_name": "Event1"}]
+
+    with pytest.raises(InvalidAttribute):
+        events_handler.get_events(fields=["event_id", "1; DROP TABLE events"])
+
+
+def test_versions(events_handler):
+    event = Event(event_id=None, created_user_id="user1", event_name="Event1", event_description="Description",
+                  location="Holon", subscribers=[], event_start_time=now, event_end_time=now, creation_time=now)
+    assert events_handler.get_version("events") == 0
+    event_id = events_handler.add_event(event)
+    assert events_handler.get_version("events") == 1
+    assert events_handler.get_event_version_by_name("Event1") == (event_id, 0)
+
+    events_handler.modify_event(event_id, location="Haifa", version=100)
+    events_handler.add_subscriber(event_id, "user2")
+    assert events_handler.get_event(event_id).version == 2
+    assert events_handler.get_version("events") == 3
+    assert events_handler.get_event_version_by_name("Missing") is None
+
+
+def test_concurrent_add_subscriber(events_handler, temp_db_file):
+    event = Event(event_id=None, created_user_id="user1", event_name="Event1", event_description="Description",
+                  location="Holon", subscribers=[], event_start_time=now, event_end_time=now, creation_time=now)
+    event_id = events_handler.add_event(event)
+    local = threading.local()
+
+    def subscribe(index):
+        # A connection per thread.
+        if not hasattr(local, "handler"):
+            local.handler = type(events_handler)(temp_db_file)
+        local.handler.add_subscriber(event_id, f"user{index}")
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(subscribe, range(40)))
+
+    # No update is lost between the concurrent writers.
+    assert len(events_handler.get_event(event_id).subscribers) == 40
+
+
+def test_modify_event_expected_version(events_handler):
+    event = Event(event_id=None, created_user_id="user1", event_name="Event1", event_description="Description",
+                  location="Holon", subscribers=[], event_start_time=now, event_end_time=now, creation_time=now)
+    event_id = events_handler.add_event(event)
+
+    events_handler.modify_event(event_id, expected_version=0, location="Haifa")
+    with pytest.raises(EventVersionMismatch):
+        events_handler.modify_event(event_id, expected_version=0, location="Eilat")
+    assert events_handler.get_event(event_id).location == "Haifa"
+
+
+def test_modify_missing_event(events_handler):
+    version = events_handler.get_version("events")
+    # Without an expected version a missing event is not modified, like the update of a missing row.
+    events_handler.modify_event("missing", location="Haifa")
+    assert events_handler.get_version("events") == version
+    assert events_handler.get_changes() == []
+    with pytest.raises(EventDoesNotExist):
+        events_handler.modify_event("missing", expected_version=0, location="Haifa")
+
+
+def test_stats(events_handler, temp_db_file):
+    day = datetime(2030, 1, 1, 10)
+    for name, location, host in (("Event1", "Holon", "user1"), ("Event2", "Holon", "user2"),
+                                 ("Event3", "Haifa", "user1")):
+        events_handler.add_event(Event(event_id=None, created_user_id=host, event_name=name,
+                                       event_description="Description", location=location, subscribers=[host],
+                                       event_start_time=day, event_end_time=day, creation_time=now))
+    event_id = events_handler.get_events(event_name="Event3")[0].event_id
+    events_handler.add_subscriber(event_id, "user3")
+    events_handler.modify_event(events_handler.get_events(event_name="Event2")[0].event_id, location="Eilat")
+
+    stats = events_handler.get_stats(top=2, from_day="2030-01-01")
+    assert stats["popular_events"][0] == {"event_id": event_id, "event_name": "Event3", "subscribers": 2}
+    assert len(stats["popular_events"]) == 2
+    stats = events_handler.get_stats(top=1, from_day="2030-01-01", rankings_top=-1)
+    assert len(stats["popular_events"]) == 1 and len(stats["locations"]) == 3 and len(stats["hosts"]) == 2
+    stats = events_handler.get_stats(from_day="2030-01-01")
+    assert {entry["location"]: entry["events"] for entry in stats["locations"]} == {"Holon": 1, "Eilat": 1, "Haifa": 1}
+    assert stats["hosts"][0] == {"host": "user1", "events": 2}
+    assert stats["upcoming_days"] == [{"day": "2030-01-01", "events": 3}]
+    assert events_handler.get_stats(from_day="2030-01-02")["upcoming_days"] == []
+
+    events_handler.remove_event(event_id)
+    assert events_handler.get_stats()["hosts"][0]["events"] == 1
+
+    # The aggregates are filled from the existing events when an older database is migrated.
+    if isinstance(events_handler, EventsHandler):
+        events_handler.cursor.execute("DROP TABLE event_stats")
+        events_handler.cursor.execute("UPDATE schema_migrations SET version = 3 WHERE scope = 'events'")
+        events_handler.conn.commit()
+        assert EventsHandler(temp_db_file).get_stats(from_day="2030-01-01")["upcoming_days"][0]["events"] == 2
+
+
+
+def test_user_events_follow_the_writes(events_handler):
+    event_id = events_handler.add_event(Event(event_id=None, created_user_id="user1", event_name="Event1",
+                                              event_description="Description", location="Holon",
+                                              subscribers=["user1", "user2"], event_start_time=now,
+                                              event_end_time=now, creation_time=now))
+
+    def user_events(user_id):
+        return [event.event_id for event in events_handler.get_user_events(user_id)]
+
+    assert user_events("user1") == [event_id] and user_events("user2") == [event_id]
+    events_handler.add_subscriber(event_id, "user3")
+    assert user_events("user3") == [event_id]
+    # The host stays after it unsubscribed.
+    events_handler.remove_subscriber(event_id, "user1")
+    assert user_events("user1") == [event_id]
+    events_handler.apply_subscriber_changes([("remove", event_id, "user2"), ("add", event_id, "user4")])
+    assert user_events("user2") == [] and user_events("user4") == [event_id]
+    events_handler.modify_event(event_id, subscribers=["user5"])
+    assert user_events("user3") == [] and user_events("user5") == [event_id]
+    events_handler.remove_event(event_id)
+    assert user_events("user1") == [] and user_events("user5") == []
+
+
+
+def test_iter_user_events(events_handler):
+    for index in range(5):
+        subscribers = ["user2"] if index % 2 else []
+        events_handler.add_event(Event(event_id=None, created_user_id="user1" if index < 4 else "user3",
+                                       event_name=f"Event{index}", event_description="Description", location="Holon",
+                                       subscribers=subscribers, event_start_time=now, event_end_time=now,
+                                       creation_time=now))
+
+    names = sorted(event.event_name for event in events_handler.iter_user_events("user1", batch_size=2))
+    assert names == ["Event0", "Event1", "Event2", "Event3"]
+    assert sorted(event.event_name for event in events_handler.iter_user_events("user2", batch_size=1)) == \
+           ["Event1", "Event3"]
+    assert list(events_handler.iter_user_events("user4")) == []
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,87 @@
+import pytest
+from common.idempotency_handler import IdempotencyHandler, IdempotencyKeyReused, IdempotentRequestInProgress, \
+    hash_request
+import tempfile
+import os
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def idempotency_handler(temp_db_file):
+    return IdempotencyHandler(temp_db_file)
+
+
+def test_begin_complete(idempotency_handler):
+    response, claimed_at = idempotency_handler.begin("key1", "schedule_event")
+    assert response is None
+    with pytest.raises(IdempotentRequestInProgress):
+        idempotency_handler.begin("key1", "schedule_event")
+
+    assert idempotency_handler.complete("key1", "schedule_event", claimed_at, {"event_id": "event1"})
+    assert idempotency_handler.begin("key1", "schedule_event") == ({"event_id": "event1"}, None)
+    # Keys are per route.
+    assert idempotency_handler.begin("key1", "register")[0] is None
+
+
+def test_abort_and_expire(temp_db_file):
+    idempotency_handler = IdempotencyHandler(temp_db_file, ttl=0)
+    response, claimed_at = idempotency_handler.begin("key1", "register")
+    assert idempotency_handler.abort("key1", "register", claimed_at)
+    response, claimed_at = idempotency_handler.begin("key1", "register")
+    assert response is None
+
+    idempotency_handler.complete("key1", "register", claimed_at, {"user_id": "user1"})
+    # Expired keys are dropped, the request runs again.
+    assert idempotency_handler.begin("key1", "register")[0] is None
+
+
+def test_expired_claim_is_taken_over(temp_db_file):
+    idempotency_handler = IdempotencyHandler(temp_db_file, lease=0)
+    _, first_claim = idempotency_handler.begin("key1", "register")
+    # The first request did not complete within its lease.
+    response, claimed_at = idempotency_handler.begin("key1", "register")
+    assert response is None and claimed_at != first_claim
+
+    # The first request lost its claim, it does not release or complete the key of the retry.
+    assert not idempotency_handler.abort("key1", "register", first_claim)
+    assert idempotency_handler.complete("key1", "register", claimed_at, {"user_id": "user1"})
+    assert not idempotency_handler.complete("key1", "register", first_claim, {"user_id": "user2"})
+    assert idempotency_handler.begin("key1", "register") == ({"user_id": "user1"}, None)
+
+
+def test_reused_key_with_other_parameters(idempotency_handler):
+    request_hash = hash_request({"name": "event1"})
+    response, claimed_at = idempotency_handler.begin("key1", "schedule_event", request_hash)
+    idempotency_handler.complete("key1", "schedule_event", claimed_at, {"event_id": "event1"})
+
+    assert idempotency_handler.begin("key1", "schedule_event", request_hash) == ({"event_id": "event1"}, None)
+    with pytest.raises(IdempotencyKeyReused):
+        idempotency_handler.begin("key1", "schedule_event", hash_request({"name": "event2"}))
+
+
+def test_expired_keys_are_purged_periodically(temp_db_file):
+    idempotency_handler = IdempotencyHandler(temp_db_file, ttl=0, purge_interval=3600)
+    IdempotencyHandler._next_purge.clear()
+    idempotency_handler.begin("key1", "register")
+    idempotency_handler.begin("key2", "register")
+    # The first claim purged the expired keys, the next purge is in an hour.
+    idempotency_handler.cursor.execute("SELECT COUNT(*) FROM idempotency_keys")
+    assert idempotency_handler.cursor.fetchone()[0] == 2
+
+
+def test_run_idempotent_rejects_other_parameters(idempotency_handler):
+    import remind_me_api
+    from fastapi import HTTPException
+
+    create = lambda: {"event_id": "event1"}  # noqa: E731
+    assert remind_me_api.run_idempotent(idempotency_handler, "key1", "schedule_event", {"name": "a"}, create) == \
+        {"event_id": "event1"}
+    with pytest.raises(HTTPException) as error:
+        remind_me_api.run_idempotent(idempotency_handler, "key1", "schedule_event", {"name": "b"}, create)
+    assert error.value.status_code == 422
@@ -0,0 +1,34 @@
+import random
+
+from core.interval_index import IntervalIndex
+
+
+def brute_force_overlapping(intervals, start, end):
+    result = []
+    for interval_start, interval_end, item in intervals:
+        if interval_start < start < interval_end or start <= interval_start < end or interval_start == start:
+            result.append(item)
+    return result
+
+
+def test_overlapping():
+    index = IntervalIndex([(0, 10, "a"), (5, 7, "b"), (10, 12, "c"), (20, 20, "d")])
+    assert sorted(index.overlapping(6, 8)) == ["a", "b"]
+    assert sorted(index.overlapping(10, 11)) == ["c"]
+    assert index.overlapping(12, 20) == []
+    assert index.overlapping(20, 20) == ["d"]
+    assert len(index) == 4
+
+
+def test_overlapping_matches_brute_force():
+    rand = random.Random(7)
+    intervals = []
+    for i in range(300):
+        start = rand.randint(0, 1000)
+        intervals.append((start, start + rand.randint(0, 50), i))
+    index = IntervalIndex(intervals)
+
+    for _ in range(200):
+        start = rand.randint(0, 1000)
+        end = start + rand.randint(0, 80)
+        assert sorted(index.overlapping(start, end)) == sorted(brute_force_overlapping(intervals, start, end))
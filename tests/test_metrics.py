@@ -0,0 +1,134 @@
+import pytest
+from datetime import datetime
+from common.events_handler import EventsHandler
+from core import database_handler
+from core.event import Event
+from core.metrics import COUNT_BUCKETS, MetricsRegistry, RequestStats, current_request, timed_stage
+import tempfile
+import os
+
+now = datetime.now()
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def request_stats():
+    stats = RequestStats()
+    token = current_request.set(stats)
+    yield stats
+    current_request.reset(token)
+
+
+def add_event(handler, name):
+    return handler.add_event(Event(event_id=None, created_user_id="user1", event_name=name,
+                                   event_description="Description", location="Holon", subscribers=[],
+                                   event_start_time=now, event_end_time=now, creation_time=now))
+
+
+def test_render_prometheus_format():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.", ("route",))
+    histogram = registry.histogram("queries", "Queries.", ("route",), COUNT_BUCKETS)
+    counter.inc("/events")
+    counter.inc("/events", amount=2)
+    counter.inc('/say "hi"')
+    histogram.observe(3, "/events")
+    histogram.observe(30, "/events")
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/events"} 3' in lines
+    assert 'requests_total{route="/say \\"hi\\""} 1' in lines
+    assert 'queries_bucket{route="/events",le="2"} 0' in lines
+    assert 'queries_bucket{route="/events",le="5"} 1' in lines
+    assert 'queries_bucket{route="/events",le="+Inf"} 2' in lines
+    assert 'queries_sum{route="/events"} 33.0' in lines
+    assert 'queries_count{route="/events"} 2' in lines
+
+
+def test_register_twice_keeps_the_metric():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "Requests.")
+    counter.inc()
+    assert registry.counter("requests_total", "Requests.") is counter
+
+
+def test_statements_are_recorded(temp_db_file, request_stats, monkeypatch):
+    monkeypatch.setattr(database_handler, "QUERY_SAMPLE_EVERY", 1)
+    handler = EventsHandler(temp_db_file)
+    add_event(handler, "Event1")
+    before = request_stats.queries
+    selects = database_handler.query_duration.values.get(("SELECT", "events"), [None, 0.0, 0])[2]
+
+    handler.get_events(sort_by_attribute="event_start_time")
+    assert request_stats.queries == before + 1
+    assert request_stats.query_seconds > 0
+    assert request_stats.stages["decode"] > 0
+    assert database_handler.query_duration.values[("SELECT", "events")][2] == selects + 1
+
+
+def test_get_event_by_name_is_one_statement(temp_db_file, request_stats):
+    handler = EventsHandler(temp_db_file)
+    event_id = add_event(handler, "Event1")
+    before = request_stats.queries
+
+    assert handler.get_event_by_name("Event1", fields=["event_id"]) == {"event_id": event_id}
+    assert handler.get_event_by_name("Missing") is None
+    assert request_stats.queries == before + 2
+
+
+def test_statement_is_timed_until_its_last_row(temp_db_file, request_stats):
+    handler = EventsHandler(temp_db_file)
+    add_event(handler, "Event1")
+    add_event(handler, "Event2")
+    before = request_stats.queries
+
+    handler.cursor.execute("SELECT event_id FROM events")
+    assert handler.cursor.fetchone() is not None
+    assert handler.cursor.fetchone() is not None
+    assert request_stats.queries == before
+    assert handler.cursor.fetchone() is None
+    assert request_stats.queries == before + 1
+
+    handler.cursor.execute("SELECT event_id FROM events")
+    handler.cursor.fetchone()
+    handler.close()
+    assert request_stats.queries == before + 2
+
+
+def test_statements_histogram_is_sampled(temp_db_file, monkeypatch):
+    monkeypatch.setattr(database_handler, "QUERY_SAMPLE_EVERY", 4)
+    handler = EventsHandler(temp_db_file)
+    selects = database_handler.query_duration.values.get(("SELECT", "events"), [None, 0.0, 0])[2]
+    for _ in range(8):
+        handler.cursor.execute("SELECT COUNT(*) FROM events")
+        handler.cursor.fetchall()
+    assert database_handler.query_duration.values[("SELECT", "events")][2] == selects + 2
+
+
+def test_slow_queries_are_logged(temp_db_file, monkeypatch, caplog):
+    handler = EventsHandler(temp_db_file)
+    monkeypatch.setattr(database_handler, "SLOW_QUERY_SECONDS", 0)
+    with caplog.at_level("WARNING", logger="remind_me.slow_queries"):
+        handler.get_events()
+    assert "SELECT" in caplog.text
+    assert database_handler.slow_queries.values[("SELECT", "events")] >= 1
+
+
+def test_timed_stage_without_request():
+    with timed_stage("serialization"):
+        pass
+    assert current_request.get() is None
+
+
+def test_classify_statement():
+    assert database_handler.classify_statement("SELECT * FROM events WHERE event_id=?") == ("SELECT", "events")
+    assert database_handler.classify_statement("\n  insert into users (user_id) VALUES (?)") == ("INSERT", "users")
+    assert database_handler.classify_statement("UPDATE events SET version = version + 1") == ("UPDATE", "events")
+    assert database_handler.classify_statement("BEGIN IMMEDIATE") == ("BEGIN", "")
@@ -0,0 +1,117 @@
+import pytest
+from common.events_handler import EventsHandler
+from core.database_handler import DatabaseHandler
+from core.migrations import Backfill, Migration, InvalidMigrations, run_migrations, get_schema_version, \
+    set_schema_version, _run_backfill
+import sqlite3
+import tempfile
+import os
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+def create_items(handler):
+    handler.cursor.execute("CREATE TABLE items (item_id TEXT PRIMARY KEY, value INTEGER)")
+    handler.cursor.executemany("INSERT INTO items (item_id, value) VALUES (?, ?)",
+                               [(f"item{index:03}", index) for index in range(25)])
+
+
+def test_run_migrations(temp_db_file):
+    handler = DatabaseHandler(temp_db_file)
+    batches = []
+
+    def double(migration_handler, keys):
+        batches.append(len(keys))
+        if len(batches) == 2 and not getattr(double, "failed", False):
+            double.failed = True
+            raise RuntimeError("Interrupted")
+        placeholders = ', '.join(['?'] * len(keys))
+        migration_handler.cursor.execute(f"UPDATE items SET value = value * 2 WHERE item_id IN ({placeholders})", keys)
+
+    migrations = [Migration(2, "Double the values", lambda migration_handler: None,
+                            Backfill("items", "item_id", double)),
+                  Migration(1, "Create the items", create_items)]
+    with pytest.raises(RuntimeError):
+        run_migrations(handler, "items", migrations, batch_size=10)
+    # The first batch is kept, the interrupted one was rolled back.
+    assert get_schema_version(handler.cursor, "items") == (1, "item009")
+
+    progress = []
+    assert run_migrations(handler, "items", migrations, batch_size=10,
+                          progress=lambda scope, migration, done, total: progress.append((done, total))) == 1
+    assert progress == [(20, 25), (25, 25)]
+    handler.cursor.execute("SELECT SUM(value) FROM items")
+    assert handler.cursor.fetchone()[0] == 2 * sum(range(25))
+    assert get_schema_version(handler.cursor, "items") == (2, None)
+    assert run_migrations(handler, "items", migrations) == 0
+
+    with pytest.raises(InvalidMigrations):
+        run_migrations(handler, "items", migrations + [Migration(2, "Duplicate", create_items)])
+
+
+def test_backfill_integer_keys(temp_db_file):
+    handler = DatabaseHandler(temp_db_file)
+
+    def create_numbers(migration_handler):
+        migration_handler.cursor.execute("CREATE TABLE numbers (number INTEGER PRIMARY KEY, value INTEGER)")
+        migration_handler.cursor.executemany("INSERT INTO numbers (number, value) VALUES (?, 1)",
+                                             [(index,) for index in range(1, 26)])
+
+    def double(migration_handler, keys):
+        placeholders = ', '.join(['?'] * len(keys))
+        migration_handler.cursor.execute(f"UPDATE numbers SET value = value * 2 WHERE number IN ({placeholders})",
+                                         keys)
+
+    progress = []
+    assert run_migrations(handler, "numbers", [Migration(1, "Create the numbers", create_numbers),
+                                               Migration(2, "Double the values", lambda migration_handler: None,
+                                                         Backfill("numbers", "number", double))],
+                          batch_size=10, progress=lambda scope, migration, done, total: progress.append(done)) == 2
+    assert progress == [10, 20, 25]
+    handler.cursor.execute("SELECT SUM(value) FROM numbers")
+    assert handler.cursor.fetchone()[0] == 50
+
+
+def test_backfill_finished_by_another_handler(temp_db_file):
+    handler = DatabaseHandler(temp_db_file)
+    updated = []
+    migrations = [Migration(1, "Create the items", create_items),
+                  Migration(2, "Backfill", lambda migration_handler: None,
+                            Backfill("items", "item_id", lambda migration_handler, keys: updated.append(2))),
+                  Migration(3, "Next backfill", lambda migration_handler: None,
+                            Backfill("items", "item_id", lambda migration_handler, keys: updated.append(3)))]
+    run_migrations(handler, "items", migrations[:1])
+    # Another handler finished the backfill of version 2 and is in the middle of the backfill of version 3.
+    set_schema_version(handler.cursor, "items", 2, "item009")
+    handler.conn.commit()
+
+    _run_backfill(handler, "items", migrations[1], 10, None)
+    assert updated == []
+    assert get_schema_version(handler.cursor, "items") == (2, "item009")
+
+
+def test_migrate_old_events_database(temp_db_file):
+    # The layout of the events table before the migrations existed.
+    conn = sqlite3.connect(temp_db_file)
+    conn.execute("CREATE TABLE events (event_id TEXT PRIMARY KEY, created_user_id TEXT, event_name TEXT UNIQUE, "
+                 "event_description TEXT, location TEXT, subscribers TEXT DEFAULT '[]', event_start_time DATETIME, "
+                 "event_end_time DATETIME, creation_time DATETIME DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO events VALUES (?, 'user1', ?, '', 'Holon', ?, '2030-01-01 10:00:00', "
+                     "'2030-01-01 11:00:00', '2023-10-22 10:00:00')",
+                     [("1", "Event1", '["a", "b"]'), ("2", "Event2", '[]'), ("3", "Event3", '["a"]')])
+    conn.commit()
+    conn.close()
+
+    events_handler = EventsHandler(temp_db_file)
+    events = events_handler.get_events(sort_by_attribute="subscribers", reverse=True)
+    assert [event.event_name for event in events] == ["Event1", "Event3", "Event2"]
+    assert events[0].version == 0
+    assert events_handler.get_stats(from_day="2030-01-01")["locations"] == [{"location": "Holon", "events": 3}]
+    # The user events index is backfilled.
+    assert sorted(event.event_id for event in events_handler.get_user_events("a")) == ["1", "3"]
+    assert len(events_handler.get_user_events("user1")) == 3
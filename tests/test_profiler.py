@@ -0,0 +1,62 @@
+import pytest
+import threading
+import time
+from core.profiler import ProfilerBusy, StackSampler
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+@pytest.fixture
+def busy_thread():
+    stop = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+    thread.start()
+    yield thread
+    stop.set()
+    thread.join()
+
+
+def test_samples_other_threads(busy_thread):
+    sampler = StackSampler(interval=0.001)
+    sampler.run(0.2)
+    assert sampler.samples > 0
+
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy-worker;")]
+    assert busy
+    assert all("busy_loop (tests/test_profiler.py:" in line for line in busy)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    # The sampling thread itself is not recorded.
+    assert not any("StackSampler.run" in line or "run (core/profiler.py" in line for line in lines)
+
+
+def test_idle_threads_are_skipped():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, name="idle-worker")
+    thread.start()
+    try:
+        sampler = StackSampler(interval=0.001)
+        sampler.run(0.05)
+        assert "idle-worker" not in sampler.collapsed()
+
+        sampler = StackSampler(interval=0.001, include_idle=True)
+        sampler.run(0.05)
+        assert "idle-worker" in sampler.collapsed()
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_one_profile_at_a_time():
+    sampler = StackSampler(interval=0.001)
+    thread = threading.Thread(target=sampler.run, args=(0.3,))
+    thread.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusy):
+            StackSampler().run(0.01)
+    finally:
+        thread.join()
@@ -0,0 +1,122 @@
+import pytest
+from datetime import datetime, timedelta
+from common.events_handler import EventsHandler
+from common.users_handler import UsersHandler
+from core import database_handler
+from core.database_handler import FullTableScan, in_list_chunks
+from core.event import Event
+from core.user import User
+import tempfile
+import os
+
+now = datetime.now()
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def check_query_plans(monkeypatch):
+    monkeypatch.setattr(database_handler, "CHECK_QUERY_PLANS", True)
+    monkeypatch.setattr(database_handler, "_checked_plans", set())
+
+
+@pytest.fixture
+def statements(monkeypatch):
+    executed = []
+    monkeypatch.setattr(database_handler, "CHECK_QUERY_PLANS", True)
+    monkeypatch.setattr(database_handler, "check_query_plan", lambda conn, sql, parameters=(): executed.append(sql))
+    yield executed
+
+
+def add_event(handler, name, days=1):
+    return handler.add_event(Event(event_id=None, created_user_id="user1", event_name=name,
+                                   event_description="Description", location="Holon", subscribers=["user2"],
+                                   event_start_time=now + timedelta(days=days),
+                                   event_end_time=now + timedelta(days=days), creation_time=None))
+
+
+def test_in_list_chunks():
+    assert list(in_list_chunks([])) == []
+    assert list(in_list_chunks(["a"])) == [("?", ["a"])]
+    assert list(in_list_chunks(["a", "b", "c"])) == [("?, ?, ?, ?", ["a", "b", "c", "c"])]
+    chunks = list(in_list_chunks(list(range(600))))
+    assert [len(chunk) for _, chunk in chunks] == [512, 128]
+    assert chunks[1][1][-1] == 599 and chunks[1][0].count("?") == 128
+
+
+def test_statements_are_shared_by_shape(temp_db_file, statements):
+    handler = EventsHandler(temp_db_file)
+    events_ids = [add_event(handler, f"Event{index}") for index in range(5)]
+
+    del statements[:]
+    handler.get_events(location="Holon", created_user_id="user1")
+    handler.get_events(created_user_id="user2", location="Haifa")
+    assert len(statements) == 2 and statements[0] == statements[1]
+
+    del statements[:]
+    assert len(handler.get_events_by_ids(events_ids[:3])) == 3
+    assert len(handler.get_events_by_ids(events_ids[:4] + events_ids[:1])) == 4
+    assert len(statements) == 2 and statements[0] == statements[1]
+
+    del statements[:]
+    handler.modify_event(events_ids[0], location="Haifa", event_description="Changed")
+    handler.modify_event(events_ids[1], event_description="Changed", location="Haifa")
+    updates = [statement for statement in statements if statement.startswith("UPDATE events SET")]
+    assert len(updates) == 2 and updates[0] == updates[1]
+    assert handler.get_event(events_ids[1]).location == "Haifa"
+
+
+def test_query_plans_use_the_indexes(temp_db_file, check_query_plans):
+    events_handler = EventsHandler(temp_db_file)
+    users_handler = UsersHandler(temp_db_file)
+    events_ids = [add_event(events_handler, f"Event{index}", days=index - 2) for index in range(5)]
+    user_id = users_handler.add_user(User(None, "Oron", "oron@gmail.com", ""), "111")
+
+    for sort_by_attribute in (None, "event_start_time", "subscribers"):
+        events_handler.get_events(sort_by_attribute=sort_by_attribute, reverse=True, location="Holon")
+    events_handler.get_events(event_name="Event1", fields=["event_id"])
+    events_handler.get_events_by_ids(events_ids, include_archived=True)
+    events_handler.get_event_by_name("Event2")
+    events_handler.get_upcoming_events(now, 10, fields=["event_id"])
+    events_handler.get_upcoming_events(now, 10, fields=["event_id"], end=now + timedelta(days=1))
+    events_handler.get_event_version_by_name("Event2")
+    events_handler.modify_event(events_ids[3], expected_version=0, event_name="Renamed")
+    events_handler.add_subscriber(events_ids[4], "user3")
+    events_handler.remove_subscriber(events_ids[4], "user3")
+    events_handler.modify_event(events_ids[4], subscribers=["user3"])
+    events_handler.get_user_events("user3")
+    events_handler.get_stats()
+    list(events_handler.iter_user_events("user2"))
+    assert events_handler.archive_events(now) == 2
+    events_handler.remove_event(events_ids[0])
+    users_handler.get_existing_user_ids([user_id, "missing"])
+    users_handler.get_user_id_by_name("Oron")
+
+
+def test_known_scans_are_allowed(temp_db_file, check_query_plans, monkeypatch):
+    handler = EventsHandler(temp_db_file)
+    statement = "SELECT event_id FROM events WHERE event_name = ? OR location = ?"
+    monkeypatch.setattr(database_handler, "SCANNING_STATEMENTS", frozenset([statement]))
+    handler.cursor.execute(statement.replace(" WHERE", "\n    WHERE"), ("Event1", "Holon"))
+
+
+def test_full_scan_is_detected(temp_db_file, check_query_plans):
+    handler = EventsHandler(temp_db_file)
+    add_event(handler, "Event1")
+    # The unique index of the names is case sensitive, it can not be searched case insensitively.
+    with pytest.raises(FullTableScan):
+        handler.cursor.execute("SELECT event_id FROM events WHERE event_name = ? COLLATE NOCASE", ("event1",))
+    # A branch of an OR without an index scans the table.
+    statement = "SELECT event_id FROM events\n WHERE event_name = ? OR location = ?"
+    with pytest.raises(FullTableScan):
+        handler.cursor.execute(statement, ("Event1", "Holon"))
+
+    # Conditions without an index are expected to scan.
+    handler.cursor.execute("DROP INDEX events_end_time")
+    assert handler.archive_events(now) == 0
+    handler.get_events(location="Holon")
@@ -1,6 +1,10 @@
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
+from common.memory_handlers import MemoryDatabaseHandler
 from common.server_handler import CombinedHandler
+from core.storage import STORAGE_SQLITE, STORAGE_MEMORY, STORAGE_SHARDED
+from core.event import EventConflict, EventDoesNotExist, InvalidAttribute, UserAlreadySubscriber
+from core.user import UserDoesNotExist
 import tempfile
 import os
 
@@ -12,9 +16,10 @@ def temp_db_file():
     os.close(fd)
 
 
-@pytest.fixture
-def handler(temp_db_file):
-    return CombinedHandler(temp_db_file, temp_db_file)
+@pytest.fixture(params=[STORAGE_SQLITE, STORAGE_MEMORY, STORAGE_SHARDED])
+def handler(request, temp_db_file):
+    yield CombinedHandler(temp_db_file, temp_db_file, storage=request.param, shards=3)
+    MemoryDatabaseHandler.drop(temp_db_file)
 
 
 def test_add_get_user(handler):
@@ -47,6 +52,35 @@ def test_remove_event(handler):
         handler.get_event(event_id)
 
 
+def test_get_event_by_name(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    event_id = handler.add_event(user_id, "event", "Hello", "Holon", [], datetime.now())
+    assert handler.get_event_by_name("event").event_id == event_id
+    assert handler.get_event_by_name("event", fields=["event_id", "created_user_id"]) == \
+           {"event_id": event_id, "created_user_id": user_id}
+    assert handler.get_event_by_name("missing") is None
+    with pytest.raises(InvalidAttribute):
+        handler.get_event_by_name("event", fields=["password"])
+
+    handler.remove_event(event_id, user_id)
+    assert handler.get_event_by_name("event") is None
+    assert handler.get_user(user_id).hosts_events == []
+
+
+def test_get_upcoming_events(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    now = datetime.utcnow()
+    for days in (3, -1, 1, 2, -2, 4):
+        handler.add_event(user_id, f"event{days}", "Hello", "Holon", [], now + timedelta(days=days))
+
+    assert [event["event_name"] for event in handler.get_upcoming_events(3, fields=["event_name"])] == \
+           ["event1", "event2", "event3"]
+    events = handler.get_upcoming_events(10, start=now - timedelta(days=1, hours=1))
+    assert [event.event_name for event in events] == ["event-1", "event1", "event2", "event3", "event4"]
+    events = handler.get_upcoming_events(10, fields=["event_name"], start=now, end=now + timedelta(days=2, hours=1))
+    assert [event["event_name"] for event in events] == ["event1", "event2"]
+
+
 def test_modify_event(handler):
     user_id = handler.add_user("Oron", "oron@gmail.com", "111")
     event_id = handler.add_event(user_id, "event", "Hello", "Holon", [], datetime.now())
@@ -67,5 +101,108 @@ def test_add_remove_subscriber_to_event(handler):
     assert user2_id not in event.subscribers
 
 
+def test_free_busy_and_conflicts(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    user2_id = handler.add_user("user2", "user2@gmail.com", "222")
+    start = datetime(2030, 1, 1, 10)
+    event_id = handler.add_event(user_id, "morning", "Hello", "Holon", [], start, start + timedelta(hours=1))
+    other_event_id = handler.add_event(user2_id, "overlap", "Hello", "Holon", [],
+                                       start + timedelta(minutes=30), start + timedelta(hours=2))
+
+    busy = handler.get_free_busy(user_id, start - timedelta(hours=1), start + timedelta(hours=3))
+    assert [event.event_id for event in busy] == [event_id]
+    assert handler.get_free_busy(user_id, start + timedelta(hours=1), start + timedelta(hours=2)) == []
+
+    with pytest.raises(EventConflict):
+        handler.add_event(user_id, "clash", "Hello", "Holon", [], start + timedelta(minutes=15),
+                          start + timedelta(minutes=45), check_conflicts=True)
+    handler.add_event(user_id, "after", "Hello", "Holon", [], start + timedelta(hours=1),
+                      start + timedelta(hours=2), check_conflicts=True)
+
+    with pytest.raises(EventConflict):
+        handler.add_subscriber_to_event(other_event_id, user_id, check_conflicts=True)
+    handler.add_subscriber_to_event(other_event_id, user_id)
+    busy = handler.get_free_busy(user_id, start, start + timedelta(hours=3))
+    assert other_event_id in [event.event_id for event in busy]
+
+
+def test_schedules_are_shared_by_the_handlers(handler, temp_db_file):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    start = datetime(2030, 1, 1, 10)
+    handler.add_event(user_id, "morning", "Hello", "Holon", [], start, start + timedelta(hours=1))
+    schedule = handler.get_user_schedule(user_id)
+
+    other_handler = CombinedHandler(temp_db_file, temp_db_file, storage=handler._events_database[0], shards=3)
+    assert other_handler.get_user_schedule(user_id) is schedule
+    # A write of any handler changes the version of the events, the schedule is built again.
+    other_handler.add_event(user_id, "evening", "Hello", "Holon", [], start + timedelta(hours=8))
+    assert handler.get_user_schedule(user_id) is not schedule
+    assert len(handler.get_free_busy(user_id, start, start + timedelta(days=1))) == 2
+
+
+def test_apply_subscriptions(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    user2_id = handler.add_user("user2", "user2@gmail.com", "222")
+    event_id = handler.add_event(user_id, "event", "Hello", "Holon", [], datetime.now())
+    event2_id = handler.add_event(user_id, "event2", "Hello", "Holon", [], datetime.now())
+
+    results = handler.apply_subscriptions([("add", event_id, user2_id),
+                                           ("add", event2_id, user2_id),
+                                           ("add", event_id, user2_id),
+                                           ("add", event_id, "missing_user"),
+                                           ("remove", "missing_event", user2_id),
+                                           ("remove", event2_id, user2_id)])
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], UserAlreadySubscriber)
+    assert isinstance(results[3], UserDoesNotExist)
+    assert isinstance(results[4], EventDoesNotExist)
+    assert results[5] is None
+    assert user2_id in handler.get_event(event_id).subscribers
+    assert user2_id not in handler.get_event(event2_id).subscribers
+
+
+def test_archive_past_events(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    past_event_id = handler.add_event(user_id, "past", "Hello", "Holon", [], datetime(2020, 1, 1))
+    future_event_id = handler.add_event(user_id, "future", "Hello", "Holon", [], datetime(2030, 1, 1))
+
+    assert handler.archive_past_events(timedelta(days=30), now=datetime(2020, 1, 15)) == 0
+    assert handler.archive_past_events(timedelta(days=30)) == 1
+
+    assert [event.event_id for event in handler.get_events_by_attribute()] == [future_event_id]
+    events = handler.get_events_by_attribute(sort_by_attribute="event_start_time", include_archived=True)
+    assert [event.event_id for event in events] == [past_event_id, future_event_id]
+    assert handler.get_event(past_event_id, include_archived=True).event_name == "past"
+
+    handler.remove_event(past_event_id)
+    assert [event.event_id for event in handler.get_events_by_attribute(include_archived=True)] == [future_event_id]
+
+
+def test_memory_storage_is_shared_by_name(temp_db_file):
+    handler = CombinedHandler(temp_db_file, temp_db_file, storage=STORAGE_MEMORY)
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    assert CombinedHandler(temp_db_file, temp_db_file, storage=STORAGE_MEMORY).get_user(user_id).user_name == "Oron"
+    MemoryDatabaseHandler.drop(temp_db_file)
+    with pytest.raises(UserDoesNotExist):
+        CombinedHandler(temp_db_file, temp_db_file, storage=STORAGE_MEMORY).get_user(user_id)
+
+
+
+def test_trim_changes(handler):
+    user_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    for i in range(3):
+        handler.add_event(user_id, f"event{i}", "Hello", "Holon", [], datetime.now())
+    last_sequence = handler.get_last_change_sequence()
+    assert handler.get_first_change_sequence() == 1
+
+    handler.trim_changes(keep=2)
+    assert handler.get_first_change_sequence() == last_sequence - 1
+    assert handler.get_last_change_sequence() == last_sequence
+    assert [change["sequence"] for change in handler.get_changes(0)] == [last_sequence - 1, last_sequence]
+
+    handler.modify_event(handler.get_event_by_name("event0").event_id, location="Tel Aviv")
+    assert handler.get_changes(last_sequence)[0]["sequence"] == last_sequence + 1
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,187 @@
+import pytest
+from datetime import datetime
+from common.sharded_handlers import ShardedEventsHandler, ShardedUsersHandler, rebalance_shards, shard_files, \
+    shard_index
+from core.event import Event, EventAlreadyExist
+from core.user import User, UserAlreadyExist
+import random
+import sqlite3
+import tempfile
+import os
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+def add_event(handler, name, location="Holon", day=1):
+    start = datetime(2030, 1, day, 10)
+    return handler.add_event(Event(event_id=None, created_user_id="user1", event_name=name,
+                                   event_description="Description", location=location, subscribers=["user1"],
+                                   event_start_time=start, event_end_time=start, creation_time=None))
+
+
+def count_rows(path, table_name):
+    conn = sqlite3.connect(path)
+    count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_events_are_routed_by_id(temp_db_file):
+    handler = ShardedEventsHandler(temp_db_file, shards=3)
+    events_ids = [add_event(handler, f"Event{index}", day=index % 28 + 1) for index in range(30)]
+
+    counts = [count_rows(path, "events") for path in shard_files(temp_db_file, 3)]
+    assert sum(counts) == 30 and all(counts)
+    for event_id in events_ids:
+        assert handler.get_event(event_id).event_id == event_id
+
+    # Names are unique across the shards.
+    with pytest.raises(EventAlreadyExist):
+        add_event(handler, "Event7")
+    handler.modify_event(events_ids[0], event_name="Renamed")
+    add_event(handler, "Event0")
+    with pytest.raises(EventAlreadyExist):
+        handler.modify_event(events_ids[1], event_name="Renamed")
+    assert handler.get_event_version_by_name("Renamed") == (events_ids[0], 1)
+
+    # The results of the shards are merged by the sort attribute.
+    events = handler.get_events(sort_by_attribute="event_start_time", reverse=True, fields=["event_name"])
+    assert len(events) == 31 and "event_start_time" not in events[0]
+    times = [event.event_start_time for event in handler.get_events(sort_by_attribute="event_start_time")]
+    assert times == sorted(times)
+
+    handler.add_subscriber(events_ids[2], "user2")
+    assert handler.get_stats(top=1)["popular_events"][0]["event_id"] == events_ids[2]
+    assert handler.get_stats()["locations"] == [{"location": "Holon", "events": 31}]
+    assert [change["operation"] for change in handler.get_changes(since=handler.get_last_change_sequence() - 1)] == \
+        ["add_subscriber"]
+
+
+def test_users_are_routed_by_id(temp_db_file):
+    handler = ShardedUsersHandler(temp_db_file, shards=2)
+    user_id = handler.add_user(User(None, "Oron", "oron@gmail.com", ""), "111")
+    with pytest.raises(UserAlreadyExist):
+        handler.add_user(User(None, "Oron", "oron@gmail.com", ""), "111")
+    assert handler.login("Oron", "111") == user_id
+    assert handler.get_existing_user_ids([user_id, "missing"]) == {user_id}
+
+    handler.remove_user(user_id)
+    assert handler.add_user(User(None, "Oron", "oron@gmail.com", ""), "111") != user_id
+
+
+def test_rebalance_shards(temp_db_file):
+    handler = ShardedEventsHandler(temp_db_file, shards=2)
+    events_ids = [add_event(handler, f"Event{index}", location=f"City{index % 3}") for index in range(20)]
+    handler.close()
+
+    moved = rebalance_shards(temp_db_file, 2, 5)
+    assert moved == sum(1 for event_id in events_ids if shard_index(event_id, 2) != shard_index(event_id, 5))
+
+    handler = ShardedEventsHandler(temp_db_file, shards=5)
+    for event_id in events_ids:
+        assert handler.get_event(event_id).event_id == event_id
+    assert sum(count_rows(path, "events") for path in shard_files(temp_db_file, 5)) == 20
+    assert sum(entry["events"] for entry in handler.get_stats()["locations"]) == 20
+
+
+def test_rebalance_keeps_the_changes_and_versions(temp_db_file):
+    handler = ShardedEventsHandler(temp_db_file, shards=4)
+    for index in range(12):
+        add_event(handler, f"Event{index}")
+    version = handler.get_version("events")
+    handler.close()
+
+    rebalance_shards(temp_db_file, 4, 2)
+    handler = ShardedEventsHandler(temp_db_file, shards=2)
+    assert handler.get_version("events") == version
+    assert len(handler.get_changes(0)) == 12
+
+
+def test_shard_writes_do_not_lock_the_main_database(temp_db_file):
+    handler = ShardedEventsHandler(temp_db_file, shards=3)
+    events_ids = [add_event(handler, f"Event{index}") for index in range(6)]
+    version = handler.get_version("events")
+
+    writer = sqlite3.connect(temp_db_file)
+    writer.execute("BEGIN IMMEDIATE")
+    handler.add_subscriber(events_ids[0], "user2")
+    handler.modify_event(events_ids[1], location="Haifa")
+    assert handler.get_version("events") == version + 2
+    writer.rollback()
+    writer.close()
+
+    # The changes of the shards are merged into the change log when it is read.
+    changes = handler.get_changes(since=handler.get_last_change_sequence() - 2)
+    assert [(change["entity_id"], change["operation"]) for change in changes] == \
+        [(events_ids[0], "add_subscriber"), (events_ids[1], "modify")]
+    assert [change["sequence"] for change in handler.get_changes(0, limit=100)] == list(range(1, 9))
+
+
+def test_failed_shard_write_releases_the_name(temp_db_file, monkeypatch):
+    handler = ShardedEventsHandler(temp_db_file, shards=2)
+    event_id = add_event(handler, "Event")
+    for shard in handler.shards:
+        monkeypatch.setattr(shard, "add_event", lambda event: 1 / 0)
+        monkeypatch.setattr(shard, "modify_event", lambda *args, **kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        add_event(handler, "Other")
+    with pytest.raises(ZeroDivisionError):
+        handler.modify_event(event_id, event_name="Renamed")
+    monkeypatch.undo()
+
+    add_event(handler, "Other")
+    handler.modify_event(event_id, event_name="Renamed")
+    handler.modify_event(event_id, event_name="Renamed", location="Haifa")
+    assert handler.get_event_by_name("Renamed").location == "Haifa"
+    assert handler.get_event_by_name("Event") is None
+
+
+def test_stats_are_merged(temp_db_file):
+    handler = ShardedEventsHandler(temp_db_file, shards=3)
+    events_ids = [add_event(handler, f"Event{index}", location="Holon" if index % 4 else f"City{index}")
+                  for index in range(12)]
+    for index, event_id in enumerate(events_ids):
+        for subscriber in range(index):
+            handler.add_subscriber(event_id, f"user{subscriber + 2}")
+
+    stats = handler.get_stats(top=3)
+    assert [event["event_id"] for event in stats["popular_events"]] == events_ids[:-4:-1]
+    assert [event["subscribers"] for event in stats["popular_events"]] == [12, 11, 10]
+    assert stats["locations"][0] == {"location": "Holon", "events": 9}
+    assert len(stats["locations"]) == 3
+
+
+def test_merged_rankings_read_the_top_of_the_shards(temp_db_file, monkeypatch):
+    handler = ShardedEventsHandler(temp_db_file, shards=4)
+    random_generator = random.Random(7)
+    for index in range(200):
+        add_event(handler, f"Event{index}", location=f"City{int(random_generator.paretovariate(1.2)) % 40}")
+    everything = {entry["location"]: entry["events"] for entry in handler.get_stats(top=-1)["locations"]}
+    assert sum(everything.values()) == 200
+
+    read = []
+    for shard in handler.shards:
+        get_ranking = shard.get_ranking
+        monkeypatch.setattr(shard, "get_ranking",
+                            lambda kind, limit, get_ranking=get_ranking: read.append(limit) or get_ranking(kind, limit))
+    for top in (1, 3, 5):
+        del read[:]
+        locations = handler.get_stats(top=top)["locations"]
+        assert [entry["events"] for entry in locations] == sorted(everything.values(), reverse=True)[:top]
+        assert all(everything[entry["location"]] == entry["events"] for entry in locations)
+        assert read and all(0 <= limit < 40 for limit in read)
+
+    # The merged aggregates are kept until the events change.
+    monkeypatch.undo()
+    stats = handler.get_stats(top=3)
+    for shard in handler.shards:
+        monkeypatch.setattr(shard, "get_stats", lambda *args, **kwargs: 1 / 0)
+    assert handler.get_stats(top=3) == stats
+    monkeypatch.undo()
+    add_event(handler, "Another", location=stats["locations"][0]["location"])
+    assert handler.get_stats(top=3)["locations"][0]["events"] == stats["locations"][0]["events"] + 1
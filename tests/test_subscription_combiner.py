@@ -0,0 +1,62 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+from common.server_handler import CombinedHandler
+from common.subscription_combiner import SubscriptionCombiner
+from core.event import UserAlreadySubscriber
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+def test_concurrent_subscriptions(temp_db_file):
+    handler = CombinedHandler(temp_db_file, temp_db_file)
+    host_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    event_id = handler.add_event(host_id, "event", "Hello", "Holon", [], datetime.now())
+    users_ids = [f"user{i}" for i in range(50)]
+    handler.users_handler.cursor.executemany("INSERT INTO users (user_id, user_name) VALUES (?, ?)",
+                                             [(user_id, user_id) for user_id in users_ids])
+    handler.users_handler.conn.commit()
+
+    combiner = SubscriptionCombiner(lambda: CombinedHandler(temp_db_file, temp_db_file))
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(lambda user_id: combiner.add_subscriber(event_id, user_id), users_ids))
+
+    event = handler.get_event(event_id)
+    assert sorted(event.subscribers) == sorted(users_ids + [host_id])
+    # Far fewer writes than subscriptions.
+    assert event.version < len(users_ids)
+
+    with pytest.raises(UserAlreadySubscriber):
+        combiner.add_subscriber(event_id, users_ids[0])
+    combiner.remove_subscriber(event_id, users_ids[0])
+    assert users_ids[0] not in handler.get_event(event_id).subscribers
+
+
+def test_single_subscription_is_applied_at_once(temp_db_file):
+    handler = CombinedHandler(temp_db_file, temp_db_file)
+    host_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    user_id = handler.add_user("Dana", "dana@gmail.com", "222")
+    event_id = handler.add_event(host_id, "event", "Hello", "Holon", [], datetime.now())
+    handlers = []
+
+    def handler_factory():
+        handlers.append(CombinedHandler(temp_db_file, temp_db_file))
+        return handlers[-1]
+
+    combiner = SubscriptionCombiner(handler_factory)
+    combiner.add_subscriber(event_id, user_id)
+    assert user_id in handler.get_event(event_id).subscribers
+    assert not combiner.pending and not combiner.flushing
+    combiner.remove_subscriber(event_id, user_id)
+    assert user_id not in handler.get_event(event_id).subscribers
+    # A handler for every update.
+    assert len(handlers) == 2
@@ -1,5 +1,6 @@
 import pytest
 from core.user import User, UserAlreadyExist, UserDoesNotExist, EventAlreadyInUser, EventDoesNotInUser
+from common.memory_handlers import MemoryUsersHandler
 from common.users_handler import UsersHandler
 import tempfile
 import os
@@ -12,9 +13,10 @@ def temp_db_file():
     os.close(fd)
 
 
-@pytest.fixture
-def users_handler(temp_db_file):
-    return UsersHandler(temp_db_file)
+@pytest.fixture(params=[UsersHandler, MemoryUsersHandler])
+def users_handler(request, temp_db_file):
+    yield request.param(temp_db_file)
+    MemoryUsersHandler.drop(temp_db_file)
 
 
 def test_add_user(users_handler):
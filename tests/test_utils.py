@@ -0,0 +1,27 @@
+import dataclasses
+import json
+from datetime import datetime
+
+from core.event import Event
+from core.user import User
+from core.utils import to_json_bytes
+
+
+def test_to_json_bytes():
+    now = datetime(2030, 1, 1, 10, 30)
+    event = Event(event_id="id", created_user_id="user1", event_name="Event1", event_description="Description",
+                  location="Holon", subscribers=["user1"], event_start_time=now, event_end_time=now,
+                  creation_time=None)
+    decoded = json.loads(to_json_bytes([event]))
+    assert decoded[0]["event_start_time"] == "2030-01-01T10:30:00"
+    assert decoded[0]["subscribers"] == ["user1"]
+    assert decoded[0]["creation_time"] is None
+
+
+def test_slotted_records():
+    user = User(user_id=None, user_name="Oron", user_mail="Oron@gmail.com", hashed_password="")
+    other_user = User(user_id=None, user_name="Oron", user_mail="Oron@gmail.com", hashed_password="")
+    assert not hasattr(user, "__dict__")
+    user.hosts_events.append("event1")
+    assert other_user.hosts_events == []
+    assert dataclasses.asdict(user)["hosts_events"] == ["event1"]
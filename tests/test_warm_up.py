@@ -0,0 +1,50 @@
+import pytest
+from datetime import datetime, timedelta
+import remind_me_api
+from common.server_handler import CombinedHandler
+import tempfile
+import os
+
+now = datetime.utcnow()
+
+
+@pytest.fixture
+def temp_db_file():
+    fd, path = tempfile.mkstemp()
+    yield path
+    os.close(fd)
+
+
+@pytest.fixture
+def response_cache(monkeypatch):
+    cache = remind_me_api.ResponseCache(max_entries=256)
+    monkeypatch.setattr(remind_me_api, "response_cache", cache)
+    yield cache
+
+
+@pytest.fixture
+def handler(temp_db_file):
+    handler = CombinedHandler(temp_db_file, temp_db_file)
+    host_id = handler.add_user("Oron", "oron@gmail.com", "111")
+    subscriber_id = handler.add_user("Dana", "dana@gmail.com", "111")
+    handler.add_event(host_id, "Past", "Description", "Holon", [], now - timedelta(days=1))
+    for index in range(5):
+        handler.add_event(host_id, f"Upcoming{index}", "Description", "Holon", [subscriber_id],
+                          now + timedelta(days=index + 1))
+    yield handler
+    handler.close()
+
+
+def test_warm_caches_renders_upcoming_events(handler, response_cache):
+    assert remind_me_api.warm_caches(handler, seconds=10, max_events=3, max_users=10) == 3 + 1
+
+    assert set(response_cache.entries) == {f"/get_event/Upcoming{index}/?" for index in range(3)}
+    etag, body = response_cache.entries["/get_event/Upcoming0/?"]
+    event_id, version = handler.get_event_version_by_name("Upcoming0")
+    assert etag == remind_me_api.event_etag(event_id, version, handler.get_versions()[1])
+    assert b'"Dana"' in body
+
+
+def test_warm_caches_budget(handler, response_cache):
+    assert remind_me_api.warm_caches(handler, seconds=0) == 0
+    assert not response_cache.entries